@@ -0,0 +1,59 @@
+"""Скорость рассылки уведомлений через Broadcaster на локальный фейковый Bot API.
+
+    python -m benchmarks.broadcast --members 10000 --global-rate 1000
+
+В Telegram общий лимит около 30 сообщений в секунду (BROADCAST_GLOBAL_RATE),
+здесь его можно поднять, чтобы измерить накладные расходы самой очереди.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from broadcast import Broadcaster
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+async def run(args) -> dict:
+    api = FakeBotAPI(latency=args.latency, flood_every=args.flood_every)
+    base = await api.start()
+    bot = Bot(TOKEN, server=TelegramAPIServer.from_base(base))
+    broadcaster = Broadcaster(bot, global_rate=args.global_rate, chat_rate=1,
+                              workers=args.workers, dedup_window=0)
+    started = time.perf_counter()
+    broadcaster.send(range(1, args.members + 1), "🔔 Новое ДЗ", parse_mode="HTML")
+    await broadcaster.join()
+    elapsed = time.perf_counter() - started
+    await broadcaster.close()
+    await (await bot.get_session()).close()
+    await api.stop()
+    return {
+        "members": args.members,
+        "global_rate": args.global_rate,
+        "workers": args.workers,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(broadcaster.sent / elapsed, 1),
+        "sent": broadcaster.sent,
+        "failed": broadcaster.failed,
+        "flood_responses": api.flooded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--global-rate", type=float, default=1000)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа API, сек")
+    parser.add_argument("--flood-every", type=int, default=0, help="каждый N-й запрос получает 429")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
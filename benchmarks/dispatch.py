@@ -0,0 +1,86 @@
+"""Выбор обработчика кнопки: цепочка lambda-фильтров против TextRouter.
+
+    python -m benchmarks.dispatch --buttons 10,100,1000 --updates 5000
+
+Для каждого числа кнопок строятся два диспетчера с пустыми обработчиками:
+в одном кнопки зарегистрированы как message_handler(lambda m: m.text == ...),
+в другом - через TextRouter. Замеряется время dp.process_updates на
+последнюю кнопку (худший случай для цепочки) и на текст, который не
+совпадает ни с одной кнопкой и уходит в обработчик состояния.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from routing import TextRouter
+
+
+def make_update(update_id: int, text: str) -> types.Update:
+    return types.Update(**{"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "User"},
+    }})
+
+
+def build(bot: Bot, buttons: int, routed: bool) -> Dispatcher:
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    router = TextRouter(dp) if routed else None
+
+    async def handler(message: types.Message):
+        pass
+
+    for number in range(buttons):
+        text = f"Кнопка {number}"
+        if routed:
+            router.add(handler, text)
+        else:
+            dp.register_message_handler(handler, lambda message, text=text: message.text == text)
+    # Обработчик без фильтра текста в конце, как свободный ввод в состоянии
+    dp.register_message_handler(handler)
+    return dp
+
+
+async def measure(dp: Dispatcher, text: str, updates: int) -> float:
+    batch = [make_update(number, text) for number in range(updates)]
+    started = time.perf_counter()
+    for update in batch:
+        await dp.process_updates([update])
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+async def run(buttons_list, updates: int) -> dict:
+    bot = Bot("123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+    Bot.set_current(bot)
+    results = {}
+    for buttons in buttons_list:
+        row = {}
+        for name, routed in (("lambda", False), ("router", True)):
+            dp = build(bot, buttons, routed)
+            Dispatcher.set_current(dp)
+            await measure(dp, "прогрев", 100)
+            row[f"{name}_last_button_us"] = round(await measure(dp, f"Кнопка {buttons - 1}", updates), 2)
+            row[f"{name}_free_text_us"] = round(await measure(dp, "свободный текст", updates), 2)
+        results[buttons] = row
+    await (await bot.get_session()).close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buttons", default="10,100,1000", help="числа кнопок через запятую")
+    parser.add_argument("--updates", type=int, default=5000, help="апдейтов на замер")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    buttons = [int(count) for count in args.buttons.split(",")]
+    print(json.dumps(asyncio.run(run(buttons, args.updates)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
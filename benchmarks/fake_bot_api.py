@@ -0,0 +1,83 @@
+"""Фейковый Telegram Bot API: локальный HTTP-сервер и Bot без сети"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """Принимает любые методы бота и отвечает успехом.
+
+    latency - задержка ответа в секундах; flood_every - каждый N-й запрос
+    получает 429 с retry_after (0 - без ошибок).
+    """
+
+    def __init__(self, latency: float = 0.0, flood_every: int = 0, retry_after: int = 1):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.delivered = 0
+        self.flooded = 0
+        self.calls = []
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        number = self.requests
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and number % self.flood_every == 0:
+            self.flooded += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        data = dict(await request.post())
+        method = request.match_info["method"]
+        self.calls.append((method, data))
+        self.delivered += 1
+        chat_id = int(data.get("chat_id", 0) or 0)
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class RecordingBot(Bot):
+    """Bot, который не ходит в сеть: запросы записываются в calls и сразу
+    получают успешный ответ. Нужен, когда замеряется сам бот, а не HTTP."""
+
+    def __init__(self, token: str, **kwargs):
+        super().__init__(token, **kwargs)
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        data = data or {}
+        self.calls.append((method, data))
+        if method == "answerCallbackQuery":
+            return True
+        chat_id = int(data.get("chat_id", 0) or 0)
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")}
@@ -0,0 +1,78 @@
+"""Пропускная способность записи и время старта JSON-хранилища.
+
+Сравнивает режим снимка (перезапись users.json) и режим журнала
+(дописывание journal.log):
+
+    python -m benchmarks.journal --users 5000 --ops 2000 --batch 1
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from database import Database
+
+
+def populate(data_dir: str, users: int, journal: bool) -> Database:
+    storage = Database(data_dir, flush_delay=3600, max_flush_delay=3600, journal=journal,
+                       compact_threshold=2 ** 62)
+    for user_id in range(users):
+        storage.create_user_profile(user_id, f"user{user_id}")
+    storage.compact() if journal else storage.flush()
+    return storage
+
+
+def bench_writes(users: int, ops: int, batch: int, journal: bool) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = populate(data_dir, users, journal)
+        started = time.perf_counter()
+        for i in range(ops):
+            storage.add_personal_homework(i % users, f"subject{i % 7}", f"homework {i}")
+            if (i + 1) % batch == 0:
+                storage.flush()
+        storage.flush()
+        elapsed = time.perf_counter() - started
+        storage.close()
+    return {"ops": ops, "seconds": round(elapsed, 4), "ops_per_sec": round(ops / elapsed, 1)}
+
+
+def bench_startup(users: int, ops: int) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = populate(data_dir, users, journal=True)
+        for i in range(ops):
+            storage.add_personal_homework(i % users, f"subject{i % 7}", f"homework {i}")
+        storage.flush()
+        storage.close()
+
+        started = time.perf_counter()
+        Database(data_dir, journal=True, compact_threshold=2 ** 62).close()
+        replay = time.perf_counter() - started
+
+        # Тот же объём данных, но уже свёрнутый в снимок
+        Database(data_dir, journal=False).close()
+        started = time.perf_counter()
+        Database(data_dir, journal=False).close()
+        snapshot = time.perf_counter() - started
+    return {"journal_entries": ops, "startup_with_replay_sec": round(replay, 4),
+            "startup_snapshot_only_sec": round(snapshot, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=1, help="операций на один flush (fsync)")
+    args = parser.parse_args()
+
+    result = {
+        "users": args.users,
+        "batch": args.batch,
+        "snapshot_writes": bench_writes(args.users, args.ops, args.batch, journal=False),
+        "journal_writes": bench_writes(args.users, args.ops, args.batch, journal=True),
+        "startup": bench_startup(args.users, args.ops),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
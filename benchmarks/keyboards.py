@@ -0,0 +1,46 @@
+"""Построение клавиатур на каждый вызов против кэша из keyboards.py.
+
+    python -m benchmarks.keyboards --calls 100000
+"""
+import argparse
+import json
+import timeit
+
+from aiogram.utils.payload import prepare_arg
+
+import keyboards
+
+CASES = [
+    ("main_keyboard", "Member"),
+    ("admin_keyboard", "Admin"),
+    ("class_keyboard", "староста"),
+    ("status_keyboard", "Staff"),
+    ("homework_keyboard", None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, arg in CASES:
+        build = getattr(keyboards, f"_build_{name}")
+        get = getattr(keyboards, f"get_{name}")
+        call_args = () if arg is None else (arg,)
+        built = timeit.timeit(lambda: build(*call_args), number=args.calls)
+        cached = timeit.timeit(lambda: get(*call_args), number=args.calls)
+        # Сериализация, которую aiogram выполняет при каждой отправке
+        serialized = timeit.timeit(lambda: prepare_arg(get(*call_args)), number=args.calls)
+        results[name] = {
+            "build_us": round(built / args.calls * 1e6, 3),
+            "cached_us": round(cached / args.calls * 1e6, 3),
+            "cached_and_serialized_us": round(serialized / args.calls * 1e6, 3),
+            "speedup": round(built / cached, 1),
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
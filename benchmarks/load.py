@@ -0,0 +1,233 @@
+"""Нагрузочный прогон настоящего диспетчера из bot.py без Telegram.
+
+    python -m benchmarks.load --backends json,sqlite --users 1000 --output load.json
+
+Апдейты - синтетические types.Update, ответы бота записывает RecordingBot
+вместо отправки. Сценарии:
+
+    registration    каждый пользователь регистрируется и открывает профиль
+    homework        весь класс смотрит ДЗ: всё сразу и по предмету
+    join_requests   пользователи подают заявки, староста принимает все разом
+
+Шаги одного пользователя идут по очереди, пользователи - параллельно (до
+--concurrency одновременно). Каждая пара (хранилище, сценарий) запускается
+в отдельном процессе на чистых данных, поэтому пиковый RSS относится
+только к ней. Результат - JSON с коммитом и параметрами запуска, который
+можно сравнивать между коммитами.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.webhook import percentiles
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+CLASS_ID = "load-class"
+HEAD_ID = 1
+FIRST_USER_ID = 1000
+SUBJECTS = {
+    "Алгебра": "Параграф 12, номера 3-7",
+    "Физика": "Лабораторная работа 4, оформить отчёт",
+    "История": "Конспект параграфа 9",
+    "Литература": "Прочитать «Капитанскую дочку», главы 1-5",
+}
+
+BACKENDS = {
+    "json": {"STORAGE_BACKEND": "json", "JSON_JOURNAL": "0"},
+    "json-journal": {"STORAGE_BACKEND": "json", "JSON_JOURNAL": "1"},
+    "sqlite": {"STORAGE_BACKEND": "sqlite"},
+}
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_update_ids), "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "chat_instance": "load", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+        "message": {"message_id": next(_update_ids), "date": int(time.time()), "text": "load",
+                    "chat": {"id": user_id, "type": "private"}},
+    }}
+
+
+# === Сценарии: подготовка данных и шаги пользователей ===
+async def setup_class(db, members: int, homework: bool):
+    await db.create_user_profile(HEAD_ID, "Староста")
+    await db.create_class(CLASS_ID, "10А", HEAD_ID)
+    if homework:
+        for subject, text in SUBJECTS.items():
+            await db.set_class_homework(CLASS_ID, subject, text, HEAD_ID)
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + members):
+        await db.create_user_profile(user_id, f"Ученик {user_id}")
+        if homework:
+            await db.add_member(CLASS_ID, user_id)
+
+
+async def registration(db, users: int):
+    scripts = [[message_update(user_id, "/start"), message_update(user_id, f"Ученик {user_id}"),
+                message_update(user_id, "👤 Мой профиль")]
+               for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)]
+    return scripts, []
+
+
+async def homework(db, users: int):
+    await setup_class(db, users, homework=True)
+    scripts = [[message_update(user_id, "📝 ДЗ класса"), message_update(user_id, "📚 Все предметы"),
+                message_update(user_id, "🔍 Конкретный предмет"), message_update(user_id, "алгебра")]
+               for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)]
+    return scripts, []
+
+
+async def join_requests(db, users: int):
+    await setup_class(db, users, homework=False)
+    scripts = [[message_update(user_id, "Вступить в класс"), message_update(user_id, CLASS_ID)]
+               for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)]
+    # После всех заявок староста открывает список и принимает всех
+    final = [message_update(HEAD_ID, "Заявки на вступление"), callback_update(HEAD_ID, "accept_all_requests")]
+    return scripts, final
+
+
+SCENARIOS = {"registration": registration, "homework": homework, "join_requests": join_requests}
+
+
+# === Прогон в дочернем процессе ===
+async def run_scenario(scenario: str, users: int, concurrency: int) -> dict:
+    from aiogram import Bot, Dispatcher, types
+    from benchmarks.fake_bot_api import RecordingBot
+
+    import bot as bot_module
+    from database import db
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = RecordingBot(TOKEN)
+    bot_module.dp.bot = bot_module.broadcaster.bot = fake
+    Bot.set_current(fake)
+    Dispatcher.set_current(bot_module.dp)
+
+    scripts, final = await SCENARIOS[scenario](db, users)
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(update: dict):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            # Как в webhook.py: своя задача на апдейт и middleware *_process_update
+            await asyncio.ensure_future(bot_module.dp.updates_handler.notify(types.Update(**update)))
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    async def play(script: list):
+        async with semaphore:
+            for update in script:
+                await feed(update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(script) for script in scripts))
+    await play(final)
+    elapsed = time.perf_counter() - started
+
+    stats = bot_module.storage_stats
+    await bot_module.broadcaster.close()
+    await db.close()
+    await bot_module.dp.storage.close()
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = round(peak_rss_kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return {
+        "updates": len(latencies),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(latencies) / elapsed, 1),
+        **percentiles(latencies),
+        "storage_calls_per_update": round(stats.calls_per_update, 2),
+        "api_calls": len(fake.calls),
+        "errors": errors,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+def run_child(backend: str, scenario: str, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as data_dir:
+        env = dict(os.environ, BOT_TOKEN=TOKEN, DATA_DIR=data_dir,
+                   SQLITE_PATH=os.path.join(data_dir, "bot.sqlite3"),
+                   FSM_PATH=os.path.join(data_dir, "fsm.sqlite3"),
+                   REMINDERS_PATH=os.path.join(data_dir, "reminders.sqlite3"),
+                   METRICS_PORT="0", SLOW_UPDATE_THRESHOLD="0", **BACKENDS[backend])
+        env.pop("WEBHOOK_URL", None)
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.load", "--child", scenario,
+             "--users", str(args.users), "--concurrency", str(args.concurrency)],
+            env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="json,sqlite", help=f"через запятую из {', '.join(BACKENDS)}")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument("--users", type=int, default=1000, help="пользователей в сценарии")
+    parser.add_argument("--concurrency", type=int, default=100, help="пользователей одновременно")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_scenario(args.child, args.users, args.concurrency))))
+        return
+
+    results = {}
+    for backend in args.backends.split(","):
+        for scenario in args.scenarios.split(","):
+            results.setdefault(backend, {})[scenario] = run_child(backend, scenario, args)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Планировщик напоминаний под нагрузкой: постановка, восстановление, срабатывание.
+
+    python -m benchmarks.reminders --pending 100000 --due 10000
+
+pending таймеров ставятся на далёкое будущее, due - на прошедшее время:
+замеряются постановка и запись в SQLite, восстановление после
+перезапуска, срабатывание просроченных и расход CPU, пока цикл ждёт.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from reminders import ReminderScheduler
+
+
+async def run(pending: int, due: int, idle: float) -> dict:
+    fired = 0
+
+    async def handler(payload):
+        nonlocal fired
+        fired += 1
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, "reminders.sqlite3")
+        scheduler = ReminderScheduler(handler, path)
+        await scheduler.start()
+        now = time.time()
+        started = time.perf_counter()
+        for number in range(pending):
+            scheduler.schedule(f"pending:{number}", now + 86400 + number, {"n": number})
+        schedule_s = time.perf_counter() - started
+        started = time.perf_counter()
+        await scheduler.flush()
+        flush_s = time.perf_counter() - started
+
+        cpu = time.process_time()
+        await asyncio.sleep(idle)
+        idle_cpu_ms = (time.process_time() - cpu) * 1000
+        await scheduler.close()
+
+        scheduler = ReminderScheduler(handler, path)
+        started = time.perf_counter()
+        await scheduler.start()
+        restore_s = time.perf_counter() - started
+        restored = len(scheduler)
+
+        started = time.perf_counter()
+        for number in range(due):
+            scheduler.schedule(f"due:{number}", now - number, {"n": number})
+        while fired < due:
+            await asyncio.sleep(0.01)
+        fire_s = time.perf_counter() - started
+        await scheduler.close()
+
+    return {
+        "pending": pending,
+        "schedule_per_sec": round(pending / schedule_s),
+        "flush_s": round(flush_s, 3),
+        "idle_cpu_ms_per_s": round(idle_cpu_ms / idle, 2),
+        "restored": restored,
+        "restore_s": round(restore_s, 3),
+        "fired": fired,
+        "fire_per_sec": round(due / fire_s),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pending", type=int, default=100000)
+    parser.add_argument("--due", type=int, default=10000)
+    parser.add_argument("--idle", type=float, default=2.0, help="сколько секунд ждать с полной очередью")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.pending, args.due, args.idle)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
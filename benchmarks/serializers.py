@@ -0,0 +1,77 @@
+"""Время сохранения/загрузки и размер файлов JSON-хранилища в разных форматах.
+
+    python -m benchmarks.serializers --users 1000,10000,100000
+
+Таблица пользователей сериализуется целиком, как при сбросе users.json.
+Форматы без установленных пакетов (orjson, msgpack) пропускаются.
+"""
+import argparse
+import json
+import time
+
+import serializers
+from database import BaseDatabase
+
+# (название, формат, отступ, чем читать)
+VARIANTS = [
+    ("json indent=2", "json", 2, lambda raw: json.loads(raw.decode("utf-8"))),
+    ("json", "json", None, lambda raw: json.loads(raw.decode("utf-8"))),
+    ("orjson", "orjson", None, serializers.loads),
+    ("msgpack", "msgpack", None, serializers.loads),
+]
+
+
+def make_users(count: int) -> dict:
+    users = {}
+    for user_id in range(1, count + 1):
+        user = BaseDatabase._new_user(user_id, f"Ученик {user_id}")
+        user["profile"].update(phone=f"+7900{user_id:07d}", email=f"user{user_id}@school.ru")
+        user["class_id"] = f"class{user_id // 30}"
+        user["teamRole"] = "участник"
+        user["personal_homework"] = {"Математика": f"№ {user_id % 500}, стр. 42", "Физика": "параграф 12"}
+        user["settings"] = {"homework_notifications": user_id % 2 == 0}
+        users[str(user_id)] = user
+    return users
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(counts, repeat: int) -> list:
+    results = []
+    for count in counts:
+        users = make_users(count)
+        for name, storage_format, indent, load in VARIANTS:
+            try:
+                serializer = serializers.get_serializer(storage_format, indent)
+            except RuntimeError:
+                continue
+            raw = serializer.dumps(users)
+            assert load(raw) == users
+            results.append({
+                "users": count,
+                "format": name,
+                "size_kb": round(len(raw) / 1024, 1),
+                "dump_ms": round(best_of(repeat, lambda: serializer.dumps(users)) * 1000, 2),
+                "load_ms": round(best_of(repeat, lambda: load(raw)) * 1000, 2),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="1000,10000,100000", help="размеры таблицы через запятую")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    counts = [int(count) for count in args.users.split(",")]
+    print(json.dumps(run(counts, args.repeat), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Пропускная способность и задержки обработки апдейтов: webhook против polling.
+
+    python -m benchmarks.webhook --chats 500 --messages 10 --workers 100
+
+Апдейты обрабатывает настоящий диспетчер из bot.py, ответы уходят на
+локальный фейковый Bot API. В режиме webhook апдейты отправляются POST-запросами
+на WebhookServer (до --connections одновременно, как у Telegram), в режиме
+polling - пачками по 100 в dp.process_updates, как это делает start_polling.
+Задержка - время от получения апдейта ботом до конца его обработки.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_updates(chats: int, messages: int) -> list:
+    """Сценарий каждого чата: регистрация, затем просмотр профиля"""
+    script = ["/start", "Ученик", "👤 Мой профиль", "/start", "🏫 Класс"]
+    updates = []
+    for step in range(messages):
+        text = script[step] if step < len(script) else script[2 + step % (len(script) - 2)]
+        for chat_id in range(1, chats + 1):
+            message = {
+                "message_id": step + 1, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+            }
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+            updates.append({"update_id": len(updates) + 1, "message": message})
+    return updates
+
+
+def percentiles(latencies) -> dict:
+    latencies = sorted(latencies)
+    cuts = statistics.quantiles(latencies, n=100)
+    return {"p50_ms": round(cuts[49] * 1000, 2), "p95_ms": round(cuts[94] * 1000, 2),
+            "p99_ms": round(cuts[98] * 1000, 2)}
+
+
+def post_updates(url: str, updates: list, connections: int):
+    import aiohttp
+
+    async def sender(session, queue):
+        while not queue.empty():
+            async with session.post(url, json=queue.get_nowait()) as response:
+                assert response.status == 200, response.status
+
+    async def send_all():
+        queue = asyncio.Queue()
+        for data in updates:
+            queue.put_nowait(data)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)) as session:
+            await asyncio.gather(*(sender(session, queue) for _ in range(connections)))
+
+    asyncio.run(send_all())
+
+
+async def run_polling(dp, updates: list) -> dict:
+    from aiogram import types
+
+    latencies = []
+    started = time.perf_counter()
+    for offset in range(0, len(updates), 100):
+        batch = [types.Update(**data) for data in updates[offset:offset + 100]]
+        received = time.perf_counter()
+        await dp.process_updates(batch)
+        latencies.extend([time.perf_counter() - received] * len(batch))
+    elapsed = time.perf_counter() - started
+    return {"seconds": round(elapsed, 3), "updates_per_sec": round(len(updates) / elapsed, 1),
+            **percentiles(latencies)}
+
+
+async def run_webhook(dp, updates: list, args) -> dict:
+    from aiohttp import web
+    from webhook import WebhookServer
+
+    server = WebhookServer(dp, workers=args.workers, max_pending=args.max_pending,
+                           backpressure="wait", secret=None)
+    await server.start()
+    runner = web.AppRunner(server.make_app("/webhook"), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+
+    # Апдейты шлёт отдельный процесс, как Telegram, и не отнимает CPU у бота
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        await loop.run_in_executor(pool, post_updates, url, updates, args.connections)
+    while server.processed < len(updates):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    await server.stop()
+    await runner.cleanup()
+    return {"seconds": round(elapsed, 3), "updates_per_sec": round(len(updates) / elapsed, 1),
+            **percentiles(server.latencies)}
+
+
+async def run(args) -> dict:
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+    from benchmarks.fake_bot_api import FakeBotAPI
+
+    import bot as bot_module
+    from database import db
+
+    logging.getLogger().setLevel(logging.WARNING)
+    api = FakeBotAPI(latency=args.latency)
+    base = await api.start()
+    bot_module.bot.server = TelegramAPIServer.from_base(base)
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+
+    updates = make_updates(args.chats, args.messages)
+    if args.mode == "polling":
+        result = await run_polling(bot_module.dp, updates)
+    else:
+        result = await run_webhook(bot_module.dp, updates, args)
+
+    await db.close()
+    await bot_module.dp.storage.close()
+    await (await bot_module.bot.get_session()).close()
+    await api.stop()
+    return {"mode": args.mode, "updates": len(updates), "chats": args.chats,
+            "api_requests": api.requests, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=10, help="апдейтов на чат")
+    parser.add_argument("--workers", type=int, default=100)
+    parser.add_argument("--max-pending", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=40, help="одновременных POST-запросов")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа API, сек")
+    args = parser.parse_args()
+
+    # Бот работает на временных данных и не трогает data/
+    data_dir = tempfile.mkdtemp(prefix="bench-webhook-")
+    os.environ.setdefault("BOT_TOKEN", "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["SQLITE_PATH"] = os.path.join(data_dir, "bot.sqlite3")
+    os.environ["FSM_PATH"] = os.path.join(data_dir, "fsm.sqlite3")
+    os.environ.pop("WEBHOOK_URL", None)
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
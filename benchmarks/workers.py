@@ -0,0 +1,216 @@
+"""Масштабирование по процессам: supervisor и 1..8 процессов-обработчиков.
+
+    python -m benchmarks.workers --workers 1,2,4,8 --users 400 --output workers.json
+
+Для каждого числа процессов на чистой SQLite-базе запускаются настоящие
+Supervisor и Ingress из workers.py, процессы webhook.py ходят в фейковый
+Bot API в отдельном процессе. Нагрузка - рендеринг: у каждого ученика
+--subjects предметов личного ДЗ и ДЗ класса по --words слов, сценарий
+пользователя по кругу смотрит «📚 Моё ДЗ», ищет предмет с опечаткой и
+ищет по ДЗ (/search). Обработанные апдейты считаются по метрике
+bot_update_seconds_count на /metrics каждого процесса.
+
+Линейный рост возможен, только если ядер хватает на все процессы
+обработчиков, supervisor, фейковый Bot API и генератор нагрузки
+(в результате есть cpu_count).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.load import git_commit, message_update
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+FIRST_USER_ID = 1000
+CLASS_SIZE = 25
+SUBJECTS = ["Алгебра", "Геометрия", "Физика", "Химия", "Биология", "История", "Обществознание",
+            "Литература", "Русский язык", "Английский язык", "География", "Информатика"]
+WORDS = ("прочитать параграф решить номера выучить определения подготовить доклад повторить "
+         "конспект лабораторная работа оформить отчёт задачи упражнение страница").split()
+_COUNT = re.compile(r"^bot_update_seconds_count (\d+)", re.M)
+
+
+def subject_names(count: int):
+    return [SUBJECTS[number % len(SUBJECTS)] + ("" if number < len(SUBJECTS) else f" {number // len(SUBJECTS) + 1}")
+            for number in range(count)]
+
+
+def homework_text(number: int, words: int) -> str:
+    return " ".join(WORDS[(number + offset) % len(WORDS)] for offset in range(words)) + f" {number}"
+
+
+def populate(path: str, users: int, subjects: int, words: int):
+    from database import SQLiteDatabase
+
+    storage = SQLiteDatabase(path)
+    names = subject_names(subjects)
+    due = "2099-05-20T08:00:00"
+    for start in range(FIRST_USER_ID, FIRST_USER_ID + users, CLASS_SIZE):
+        class_id = f"class-{start}"
+        storage.create_user_profile(start, f"Ученик {start}")
+        storage.create_class(class_id, f"Класс {start}", start)
+        storage.update_class_homework(class_id, {name: homework_text(number, words) for number, name in enumerate(names)})
+        roster = [(user_id, f"Ученик {user_id}", "участник")
+                  for user_id in range(start, min(start + CLASS_SIZE, FIRST_USER_ID + users))]
+        storage.import_members(class_id, roster)
+        for user_id, _, _ in roster:
+            for number, name in enumerate(names):
+                storage.add_personal_homework(user_id, name, homework_text(user_id + number, words), due=due)
+    storage.close()
+
+
+def user_script(user_id: int, rounds: int, subjects: int):
+    names = subject_names(subjects)
+    script = []
+    for number in range(rounds):
+        subject = names[(user_id + number) % len(names)]
+        script += [message_update(user_id, "📚 Моё ДЗ"),
+                   message_update(user_id, "🔍 Конкретный предмет"),
+                   # Опечатка: предмет находится нечётким сравнением
+                   message_update(user_id, subject[:-1].lower() + "ь"),
+                   message_update(user_id, f"/search {WORDS[number % len(WORDS)]} {WORDS[user_id % len(WORDS)]}")]
+    return script
+
+
+async def processed(session, metrics_ports) -> int:
+    total = 0
+    for port in metrics_ports:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            match = _COUNT.search(await response.text())
+            total += int(match.group(1)) if match else 0
+    return total
+
+
+async def wait_processed(session, metrics_ports, expected: int, timeout: float = 600):
+    deadline = time.perf_counter() + timeout
+    while await processed(session, metrics_ports) < expected:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"Workers did not process {expected} updates in {timeout}s")
+        await asyncio.sleep(0.02)
+
+
+async def run_workers(workers: int, args, api_url: str) -> dict:
+    import aiohttp
+    from workers import Ingress, Supervisor
+
+    with tempfile.TemporaryDirectory(prefix="bench-workers-") as data_dir:
+        sqlite_path = os.path.join(data_dir, "bot.sqlite3")
+        populate(sqlite_path, args.users, args.subjects, args.words)
+        supervisor = Supervisor(workers, args.base_port, env={
+            "BOT_TOKEN": TOKEN, "DATA_DIR": data_dir, "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": sqlite_path,
+            "FSM_STORAGE": "sqlite", "FSM_PATH": os.path.join(data_dir, "fsm.sqlite3"),
+            "REMINDERS_PATH": os.path.join(data_dir, "reminders.sqlite3"),
+            "TELEGRAM_API_SERVER": api_url, "METRICS_PORT": str(args.metrics_port), "SLOW_UPDATE_THRESHOLD": "0",
+        })
+        ingress = Ingress(supervisor.urls, supervisor.secret)
+        metrics_ports = [args.metrics_port + index for index in range(workers)]
+        await supervisor.start()
+        await ingress.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                # Прогрев: первый запрос каждого процесса не попадает в замер
+                owners = {}
+                for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users):
+                    owners.setdefault(ingress.ring.node(user_id), user_id)
+                for user_id in owners.values():
+                    await ingress.forward(message_update(user_id, "/search прогрев"))
+                await wait_processed(session, metrics_ports, len(owners))
+
+                scripts = [user_script(user_id, args.rounds, args.subjects)
+                           for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users)]
+                total = sum(len(script) for script in scripts)
+
+                async def play(script):
+                    for update in script:
+                        await ingress.forward(update)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(play(script) for script in scripts))
+                await wait_processed(session, metrics_ports, len(owners) + total)
+                elapsed = time.perf_counter() - started
+        finally:
+            await ingress.close()
+            await supervisor.stop()
+    return {
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total / elapsed, 1),
+        "per_worker": ingress.forwarded,
+        "failed": ingress.failed,
+        "restarts": supervisor.restarts,
+    }
+
+
+async def serve_fake_api(port: int):
+    from benchmarks.fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    await api.start(port=port)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8", help="числа процессов через запятую")
+    parser.add_argument("--users", type=int, default=400, help="учеников (по 25 в классе)")
+    parser.add_argument("--rounds", type=int, default=3, help="повторов сценария на ученика")
+    parser.add_argument("--subjects", type=int, default=24, help="предметов в ДЗ")
+    parser.add_argument("--words", type=int, default=40, help="слов в тексте ДЗ по предмету")
+    parser.add_argument("--base-port", type=int, default=8200, help="порт первого процесса")
+    parser.add_argument("--metrics-port", type=int, default=8300, help="порт /metrics первого процесса")
+    parser.add_argument("--api-port", type=int, default=8399, help="порт фейкового Bot API")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--fake-api", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fake_api:
+        asyncio.run(serve_fake_api(args.api_port))
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    # database.py создаёт хранилище по умолчанию при импорте - не в рабочем data/
+    scratch = tempfile.mkdtemp(prefix="bench-workers-")
+    os.environ.update(BOT_TOKEN=TOKEN, DATA_DIR=scratch, STORAGE_BACKEND="sqlite",
+                      SQLITE_PATH=os.path.join(scratch, "bot.sqlite3"))
+    api = subprocess.Popen([sys.executable, "-m", "benchmarks.workers", "--fake-api", "--api-port", str(args.api_port)])
+    results = {}
+    try:
+        time.sleep(1)
+        for workers in (int(count) for count in args.workers.split(",")):
+            results[workers] = asyncio.run(run_workers(workers, args, f"http://127.0.0.1:{args.api_port}"))
+    finally:
+        api.terminate()
+        api.wait()
+    # Ускорение относительно наименьшего числа процессов, эффективность - на процесс
+    first = min(results)
+    for workers, row in results.items():
+        row["speedup"] = round(row["updates_per_sec"] / results[first]["updates_per_sec"], 2)
+        row["efficiency"] = round(row["speedup"] * first / workers, 2)
+    report = {
+        "commit": git_commit(),
+        "cpu_count": os.cpu_count(),
+        "users": args.users,
+        "rounds": args.rounds,
+        "subjects": args.subjects,
+        "words": args.words,
+        "results": results,
+    }
+    if (os.cpu_count() or 1) < max(results) + 3:
+        print(f"Warning: {os.cpu_count()} CPUs for {max(results)} workers, supervisor, fake API and load "
+              "generator - scaling is limited by the machine", file=sys.stderr)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,49 @@
+import io
 import logging
+from datetime import datetime
+from typing import Optional, Tuple
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Command
 
-from config import BOT_TOKEN, ADMIN_IDS, OWNER_ID, PROJECT_STATUSES, TEAM_ROLES
+from config import (BOT_TOKEN, ADMIN_IDS, OWNER_ID, PROJECT_STATUSES, TEAM_ROLES, FSM_STORAGE, WEBHOOK_URL,
+                    METRICS_PORT, BROADCAST_GLOBAL_RATE, WORKERS, WORKER_INDEX, TELEGRAM_API_SERVER)
 from database import db
+from fsm_storage import SQLiteStorage
+from broadcast import Broadcaster
+from reminders import HomeworkReminders
+from routing import TextRouter
+from search import match_subject
 from states import *
 from keyboards import *
 from utils import *
+from metrics import InstrumentedBot, MetricsServer
+from middlewares import UserContextMiddleware, StorageStatsMiddleware, MetricsMiddleware, ActivityMiddleware
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+bot = InstrumentedBot(token=BOT_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)
+                      if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION)
+storage = SQLiteStorage() if FSM_STORAGE == "sqlite" else MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
+# Создаётся до остальных обработчиков, чтобы кнопки проверялись первыми
+router = TextRouter(dp)
+# Лимит Telegram общий на бота, процессы-обработчики делят его поровну
+broadcaster = Broadcaster(bot, global_rate=BROADCAST_GLOBAL_RATE / WORKERS)
+reminders = HomeworkReminders(broadcaster)
+metrics_server = MetricsServer(port=METRICS_PORT + WORKER_INDEX) if METRICS_PORT else None
+storage_stats = StorageStatsMiddleware()
+dp.middleware.setup(MetricsMiddleware())
+dp.middleware.setup(storage_stats)
+dp.middleware.setup(ActivityMiddleware())
+dp.middleware.setup(UserContextMiddleware())
 
 # ========== COMMON HANDLERS ==========
 @dp.message_handler(commands=['start'])
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user:
         await message.answer("👋 Добро пожаловать! Для начала создайте свой профиль.\nВведите ваше имя:")
@@ -37,11 +60,11 @@ async def process_name(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Создаем профиль с минимальными данными
-    db.create_user_profile(user_id, name)
+    await db.create_user_profile(user_id, name)
     
     # Устанавливаем статус Owner для указанного пользователя
     if user_id == OWNER_ID:
-        db.update_user_status(user_id, "Owner")
+        await db.update_user_status(user_id, "Owner")
     
     await state.finish()
     await message.answer(
@@ -50,29 +73,27 @@ async def process_name(message: types.Message, state: FSMContext):
         reply_markup=get_main_keyboard("Member")
     )
 
-@dp.message_handler(lambda message: message.text == "⬅️ Назад")
-async def cmd_back(message: types.Message):
+@router.text("⬅️ Назад")
+async def cmd_back(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     status = user.get("projectStatus", "Member") if user else "Member"
     await message.answer("Главное меню:", reply_markup=get_main_keyboard(status))
 
-@dp.message_handler(lambda message: message.text == "👤 Мой профиль")
-async def cmd_profile(message: types.Message):
+@router.text("👤 Мой профиль")
+async def cmd_profile(message: types.Message, user: dict = None, class_data: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user:
         await message.answer("Профиль не найден. Начните с /start")
         return
     
     await message.answer(
-        format_user_profile(user),
+        await format_user_profile(user, class_data),
         parse_mode="HTML",
         reply_markup=get_profile_keyboard()
     )
 
-@dp.message_handler(lambda message: message.text == "✏️ Редактировать профиль")
+@router.text("✏️ Редактировать профиль")
 async def cmd_edit_profile_start(message: types.Message):
     await message.answer("Выберите поле для редактирования:", reply_markup=get_edit_profile_keyboard())
     await EditProfileStates.waiting_for_field.set()
@@ -88,7 +109,7 @@ async def process_edit_field(message: types.Message, state: FSMContext):
     
     if message.text == "⬅️ Назад":
         await state.finish()
-        user = db.get_user(message.from_user.id)
+        user = await db.get_user(message.from_user.id)
         status = user.get("projectStatus", "Member") if user else "Member"
         await message.answer("Главное меню:", reply_markup=get_main_keyboard(status))
         return
@@ -102,22 +123,23 @@ async def process_edit_field(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, выберите поле из клавиатуры:")
 
 @dp.message_handler(state=EditProfileStates.waiting_for_value)
-async def process_edit_value(message: types.Message, state: FSMContext):
+async def process_edit_value(message: types.Message, state: FSMContext, user: dict = None, class_data: dict = None):
     user_data = await state.get_data()
     field = user_data.get('field')
     
     if field:
-        db.update_user_profile(message.from_user.id, {field: message.text})
+        await db.update_user_profile(message.from_user.id, {field: message.text})
+        if user:
+            user["profile"][field] = message.text
         await message.answer("✅ Профиль обновлен!")
     
     await state.finish()
-    await cmd_profile(message)
+    await cmd_profile(message, user, class_data)
 
 # ========== CLASS HANDLERS ==========
-@dp.message_handler(lambda message: message.text == "🏫 Класс")
-async def cmd_class(message: types.Message):
+@router.text("🏫 Класс")
+async def cmd_class(message: types.Message, user: dict = None, class_data: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user:
         await message.answer("Профиль не найден")
@@ -127,7 +149,6 @@ async def cmd_class(message: types.Message):
     team_role = user.get("teamRole")
     
     if class_id:
-        class_data = db.get_class(class_id)
         if class_data:
             text = f"🏫 <b>Класс:</b> {class_data['name']}\n"
             text += f"👥 <b>Участников:</b> {len(class_data['members'])}\n"
@@ -136,24 +157,23 @@ async def cmd_class(message: types.Message):
     
     await message.answer("Выберите действие:", reply_markup=get_class_keyboard(team_role))
 
-@dp.message_handler(lambda message: message.text == "Вступить в класс")
+@router.text("Вступить в класс")
 async def cmd_join_class_start(message: types.Message):
     await message.answer("Введите ID класса для вступления:")
     await ClassStates.waiting_for_class_id.set()
 
 @dp.message_handler(state=ClassStates.waiting_for_class_id)
-async def process_join_class(message: types.Message, state: FSMContext):
+async def process_join_class(message: types.Message, state: FSMContext, user: dict = None):
     class_id = message.text
     user_id = message.from_user.id
     
-    class_data = db.get_class(class_id)
+    class_data = await db.get_class(class_id)
     if not class_data:
         await message.answer("❌ Класс не найден")
         await state.finish()
         return
     
     # Проверяем, состоит ли уже в классе
-    user = db.get_user(user_id)
     if user.get("class_id"):
         await message.answer("❌ Вы уже состоите в классе")
         await state.finish()
@@ -161,21 +181,22 @@ async def process_join_class(message: types.Message, state: FSMContext):
     
     # Staff, Admin, Owner могут вступать без запроса
     if user.get("projectStatus") in ["Staff", "Admin", "Owner"]:
-        db.update_user_class(user_id, class_id, "участник")
-        class_data["members"].append(user_id)
-        db.save_class(class_id, class_data)
+        await db.add_member(class_id, user_id)
+        user.update(class_id=class_id, teamRole="участник")
+        if user_id not in class_data["members"]:
+            class_data["members"].append(user_id)
         await message.answer(f"✅ Вы вступили в класс '{class_data['name']}'")
     else:
-        db.add_join_request(class_id, user_id)
+        await db.add_join_request(class_id, user_id)
         await message.answer(f"✅ Заявка на вступление в класс '{class_data['name']}' отправлена")
+        class_data = None
     
     await state.finish()
-    await cmd_class(message)
+    await cmd_class(message, user, class_data)
 
-@dp.message_handler(lambda message: message.text == "Покинуть класс")
-async def cmd_leave_class(message: types.Message):
+@router.text("Покинуть класс")
+async def cmd_leave_class(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
@@ -186,27 +207,20 @@ async def cmd_leave_class(message: types.Message):
         await message.answer("❌ Вы не можете покинуть класс из-за вашего статуса")
         return
     
-    class_id = user["class_id"]
-    class_data = db.get_class(class_id)
-    
-    if class_data and user_id in class_data["members"]:
-        class_data["members"].remove(user_id)
-        db.save_class(class_id, class_data)
-    
-    db.update_user_class(user_id, None)
+    if not await db.remove_member(user["class_id"], user_id):
+        await db.update_user_class(user_id, None)
     await message.answer("✅ Вы покинули класс")
 
-@dp.message_handler(lambda message: message.text == "Управление классом")
-async def cmd_manage_class(message: types.Message):
+@router.text("Управление классом")
+async def cmd_manage_class(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
         return
     
     # Проверяем права на управление классом
-    if not can_edit_class(user_id, user["class_id"]):
+    if not await can_edit_class(user_id, user["class_id"], user):
         await message.answer("❌ У вас нет прав для управления классом")
         return
     
@@ -216,10 +230,9 @@ async def cmd_manage_class(message: types.Message):
     )
 
 # ========== HOMEWORK HANDLERS ==========
-@dp.message_handler(lambda message: message.text == "📝 ДЗ класса")
-async def cmd_class_homework_menu(message: types.Message):
+@router.text("📝 ДЗ класса")
+async def cmd_class_homework_menu(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
@@ -227,56 +240,105 @@ async def cmd_class_homework_menu(message: types.Message):
     
     await message.answer("Просмотр ДЗ:", reply_markup=get_homework_keyboard())
 
-@dp.message_handler(lambda message: message.text == "📚 Все предметы")
-async def cmd_all_homework(message: types.Message):
+@router.text("📚 Все предметы")
+async def cmd_all_homework(message: types.Message, user: dict = None, class_data: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
         return
     
-    class_data = db.get_class(user["class_id"])
     if class_data:
         homework = class_data.get("homework", {})
         if homework:
             text = f"📚 <b>ДЗ класса '{class_data['name']}':</b>\n\n"
-            text += format_homework(homework)
+            text += render_class_homework(class_data)
         else:
             text = "📭 ДЗ не задано"
         
         await message.answer(text, parse_mode="HTML")
 
-@dp.message_handler(lambda message: message.text == "🔍 Конкретный предмет")
-async def cmd_specific_homework_start(message: types.Message):
+@router.text("🔍 Конкретный предмет")
+async def cmd_specific_homework_start(message: types.Message, user: dict = None, class_data: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
         return
     
-    class_data = db.get_class(user["class_id"])
     if class_data:
         subjects = list(class_data.get("homework", {}).keys())
         if subjects:
             text = "Доступные предметы:\n" + "\n".join([f"• {subj}" for subj in subjects])
             text += "\n\nВведите название предмета:"
+            await HomeworkStates.waiting_for_view_subject.set()
         else:
             text = "❌ Нет заданных предметов"
         
         await message.answer(text)
 
-@dp.message_handler(lambda message: message.text == "Изменить ДЗ")
-async def cmd_edit_homework_start(message: types.Message):
+@dp.message_handler(state=HomeworkStates.waiting_for_view_subject)
+async def process_view_subject(message: types.Message, state: FSMContext, class_data: dict = None):
+    if message.text == "⬅️ Назад" or not class_data:
+        await state.finish()
+        await message.answer("Просмотр ДЗ:", reply_markup=get_homework_keyboard())
+        return
+    
+    homework = class_data.get("homework", {})
+    # Название сверяется с опечатками: «алгебр» и «алгебар» найдут «Алгебра»
+    subject = match_subject(message.text, homework)
+    if subject is None:
+        await message.answer("❌ Предмет не найден, введите название ещё раз или нажмите «⬅️ Назад»")
+        return
+    
+    await state.finish()
+    await message.answer(format_homework({subject: homework[subject]}, class_data.get("homework_meta")),
+                         parse_mode="HTML")
+
+async def answer_search(message: types.Message, query: str, user: dict):
+    results = await db.search_homework(query, class_id=user.get("class_id"), user_id=message.from_user.id)
+    await message.answer(format_search_results(results), parse_mode="HTML")
+
+@router.text("🔎 Поиск по ДЗ")
+async def cmd_search_homework_start(message: types.Message, user: dict = None):
+    if not user:
+        await message.answer("Профиль не найден. Начните с /start")
+        return
+    
+    await message.answer("Введите слова для поиска по ДЗ класса и личному ДЗ:")
+    await HomeworkStates.waiting_for_search_query.set()
+
+@dp.message_handler(state=HomeworkStates.waiting_for_search_query)
+async def process_search_query(message: types.Message, state: FSMContext, user: dict = None):
+    await state.finish()
+    if message.text == "⬅️ Назад" or not user:
+        await message.answer("Просмотр ДЗ:", reply_markup=get_homework_keyboard())
+        return
+    
+    await answer_search(message, message.text, user)
+
+@dp.message_handler(commands=['search'])
+async def cmd_search_homework(message: types.Message, user: dict = None):
+    if not user:
+        await message.answer("Профиль не найден. Начните с /start")
+        return
+    
+    query = message.get_args()
+    if not query:
+        await message.answer("Использование: /search <слова>, например /search параграф 12")
+        return
+    
+    await answer_search(message, query, user)
+
+@router.text("Изменить ДЗ")
+async def cmd_edit_homework_start(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
         return
     
-    if not can_edit_class(user_id, user["class_id"]):
+    if not await can_edit_class(user_id, user["class_id"], user):
         await message.answer("❌ У вас нет прав для изменения ДЗ")
         return
     
@@ -284,18 +346,16 @@ async def cmd_edit_homework_start(message: types.Message):
     await HomeworkStates.waiting_for_subject_choice.set()
 
 @dp.message_handler(state=HomeworkStates.waiting_for_subject_choice)
-async def process_homework_choice(message: types.Message, state: FSMContext):
+async def process_homework_choice(message: types.Message, state: FSMContext,
+                                  user: dict = None, class_data: dict = None):
     if message.text == "⬅️ Назад":
         await state.finish()
-        user = db.get_user(message.from_user.id)
         if user and user.get("teamRole"):
             await message.answer("Управление классом:", reply_markup=get_class_management_keyboard(user["teamRole"]))
         return
     
     if message.text == "Выбрать из списка":
-        user = db.get_user(message.from_user.id)
-        class_data = db.get_class(user["class_id"])
-        subjects = list(class_data.get("homework", {}).keys())
+        subjects = list(class_data.get("homework", {}).keys()) if class_data else []
         
         if subjects:
             text = "Выберите предмет из списка:\n" + "\n".join([f"• {subj}" for subj in subjects])
@@ -317,18 +377,40 @@ async def process_subject_name(message: types.Message, state: FSMContext):
     await message.answer(f"Введите ДЗ для предмета '{subject}':")
     await HomeworkStates.waiting_for_homework_text.set()
 
-@dp.message_handler(state=HomeworkStates.waiting_for_homework_text)
-async def process_homework_text(message: types.Message, state: FSMContext):
-    homework = message.text
+# ДЗ можно прислать фото или файлом с подписью
+HOMEWORK_CONTENT_TYPES = [types.ContentType.TEXT, types.ContentType.PHOTO, types.ContentType.DOCUMENT]
+
+def message_attachments(message: types.Message) -> list:
+    """Описания вложений сообщения с ДЗ (сами файлы остаются в Telegram)"""
+    if message.photo:
+        return [{"type": "photo", "file_id": message.photo[-1].file_id}]
+    if message.document:
+        return [{"type": "document", "file_id": message.document.file_id, "name": message.document.file_name}]
+    return []
+
+async def ask_due_date(message: types.Message):
+    await message.answer("Укажите срок сдачи (ДД.ММ или ДД.ММ ЧЧ:ММ):", reply_markup=get_due_date_keyboard())
+
+async def read_due_date(message: types.Message) -> Tuple[bool, str]:
+    """Срок из ответа пользователя: (принят ли ответ, срок в isoformat или None)"""
+    if message.text == "Без срока":
+        return True, None
+    due = parse_due_date(message.text or "")
+    if due is None or due <= datetime.now():
+        await message.answer("❌ Укажите будущую дату, например 25.10 или 25.10 14:30")
+        return False, None
+    return True, due.isoformat()
+
+@dp.message_handler(content_types=HOMEWORK_CONTENT_TYPES, state=HomeworkStates.waiting_for_homework_text)
+async def process_homework_text(message: types.Message, state: FSMContext,
+                                user: dict = None, class_data: dict = None):
+    homework = message.text or message.caption or ""
     user_data = await state.get_data()
-    user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await state.finish()
         return
     
-    class_data = db.get_class(user["class_id"])
     if not class_data:
         await state.finish()
         return
@@ -346,19 +428,128 @@ async def process_homework_text(message: types.Message, state: FSMContext):
     if not subject:
         subject = message.text  # Если предмет еще не задан
     
-    # Обновляем ДЗ
-    homework_dict = class_data.get("homework", {})
-    homework_dict[subject] = homework
-    db.update_class_homework(user["class_id"], homework_dict)
+    await state.update_data(subject=subject, homework=homework, attachments=message_attachments(message))
+    await ask_due_date(message)
+    await HomeworkStates.waiting_for_due_date.set()
+
+@dp.message_handler(state=HomeworkStates.waiting_for_due_date)
+async def process_homework_due(message: types.Message, state: FSMContext,
+                               user: dict = None, class_data: dict = None):
+    if not user or not user.get("class_id") or not class_data:
+        await state.finish()
+        return
+    
+    accepted, due = await read_due_date(message)
+    if not accepted:
+        return
+    
+    user_data = await state.get_data()
+    subject, homework = user_data["subject"], user_data["homework"]
     
-    await message.answer(f"✅ ДЗ по предмету '{subject}' обновлено!")
+    # Обновляем ДЗ
+    await db.set_class_homework(user["class_id"], subject, homework, author_id=message.from_user.id,
+                                due=due, attachments=user_data.get("attachments"))
+    reminders.homework_changed("class", user["class_id"], subject, due)
+    broadcaster.notify_homework(class_data, subject, homework)
+    
+    text = f"✅ ДЗ по предмету '{subject}' обновлено!"
+    if due:
+        text += f"\n⏰ Сдать до {format_due(due)}"
+    await message.answer(text, reply_markup=get_class_management_keyboard(user.get("teamRole")))
     await state.finish()
 
+HISTORY_VERSIONS = 5
+
+async def render_homework_history(class_id: str, subject: str) -> Tuple[str, types.InlineKeyboardMarkup]:
+    versions = await db.get_homework_history(class_id, subject, HISTORY_VERSIONS)
+    if not versions:
+        return f"❌ Нет истории ДЗ по предмету '{subject}'", None
+    
+    authors = await db.get_users({version["author"] for version in versions if version["author"]})
+    text = f"🕘 <b>История ДЗ: {subject}</b>\n"
+    for number, version in enumerate(versions):
+        author = authors.get(version["author"])
+        when = version["at"][:16].replace("T", " ") if version["at"] else "до ведения истории"
+        header = f"Версия {version['rev']}" + (" (текущая)" if number == 0 else "")
+        body = version["text"] if version["text"] is not None else "<i>предмет удалён</i>"
+        if len(body) > 300:
+            body = body[:300] + "…"
+        text += f"\n<b>{header}</b> · {when}"
+        text += f" · {author['name']}\n" if author else "\n"
+        text += f"{body}\n"
+    return text, get_homework_history_keyboard(subject, versions)
+
+@router.text("История ДЗ")
+async def cmd_homework_history(message: types.Message, user: dict = None, class_data: dict = None):
+    if not user or not user.get("class_id") or not class_data:
+        await message.answer("❌ Вы не состоите в классе")
+        return
+    
+    if not await can_edit_class(message.from_user.id, user["class_id"], user):
+        await message.answer("❌ У вас нет прав для изменения ДЗ")
+        return
+    
+    subjects = list(class_data.get("homework", {}).keys())
+    text = "Предметы:\n" + "\n".join([f"• {subj}" for subj in subjects]) + "\n\n" if subjects else ""
+    await message.answer(text + "Введите название предмета:")
+    await HomeworkStates.waiting_for_history_subject.set()
+
+@dp.message_handler(state=HomeworkStates.waiting_for_history_subject)
+async def process_history_subject(message: types.Message, state: FSMContext, user: dict = None):
+    if message.text == "⬅️ Назад" or not user or not user.get("class_id"):
+        await state.finish()
+        if user and user.get("teamRole"):
+            await message.answer("Управление классом:", reply_markup=get_class_management_keyboard(user["teamRole"]))
+        return
+    
+    subject = message.text
+    text, keyboard = await render_homework_history(user["class_id"], subject)
+    # Предмет нужен кнопкам отката, поэтому данные состояния сохраняем
+    await state.reset_state(with_data=False)
+    await state.update_data(history_subject=subject)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@dp.callback_query_handler(lambda call: call.data.startswith("hw_revert_"), state="*")
+async def cb_revert_homework(call: types.CallbackQuery, state: FSMContext,
+                             user: dict = None, class_data: dict = None):
+    if not user or not class_data or not await can_edit_class(call.from_user.id, user["class_id"], user):
+        await call.answer("❌ Недостаточно прав", show_alert=True)
+        return
+    
+    subject = (await state.get_data()).get("history_subject")
+    rev = int(call.data.split("_")[2])
+    if subject is None or homework_revert_callback(subject, rev) != call.data:
+        await call.answer("История устарела, откройте её заново", show_alert=True)
+        return
+    
+    homework = await db.revert_class_homework(user["class_id"], subject, rev, author_id=call.from_user.id)
+    if homework is None:
+        await call.answer("❌ Версия не найдена", show_alert=True)
+        return
+    
+    broadcaster.notify_homework(class_data, subject, homework)
+    text, keyboard = await render_homework_history(user["class_id"], subject)
+    await call.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await call.answer(f"✅ ДЗ возвращено к версии {rev}")
+
+@router.text("🔔 Уведомления о ДЗ")
+async def cmd_toggle_notifications(message: types.Message, user: dict = None):
+    if not user:
+        await message.answer("Профиль не найден")
+        return
+    
+    enabled = not user.get("settings", {}).get("homework_notifications", False)
+    await db.update_user_settings(message.from_user.id, {"homework_notifications": enabled})
+    
+    if enabled:
+        await message.answer("🔔 Уведомления об изменении ДЗ класса включены")
+    else:
+        await message.answer("🔕 Уведомления об изменении ДЗ класса выключены")
+
 # ========== PERSONAL HOMEWORK HANDLERS ==========
-@dp.message_handler(lambda message: message.text == "📚 Моё ДЗ")
-async def cmd_personal_homework(message: types.Message):
+@router.text("📚 Моё ДЗ")
+async def cmd_personal_homework(message: types.Message, user: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user:
         await message.answer("Профиль не найден")
@@ -367,13 +558,13 @@ async def cmd_personal_homework(message: types.Message):
     personal_hw = user.get("personal_homework", {})
     if personal_hw:
         text = "📚 <b>Ваше личное ДЗ:</b>\n\n"
-        text += format_homework(personal_hw)
+        text += format_homework(personal_hw, user.get("personal_homework_meta"))
     else:
         text = "📭 Личное ДЗ не задано"
     
     await message.answer(text, parse_mode="HTML", reply_markup=get_homework_keyboard())
 
-@dp.message_handler(lambda message: message.text == "➕ Добавить личное ДЗ")
+@router.text("➕ Добавить личное ДЗ")
 async def cmd_add_personal_hw_start(message: types.Message):
     await message.answer("Введите название предмета для личного ДЗ:")
     await PersonalHomeworkStates.waiting_for_personal_subject.set()
@@ -385,29 +576,298 @@ async def process_personal_subject(message: types.Message, state: FSMContext):
     await message.answer(f"Введите ДЗ для предмета '{subject}':")
     await PersonalHomeworkStates.waiting_for_personal_homework.set()
 
-@dp.message_handler(state=PersonalHomeworkStates.waiting_for_personal_homework)
+@dp.message_handler(content_types=HOMEWORK_CONTENT_TYPES, state=PersonalHomeworkStates.waiting_for_personal_homework)
 async def process_personal_homework(message: types.Message, state: FSMContext):
-    homework = message.text
+    await state.update_data(homework=message.text or message.caption or "",
+                            attachments=message_attachments(message))
+    await ask_due_date(message)
+    await PersonalHomeworkStates.waiting_for_personal_due.set()
+
+@dp.message_handler(state=PersonalHomeworkStates.waiting_for_personal_due)
+async def process_personal_due(message: types.Message, state: FSMContext):
+    accepted, due = await read_due_date(message)
+    if not accepted:
+        return
+    
     user_data = await state.get_data()
     subject = user_data.get('subject')
     
-    db.add_personal_homework(message.from_user.id, subject, homework)
+    await db.add_personal_homework(message.from_user.id, subject, user_data.get('homework', ""),
+                                   due=due, attachments=user_data.get("attachments"))
+    reminders.homework_changed("user", message.from_user.id, subject, due)
     
-    await message.answer(f"✅ Личное ДЗ по предмету '{subject}' добавлено!")
+    await message.answer(f"✅ Личное ДЗ по предмету '{subject}' добавлено!", reply_markup=get_homework_keyboard())
     await state.finish()
 
 # ========== CLASS MANAGEMENT HANDLERS ==========
-@dp.message_handler(lambda message: message.text == "Заявки на вступление")
-async def cmd_join_requests(message: types.Message):
+# Сколько участников/заявок показывается на одной странице списка
+LIST_PAGE_SIZE = 10
+
+def parse_page_callback(data: str) -> Tuple[str, str, bool, Optional[int]]:
+    """members_next_9_123 -> ("members", "123", False, 9), classes_prev_10_7_A -> ("classes", "7_A", True, 10).
+
+    Позиция курсора в списке есть не во всех кнопках: у кнопок из старых
+    сообщений (members_next_123) она None.
+    """
+    prefix, direction, cursor = data.split("_", 2)
+    position, _, anchor = cursor.partition("_")
+    if not anchor or not position.isdigit():
+        return prefix, cursor, direction == "prev", None
+    return prefix, anchor, direction == "prev", int(position)
+
+async def render_join_requests(class_id: str, anchor: int = None, backward: bool = False, position: int = None):
+    # Из хранилища читаются только заявки и пользователи текущей страницы
+    start, page, total = await db.get_class_list_page(class_id, "join_requests", LIST_PAGE_SIZE,
+                                                      anchor, backward, position)
+    users = await db.get_users(page)
+    shown = [(request_id, users[request_id]["name"] if users[request_id] else str(request_id))
+             for request_id in page]
+    
+    text = f"📨 <b>Заявки на вступление</b> ({total})\n\n"
+    text += "\n".join(f"{number}. {name}" for number, (_, name) in enumerate(shown, start=start + 1))
+    text += "\n\nОтметьте заявки на этой странице или примите все сразу."
+    navigation = get_page_navigation("requests", page, start, total)
+    return text, get_join_requests_keyboard(shown, navigation=navigation)
+
+async def render_members(class_id: str, anchor: int = None, backward: bool = False, position: int = None):
+    start, page, total = await db.get_class_list_page(class_id, "members", LIST_PAGE_SIZE, anchor, backward, position)
+    users = await db.get_users(page)
+    
+    text = f"👥 <b>Участники класса</b> ({total})\n\n"
+    for number, member_id in enumerate(page, start=start + 1):
+        member = users[member_id]
+        if member:
+            text += f"{number}. {member['name']} — {member.get('teamRole') or 'участник'}\n"
+        else:
+            text += f"{number}. {member_id}\n"
+    navigation = get_page_navigation("members", page, start, total)
+    return text, get_members_keyboard(navigation)
+
+@router.text("Заявки на вступление")
+async def cmd_join_requests(message: types.Message, user: dict = None, class_data: dict = None):
     user_id = message.from_user.id
-    user = db.get_user(user_id)
     
     if not user or not user.get("class_id"):
         await message.answer("❌ Вы не состоите в классе")
         return
     
-    if not can_edit_class(user_id, user["class_id"]):
+    if not await can_edit_class(user_id, user["class_id"], user):
         await message.answer("❌ У вас нет прав для просмотра заявок")
         return
     
-   
\ No newline at end of file
+    if not class_data or not class_data.get("join_requests"):
+        await message.answer("📭 Заявок на вступление нет")
+        return
+    
+    text, keyboard = await render_join_requests(class_data["id"])
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@router.text("Участники класса")
+async def cmd_class_members(message: types.Message, user: dict = None, class_data: dict = None):
+    if not user or not user.get("class_id") or not class_data:
+        await message.answer("❌ Вы не состоите в классе")
+        return
+    
+    if not await can_edit_class(message.from_user.id, user["class_id"], user):
+        await message.answer("❌ У вас нет прав для управления классом")
+        return
+    
+    text, keyboard = await render_members(class_data["id"])
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@dp.callback_query_handler(lambda call: call.data.startswith(("members_prev_", "members_next_",
+                                                               "requests_prev_", "requests_next_")), state="*")
+async def cb_list_page(call: types.CallbackQuery, user: dict = None):
+    # Запись класса не загружается: страницу отдаёт хранилище по курсору
+    if not user or not user.get("class_id") or not await can_edit_class(call.from_user.id, user["class_id"], user):
+        await call.answer("❌ Недостаточно прав", show_alert=True)
+        return
+    
+    prefix, anchor, backward, position = parse_page_callback(call.data)
+    render = render_members if prefix == "members" else render_join_requests
+    text, keyboard = await render(user["class_id"], int(anchor), backward, position)
+    await call.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await call.answer()
+
+@dp.callback_query_handler(lambda call: call.data.startswith("toggle_request_"), state="*")
+async def cb_toggle_request(call: types.CallbackQuery):
+    keyboard = toggle_join_request(call.message.reply_markup, int(call.data.rsplit("_", 1)[1]))
+    await call.message.edit_reply_markup(keyboard)
+    await call.answer()
+
+@dp.callback_query_handler(
+    lambda call: call.data in ("accept_all_requests", "accept_selected_requests", "reject_selected_requests"),
+    state="*"
+)
+async def cb_process_requests(call: types.CallbackQuery, user: dict = None):
+    if not user or not user.get("class_id") or not await can_edit_class(call.from_user.id, user["class_id"], user):
+        await call.answer("❌ Недостаточно прав", show_alert=True)
+        return
+    
+    # Все заявки и отмеченные обрабатываются одной пачкой
+    request_ids = None
+    if call.data != "accept_all_requests":
+        request_ids = selected_join_requests(call.message.reply_markup)
+        if not request_ids:
+            await call.answer("Отметьте хотя бы одну заявку")
+            return
+    
+    accept = call.data != "reject_selected_requests"
+    processed = await db.process_join_requests(user["class_id"], request_ids, accept)
+    await call.message.edit_text(f"{'✅ Принято' if accept else '❌ Отклонено'} заявок: {len(processed)}")
+    await call.answer()
+
+@router.text("Импорт участников")
+async def cmd_import_members(message: types.Message, user: dict = None):
+    if not user or not user.get("class_id"):
+        await message.answer("❌ Вы не состоите в классе")
+        return
+    
+    if not await can_edit_class(message.from_user.id, user["class_id"], user):
+        await message.answer("❌ У вас нет прав для управления классом")
+        return
+    
+    await message.answer(
+        "Отправьте CSV-файл со списком класса: <code>user_id;имя;роль</code>\n"
+        "Роль можно не указывать (по умолчанию — участник).",
+        parse_mode="HTML"
+    )
+    await ClassStates.waiting_for_roster.set()
+
+@dp.message_handler(content_types=types.ContentType.DOCUMENT, state=ClassStates.waiting_for_roster)
+async def process_roster(message: types.Message, state: FSMContext, user: dict = None):
+    await state.finish()
+    if not user or not user.get("class_id") or not await can_edit_class(message.from_user.id, user["class_id"], user):
+        await message.answer("❌ У вас нет прав для управления классом")
+        return
+    
+    if message.document.file_size and message.document.file_size > 1024 * 1024:
+        await message.answer("❌ Файл больше 1 МБ")
+        return
+    
+    content = (await message.document.download(destination_file=io.BytesIO())).getvalue()
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = content.decode("cp1251")
+    
+    rows, errors = parse_roster_csv(text)
+    # Назначать старост может только тот, кто управляет ролями
+    if not await can_manage_roles(message.from_user.id, user["class_id"], user):
+        rows = [(row_id, name, "участник") for row_id, name, _ in rows]
+    
+    result = await db.import_members(user["class_id"], rows) if rows else {"added": [], "created": [], "skipped": []}
+    if result is None:
+        await message.answer("❌ Класс не найден")
+        return
+    
+    text = (
+        f"✅ Импорт завершён\n"
+        f"Добавлено: {len(result['added'])} (новых профилей: {len(result['created'])})\n"
+        f"Пропущено (в другом классе): {len(result['skipped'])}"
+    )
+    if errors:
+        text += "\n\n" + "\n".join(errors[:10])
+        if len(errors) > 10:
+            text += f"\n… и ещё ошибок: {len(errors) - 10}"
+    await message.answer(text, reply_markup=get_class_management_keyboard(user.get("teamRole")))
+
+@dp.message_handler(state=ClassStates.waiting_for_roster)
+async def process_roster_text(message: types.Message, state: FSMContext, user: dict = None):
+    if message.text == "⬅️ Назад":
+        await state.finish()
+        await message.answer("Импорт отменён", reply_markup=get_class_management_keyboard(user and user.get("teamRole")))
+        return
+    await message.answer("Отправьте CSV-файл или нажмите «⬅️ Назад»")
+
+
+# ========== ADMIN HANDLERS ==========
+async def render_users(anchor: int = None, backward: bool = False, position: int = None):
+    # Страница id - диапазонный запрос к хранилищу, а не список всех пользователей
+    start, page, total = await db.get_id_page("users", LIST_PAGE_SIZE, anchor, backward, position)
+    users = await db.get_users(page)
+    classes = await db.get_classes({u["class_id"] for u in users.values() if u and u.get("class_id")})
+    
+    text = f"👥 <b>Пользователи</b> ({total})\n\n"
+    for number, user_id in enumerate(page, start=start + 1):
+        listed = users[user_id]
+        if not listed:
+            continue
+        class_data = classes.get(listed.get("class_id"))
+        text += (f"{number}. {listed['name']} (<code>{user_id}</code>) — {listed.get('projectStatus', 'Member')}, "
+                 f"{class_data['name'] if class_data else 'без класса'}\n")
+    return text, get_members_keyboard(get_page_navigation("users", page, start, total))
+
+async def render_classes(anchor: str = None, backward: bool = False, position: int = None):
+    start, page, total = await db.get_id_page("classes", LIST_PAGE_SIZE, anchor, backward, position)
+    classes = await db.get_classes(page)
+    
+    text = f"🏫 <b>Классы</b> ({total})\n\n"
+    for number, class_id in enumerate(page, start=start + 1):
+        listed = classes[class_id]
+        if listed:
+            text += (f"{number}. {listed['name']} (<code>{class_id}</code>) — участников: "
+                     f"{len(listed['members'])}, заявок: {len(listed['join_requests'])}\n")
+    return text, get_members_keyboard(get_page_navigation("classes", page, start, total))
+
+@router.text("⚙️ Админ-панель")
+async def cmd_admin_panel(message: types.Message, user: dict = None):
+    if not await has_permission(message.from_user.id, "Staff", user=user):
+        await message.answer("❌ Нет доступа")
+        return
+    await message.answer("Админ-панель:", reply_markup=get_admin_keyboard(user.get("projectStatus")))
+
+@router.text("👥 Управление пользователями", "🏫 Управление классами")
+async def cmd_admin_lists(message: types.Message, user: dict = None):
+    if not await has_permission(message.from_user.id, "Staff", user=user):
+        await message.answer("❌ Нет доступа")
+        return
+    render = render_users if message.text == "👥 Управление пользователями" else render_classes
+    text, keyboard = await render()
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@router.text("📊 Статистика")
+async def cmd_admin_stats(message: types.Message, user: dict = None):
+    if not await has_permission(message.from_user.id, "Staff", user=user):
+        await message.answer("❌ Нет доступа")
+        return
+    await message.answer(format_stats(await db.get_stats()), parse_mode="HTML")
+
+@dp.callback_query_handler(lambda call: call.data.startswith(("users_prev_", "users_next_",
+                                                               "classes_prev_", "classes_next_")), state="*")
+async def cb_admin_list_page(call: types.CallbackQuery, user: dict = None):
+    if not await has_permission(call.from_user.id, "Staff", user=user):
+        await call.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    prefix, anchor, backward, position = parse_page_callback(call.data)
+    if prefix == "users":
+        text, keyboard = await render_users(int(anchor), backward, position)
+    else:
+        text, keyboard = await render_classes(anchor, backward, position)
+    await call.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await call.answer()
+
+# ========== STARTUP / SHUTDOWN ==========
+async def on_startup(dp: Dispatcher):
+    # Таймеры напоминаний восстанавливаются из data/reminders.sqlite3
+    await reminders.start()
+    # Индекс поиска читает все записи: строим его до первого апдейта
+    await db.build_search_index()
+    if metrics_server is not None:
+        await metrics_server.start()
+
+async def on_shutdown(dp: Dispatcher):
+    # Досылаем уведомления и принудительно сбрасываем кэш БД на диск
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await reminders.close()
+    await broadcaster.close()
+    await db.close()
+
+if __name__ == '__main__':
+    if WEBHOOK_URL:
+        from webhook import run_webhook
+        run_webhook(bot, dp, on_shutdown, on_startup)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
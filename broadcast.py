@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError, BotBlocked, ChatNotFound, UserDeactivated
+
+from config import BROADCAST_GLOBAL_RATE, BROADCAST_CHAT_RATE, BROADCAST_WORKERS, BROADCAST_DEDUP_WINDOW
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, запас до capacity"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Взять токен; вернуть 0 или сколько секунд подождать"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            delay = self.take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class Broadcaster:
+    """Очередь рассылки с учётом лимитов Telegram.
+
+    Сообщения отправляют workers параллельных задач. Общий лимит
+    (около 30 сообщений в секунду) и лимит на чат держатся token bucket'ами,
+    а RetryAfter приостанавливает всю рассылку на указанное время.
+    Изменения ДЗ по одному предмету за dedup_window секунд схлопываются
+    в одно уведомление.
+    """
+
+    max_retries = 5
+
+    def __init__(self, bot: Bot, global_rate: float = BROADCAST_GLOBAL_RATE,
+                 chat_rate: float = BROADCAST_CHAT_RATE, workers: int = BROADCAST_WORKERS,
+                 dedup_window: float = BROADCAST_DEDUP_WINDOW):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.workers = workers
+        self.dedup_window = dedup_window
+        self.sent = 0
+        self.failed = 0
+
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._paused_until = 0.0
+        # (class_id, subject) -> последний текст уведомления, ждущий рассылки
+        self._scheduled: Dict[Tuple[str, str], str] = {}
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    # === Отправка ===
+    def send(self, chat_ids: Iterable[int], text: str, **kwargs):
+        """Поставить сообщение в очередь для каждого чата"""
+        self._ensure_started()
+        for chat_id in chat_ids:
+            self._queue.put_nowait((chat_id, text, kwargs))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            except Exception:
+                logger.exception("Broadcast to %s failed", chat_id)
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict):
+        for attempt in range(self.max_retries):
+            await self._chat_bucket(chat_id).acquire()
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0:
+                    break
+                await asyncio.sleep(pause)
+            await self._global.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                logger.warning("Broadcast flood control: retry after %s s", e.timeout)
+                self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+            except (BotBlocked, ChatNotFound, UserDeactivated):
+                self.failed += 1
+                return
+            except TelegramAPIError as e:
+                logger.warning("Broadcast to %s failed (attempt %d): %s", chat_id, attempt + 1, e)
+        self.failed += 1
+
+    async def join(self):
+        """Дождаться отправки всего, что уже в очереди"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        for key in list(self._scheduled):
+            await self._fan_out(key)
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+
+    # === Уведомления о ДЗ ===
+    def notify_homework(self, class_data: dict, subject: str, homework: str):
+        """Сообщить подписанным участникам класса об изменении ДЗ"""
+        key = (class_data["id"], subject)
+        first = key not in self._scheduled
+        self._scheduled[key] = (
+            f"🔔 <b>Новое ДЗ</b> ({class_data['name']})\n\n"
+            f"📘 <b>{subject}:</b>\n{homework}"
+        )
+        if first:
+            asyncio.get_running_loop().call_later(
+                self.dedup_window, lambda: asyncio.ensure_future(self._fan_out(key))
+            )
+
+    async def _fan_out(self, key: Tuple[str, str]):
+        text = self._scheduled.pop(key, None)
+        if text is None:
+            return
+        recipients = await db.get_notification_recipients(key[0])
+        self.send(recipients, text, parse_mode="HTML")
@@ -7,6 +7,81 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else []
 OWNER_ID = int(os.getenv("OWNER_ID", 0))
 
+# Хранилище: "json" (data/*.json) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+DATA_DIR = os.getenv("DATA_DIR", "data")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR, "bot.sqlite3"))
+# Режим журнала для JSON: изменения дописываются в data/journal.log,
+# снимок перезаписывается, когда журнал больше JOURNAL_COMPACT_BYTES
+JSON_JOURNAL = os.getenv("JSON_JOURNAL", "0") == "1"
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", 16 * 1024 * 1024))
+# Раскладка JSON по файлам: "single" (users.json/classes.json) или
+# "sharded" (файл на запись: data/classes/<id>.json, data/users/<шард>/<id>.json)
+JSON_LAYOUT = os.getenv("JSON_LAYOUT", "single")
+# Формат файлов JSON-хранилища: "json", "orjson" или "msgpack" (нужны
+# одноимённые пакеты). Читаются файлы любого формата.
+STORAGE_FORMAT = os.getenv("STORAGE_FORMAT", "json")
+# В боевом режиме файлы пишутся без отступов
+PRODUCTION = os.getenv("PRODUCTION", "0") == "1"
+JSON_INDENT = None if PRODUCTION else 2
+# Количество потоков, в которых выполняются операции с хранилищем
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", 4))
+
+# Хранилище состояний FSM: "sqlite" (переживает перезапуск) или "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_PATH = os.getenv("FSM_PATH", os.path.join(DATA_DIR, "fsm.sqlite3"))
+# Брошенные состояния удаляются через FSM_TTL секунд
+FSM_TTL = int(os.getenv("FSM_TTL", 7 * 24 * 3600))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1.0))
+
+# Рассылка уведомлений: общий лимит Telegram и лимит на один чат (сообщений/сек)
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", 30))
+BROADCAST_CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", 1))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 20))
+# Правки ДЗ по одному предмету за это время (сек) уходят одним уведомлением
+BROADCAST_DEDUP_WINDOW = float(os.getenv("BROADCAST_DEDUP_WINDOW", 10))
+
+# Сроки ДЗ: время по умолчанию для срока без времени ("ЧЧ:ММ"),
+# напоминание за REMINDER_BEFORE секунд до срока и перенос в архив
+# через HOMEWORK_ARCHIVE_AFTER секунд после него
+HOMEWORK_DUE_TIME = os.getenv("HOMEWORK_DUE_TIME", "08:00")
+REMINDER_BEFORE = int(os.getenv("REMINDER_BEFORE", 18 * 3600))
+HOMEWORK_ARCHIVE_AFTER = int(os.getenv("HOMEWORK_ARCHIVE_AFTER", 24 * 3600))
+REMINDERS_PATH = os.getenv("REMINDERS_PATH", os.path.join(DATA_DIR, "reminders.sqlite3"))
+REMINDERS_FLUSH_INTERVAL = float(os.getenv("REMINDERS_FLUSH_INTERVAL", 1.0))
+
+# Режим webhook: включается, если задан WEBHOOK_URL (публичный адрес бота)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))
+# Параллельно обрабатываемые апдейты (апдейты одного чата - всегда по очереди)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 100))
+# Сколько апдейтов может ждать обработки; при переполнении
+# "wait" - запрос ждёт освобождения места, "reject" - ответ 503
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+WEBHOOK_BACKPRESSURE = os.getenv("WEBHOOK_BACKPRESSURE", "wait")
+# Сколько секунд при остановке ждать обработки уже принятых апдейтов
+WEBHOOK_STOP_TIMEOUT = float(os.getenv("WEBHOOK_STOP_TIMEOUT", 30))
+
+# Несколько процессов-обработчиков (python workers.py, только STORAGE_BACKEND=sqlite):
+# supervisor принимает апдейты и раздаёт их WORKERS процессам по chat_id,
+# процесс i слушает 127.0.0.1:WORKER_BASE_PORT+i. WORKER_INDEX задаёт supervisor.
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", 0))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8100))
+# Адрес своего сервера Bot API (по умолчанию api.telegram.org)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 - выключены),
+# у процесса-обработчика i - на порту METRICS_PORT+i
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Апдейты дольше стольких секунд пишутся в лог с разбивкой по этапам (0 - не писать)
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", 1.0))
+
 
 PROJECT_STATUSES = ["Owner", "Admin", "Staff", "Member"]
 TEAM_ROLES = ["староста", "помощник старосты", "участник"]
\ No newline at end of file
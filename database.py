@@ -1,46 +1,324 @@
+import asyncio
+import atexit
+import bisect
+import copy
+import contextvars
+import functools
 import json
+import logging
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union, Any
+from urllib.parse import quote, unquote
+
+from config import (STORAGE_BACKEND, DATA_DIR, SQLITE_PATH, STORAGE_WORKERS, JSON_JOURNAL,
+                    JOURNAL_COMPACT_BYTES, JSON_LAYOUT, STORAGE_FORMAT, JSON_INDENT)
+import history
+import metrics
+import search
+import serializers
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Задержка (сек) перед сбросом изменений на диск и максимальное время,
+# которое изменения могут провести только в памяти
+FLUSH_DELAY = 0.5
+MAX_FLUSH_DELAY = 5.0
+# Число подкаталогов data/users/ в раскладке sharded
+USER_SHARDS = 256
+# Сколько ДЗ с истёкшим сроком хранится в архиве класса/пользователя
+HOMEWORK_ARCHIVE_SIZE = 50
+# Сколько отрендеренных ДЗ классов держится в памяти
+RENDER_CACHE_SIZE = 1024
+# За сколько последних дней JSON-хранилище держит в памяти отметки
+# активности; более старые дни при необходимости читаются из activity.log
+ACTIVITY_DAYS_CACHED = 2
+
+
+def paginate(items: List, size: int, anchor: Any = None, backward: bool = False,
+             position: Optional[int] = None) -> Tuple[int, List]:
+    """Страница списка относительно курсора.
+
+    anchor - элемент на границе соседней страницы: следующая страница
+    начинается после него, предыдущая (backward=True) заканчивается перед
+    ним. Курсор не сбивается, когда список меняется между нажатиями.
+    position - позиция anchor, когда показывалась та страница: если
+    элемент всё ещё там, список не просматривается.
+    Возвращает индекс начала страницы и её элементы.
+    """
+    start = 0
+    if anchor is not None:
+        if position is None or not 0 <= position < len(items) or items[position] != anchor:
+            position = items.index(anchor) if anchor in items else None
+        if position is not None:
+            start = max(position - size, 0) if backward else position + 1
+    if start >= len(items):
+        start = max(len(items) - size, 0)
+    return start, items[start:start + size]
+
+
+def _sorted_page(ids: List, size: int, anchor: Any = None, backward: bool = False) -> Tuple[int, List]:
+    """paginate() для отсортированного списка: курсор ищется бинарным поиском
+    и работает, даже если самого anchor в списке уже нет"""
+    start = 0
+    if anchor is not None:
+        start = max(bisect.bisect_left(ids, anchor) - size, 0) if backward else bisect.bisect_right(ids, anchor)
+    if start >= len(ids):
+        start = max(len(ids) - size, 0)
+    return start, ids[start:start + size]
+
+
+def atomic_write(path: str, data: Union[str, bytes]):
+    """Запись файла через временный файл и rename"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    data = data.encode('utf-8') if isinstance(data, str) else data
+    metrics.storage_serialized_bytes.inc(len(data), "json")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class RenderCache:
+    """Отрендеренные записи: ключ -> (версия, текст), не больше size штук.
+
+    Текст другой версии - промах; давно не читавшиеся ключи вытесняются.
+    """
+
+    def __init__(self, size: int = RENDER_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key, version: int) -> Optional[str]:
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is None or cached[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return cached[1]
+
+    def put(self, key, version: int, text: str):
+        with self._lock:
+            self._items[key] = (version, text)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class KeyedLock:
+    """Блокировки по ключу записи.
+
+    Захват нескольких ключей идёт в отсортированном порядке, поэтому
+    транзакции над разными записями не мешают друг другу и не дают deadlock.
+    Неиспользуемые блокировки удаляются.
+    """
 
-class Database:
     def __init__(self):
-        self.data_dir = "data"
-        self.users_file = os.path.join(self.data_dir, "users.json")
-        self.classes_file = os.path.join(self.data_dir, "classes.json")
-        self._ensure_directories()
-        self._init_files()
-    
-    def _ensure_directories(self):
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-    
-    def _init_files(self):
-        if not os.path.exists(self.users_file):
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-        
-        if not os.path.exists(self.classes_file):
-            with open(self.classes_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-    
-    # === User Operations ===
+        self._guard = threading.Lock()
+        self._locks: Dict[Any, list] = {}
+
+    @contextmanager
+    def __call__(self, *keys):
+        keys = sorted(set(keys))
+        with self._guard:
+            entries = []
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.RLock(), 0])
+                entry[1] += 1
+                entries.append(entry)
+        acquired = []
+        try:
+            for entry in entries:
+                entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            with self._guard:
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+
+
+class BaseDatabase:
+    """Общие операции над пользователями и классами.
+
+    Наследники реализуют хранение записей (get/save_user, get/save_class,
+    get_all_*) и могут переопределять отдельные операции более дешёвыми.
+    Все изменения записей идут через transaction().
+    """
+
+    # Методы, которые только читают хранилище: по ним метрики делят
+    # вызовы на read и write (см. AsyncDatabase)
+    READ_METHODS = frozenset({
+        "get_user", "get_users", "get_class", "get_classes", "get_user_ids", "get_class_ids",
+        "get_all_users", "get_all_classes", "get_user_class", "get_users_in_class", "get_member_class",
+        "get_notification_recipients", "get_class_list_page", "get_id_page", "is_member", "has_join_request",
+        "get_class_homework", "get_homework_history", "get_homework_revision", "search_homework",
+        "build_search_index", "get_stats",
+    })
+
+    def __init__(self):
+        self._record_locks = KeyedLock()
+        self._search: Optional[search.SearchIndex] = None
+        # Версия ДЗ владельца, по которой построены его документы в индексе
+        self._search_versions: Dict[search.Owner, int] = {}
+        self._search_lock = threading.Lock()
+        # ДЗ классов для показа (utils.render_class_homework), по homework_version
+        self.homework_render_cache = RenderCache()
+
+    # === Storage primitives ===
     def get_user(self, user_id: int) -> Optional[Dict]:
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        return users.get(str(user_id))
-    
+        raise NotImplementedError
+
     def save_user(self, user_id: int, user_data: Dict):
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        
-        users[str(user_id)] = user_data
-        
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
-    
-    def create_user_profile(self, user_id: int, name: str):
-        user_data = {
+        raise NotImplementedError
+
+    # Пакетное чтение: {id: запись или None} в порядке запрошенных id.
+    # Бэкенды читают все записи из одного согласованного снимка.
+    def get_users(self, user_ids: Iterable[int]) -> Dict[int, Optional[Dict]]:
+        return {user_id: self.get_user(user_id) for user_id in user_ids}
+
+    def get_classes(self, class_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        return {class_id: self.get_class(class_id) for class_id in class_ids}
+
+    def get_user_ids(self) -> List[int]:
+        return [int(user_id) for user_id in self.get_all_users()]
+
+    def get_class_ids(self) -> List[str]:
+        return list(self.get_all_classes())
+
+    def get_class(self, class_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_class(self, class_id: str, class_data: Dict):
+        raise NotImplementedError
+
+    def get_all_classes(self) -> Dict:
+        raise NotImplementedError
+
+    def get_all_users(self) -> Dict:
+        raise NotImplementedError
+
+    # История ДЗ: ревизии (класс, предмет) нумеруются с 1 подряд
+    def _revision_count(self, class_id: str, subject: str) -> int:
+        raise NotImplementedError
+
+    def _append_revisions(self, class_id: str, subject: str, entries: List[Dict]):
+        raise NotImplementedError
+
+    def _read_revisions(self, class_id: str, subject: str, since_rev: int = 1) -> List[Dict]:
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    # === Transactions ===
+    @staticmethod
+    def _lock_keys(class_id: Optional[str] = None, user_id: Optional[int] = None) -> List:
+        keys = []
+        if class_id is not None:
+            keys.append(("class", class_id))
+        if user_id is not None:
+            keys.append(("user", str(user_id)))
+        return keys
+
+    def _save_records(self, class_id: Optional[str], class_data: Optional[Dict],
+                      user_id: Optional[int], user: Optional[Dict]):
+        if class_data is not None:
+            self.save_class(class_id, class_data)
+        if user is not None:
+            self.save_user(user_id, user)
+
+    def _save_batch(self, class_id: str, class_data: Optional[Dict], users: Dict[int, Optional[Dict]]):
+        if class_data is not None:
+            self.save_class(class_id, class_data)
+        for user_id, user in users.items():
+            if user is not None:
+                self.save_user(user_id, user)
+
+    def _write_scope(self):
+        """Транзакция хранилища вокруг transaction() и batch_transaction().
+
+        Берётся после блокировок записей, как и в create_*/save_*: один
+        порядок захвата везде, иначе два потока ждут друг друга.
+        """
+        return nullcontext()
+
+    @contextmanager
+    def transaction(self, class_id: Optional[str] = None, user_id: Optional[int] = None):
+        """Атомарное чтение-изменение-запись записей.
+
+        with db.transaction(class_id=...) as class_data: ...
+        with db.transaction(user_id=...) as user: ...
+        with db.transaction(class_id=..., user_id=...) as (class_data, user): ...
+
+        Отсутствующая запись отдаётся как None. Изменения сохраняются при
+        выходе из блока без исключения, конкурентные транзакции над теми же
+        записями ждут друг друга.
+        """
+        if class_id is None and user_id is None:
+            raise ValueError("transaction() requires class_id or user_id")
+        with self._record_locks(*self._lock_keys(class_id, user_id)), self._write_scope():
+            class_data = self.get_class(class_id) if class_id is not None else None
+            user = self.get_user(user_id) if user_id is not None else None
+            if class_id is not None and user_id is not None:
+                yield class_data, user
+            else:
+                yield class_data if class_id is not None else user
+            self._save_records(class_id, class_data, user_id, user)
+
+    @contextmanager
+    def batch_transaction(self, class_id: str, user_ids: Iterable[int] = ()):
+        """transaction() для класса и сразу многих пользователей.
+
+        with db.batch_transaction(class_id, user_ids) as (class_data, users): ...
+
+        users - словарь {user_id: запись или None}. Все изменения, включая
+        добавленные в users записи, сохраняются одной пачкой; удалённые из
+        словаря записи не сохраняются.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        keys = self._lock_keys(class_id=class_id) + [key for user_id in user_ids
+                                                     for key in self._lock_keys(user_id=user_id)]
+        with self._record_locks(*keys), self._write_scope():
+            class_data = self.get_class(class_id)
+            users = self.get_users(user_ids)
+            yield class_data, users
+            self._save_batch(class_id, class_data, users)
+
+    # === User Operations ===
+    @staticmethod
+    def _new_user(user_id: int, name: str) -> Dict:
+        return {
             "id": user_id,
             "name": name,
             "profile": {
@@ -56,52 +334,47 @@ class Database:
             "join_requests": [],
             "created_at": datetime.now().isoformat()
         }
-        self.save_user(user_id, user_data)
+
+    def create_user_profile(self, user_id: int, name: str):
+        user_data = self._new_user(user_id, name)
+        with self._record_locks(*self._lock_keys(user_id=user_id)):
+            self.save_user(user_id, user_data)
         return user_data
-    
+
     def update_user_profile(self, user_id: int, profile_data: Dict):
-        user = self.get_user(user_id)
-        if user:
-            user["profile"].update(profile_data)
-            self.save_user(user_id, user)
-    
+        with self.transaction(user_id=user_id) as user:
+            if user:
+                user["profile"].update(profile_data)
+
     def update_user_status(self, user_id: int, status: str):
-        user = self.get_user(user_id)
-        if user:
-            user["projectStatus"] = status
-            self.save_user(user_id, user)
-    
+        with self.transaction(user_id=user_id) as user:
+            if user:
+                user["projectStatus"] = status
+
     def update_user_class(self, user_id: int, class_id: Optional[str], team_role: Optional[str] = None):
-        user = self.get_user(user_id)
-        if user:
-            user["class_id"] = class_id
-            if team_role:
-                user["teamRole"] = team_role
-            self.save_user(user_id, user)
-    
-    def add_personal_homework(self, user_id: int, subject: str, homework: str):
-        user = self.get_user(user_id)
-        if user:
-            if "personal_homework" not in user:
-                user["personal_homework"] = {}
-            user["personal_homework"][subject] = homework
-            self.save_user(user_id, user)
-    
+        with self.transaction(user_id=user_id) as user:
+            if user:
+                user["class_id"] = class_id
+                if team_role:
+                    user["teamRole"] = team_role
+
+    def add_personal_homework(self, user_id: int, subject: str, homework: str,
+                              due: Optional[str] = None, attachments: Optional[List[Dict]] = None):
+        with self.transaction(user_id=user_id) as user:
+            if user:
+                if "personal_homework" not in user:
+                    user["personal_homework"] = {}
+                user["personal_homework"][subject] = homework
+                user["personal_homework_version"] = user.get("personal_homework_version", 0) + 1
+                self._set_homework_meta(user.setdefault("personal_homework_meta", {}), subject, due, attachments)
+        self._reindex_homework(user_id=user_id)
+
+    def update_user_settings(self, user_id: int, settings: Dict):
+        with self.transaction(user_id=user_id) as user:
+            if user:
+                user.setdefault("settings", {}).update(settings)
+
     # === Class Operations ===
-    def get_class(self, class_id: str) -> Optional[Dict]:
-        with open(self.classes_file, 'r', encoding='utf-8') as f:
-            classes = json.load(f)
-        return classes.get(class_id)
-    
-    def save_class(self, class_id: str, class_data: Dict):
-        with open(self.classes_file, 'r', encoding='utf-8') as f:
-            classes = json.load(f)
-        
-        classes[class_id] = class_data
-        
-        with open(self.classes_file, 'w', encoding='utf-8') as f:
-            json.dump(classes, f, ensure_ascii=False, indent=2)
-    
     def create_class(self, class_id: str, class_name: str, creator_id: int):
         class_data = {
             "id": class_id,
@@ -111,53 +384,279 @@ class Database:
             "members": [creator_id],
             "join_requests": [],
             "created_at": datetime.now().isoformat(),
-            "created_by": creator_id
+            "created_by": creator_id,
+            "homework_version": 0,
+            "homework_updated_at": None
         }
-        self.save_class(class_id, class_data)
+        with self._record_locks(*self._lock_keys(class_id=class_id)):
+            self.save_class(class_id, class_data)
         return class_data
-    
+
+    # Базовые версии операций с заявками и участниками меняют загруженную
+    # запись класса целиком (O(размер класса)). Database переопределяет их
+    # проверками по множествам в памяти, SQLiteDatabase - запросами к строкам.
     def add_join_request(self, class_id: str, user_id: int):
-        class_data = self.get_class(class_id)
-        if class_data:
-            if user_id not in class_data["join_requests"]:
-                class_data["join_requests"].append(user_id)
-                self.save_class(class_id, class_data)
-    
+        with self.transaction(class_id=class_id) as class_data:
+            if class_data:
+                if user_id not in class_data["join_requests"]:
+                    class_data["join_requests"].append(user_id)
+
     def process_join_request(self, class_id: str, user_id: int, accept: bool):
-        class_data = self.get_class(class_id)
-        if class_data:
-            if user_id in class_data["join_requests"]:
+        with self.transaction(class_id=class_id, user_id=user_id) as (class_data, user):
+            if class_data and user_id in class_data["join_requests"]:
                 class_data["join_requests"].remove(user_id)
-                
+
                 if accept:
                     class_data["members"].append(user_id)
-                    self.update_user_class(user_id, class_id, "участник")
-                
-                self.save_class(class_id, class_data)
+                    if user:
+                        user["class_id"] = class_id
+                        user["teamRole"] = "участник"
                 return True
         return False
-    
-    def remove_member(self, class_id: str, user_id: int):
-        class_data = self.get_class(class_id)
-        if class_data and user_id in class_data["members"]:
-            class_data["members"].remove(user_id)
-            self.save_class(class_id, class_data)
-            self.update_user_class(user_id, None)
+
+    def process_join_requests(self, class_id: str, user_ids: Optional[Iterable[int]] = None,
+                              accept: bool = True) -> List[int]:
+        """Принять или отклонить сразу много заявок (все, если user_ids не задан).
+
+        Пользователи, успевшие вступить в другой класс, не принимаются, но их
+        заявки удаляются. Возвращает обработанные заявки.
+        """
+        if user_ids is None:
+            class_data = self.get_class(class_id)
+            user_ids = class_data["join_requests"] if class_data else []
+        user_ids = list(dict.fromkeys(user_ids))
+        with self.batch_transaction(class_id, user_ids if accept else ()) as (class_data, users):
+            if not class_data:
+                return []
+            pending = set(class_data["join_requests"])
+            processed = [user_id for user_id in user_ids if user_id in pending]
+            done = set(processed)
+            class_data["join_requests"] = [user_id for user_id in class_data["join_requests"]
+                                           if user_id not in done]
+            if accept:
+                members = set(class_data["members"])
+                for user_id in processed:
+                    user = users.get(user_id)
+                    if user and user.get("class_id") not in (None, class_id):
+                        del users[user_id]
+                        continue
+                    if user_id not in members:
+                        class_data["members"].append(user_id)
+                        members.add(user_id)
+                    if user:
+                        user["class_id"] = class_id
+                        user["teamRole"] = "участник"
+            return processed
+
+    def import_members(self, class_id: str, roster: List[Tuple[int, str, str]]) -> Optional[Dict[str, List[int]]]:
+        """Добавить в класс список (user_id, имя, роль) одной пачкой.
+
+        Недостающие профили создаются, пользователи из других классов
+        пропускаются. None - класса нет.
+        """
+        with self.batch_transaction(class_id, [row[0] for row in roster]) as (class_data, users):
+            if not class_data:
+                return None
+            result = {"added": [], "created": [], "skipped": []}
+            members = set(class_data["members"])
+            imported = set()
+            for user_id, name, team_role in roster:
+                user = users.get(user_id)
+                if user is None:
+                    user = users[user_id] = self._new_user(user_id, name)
+                    result["created"].append(user_id)
+                elif user.get("class_id") not in (None, class_id):
+                    result["skipped"].append(user_id)
+                    continue
+                user["class_id"] = class_id
+                user["teamRole"] = team_role
+                if user_id not in members:
+                    class_data["members"].append(user_id)
+                    members.add(user_id)
+                    result["added"].append(user_id)
+                imported.add(user_id)
+            for user_id in result["skipped"]:
+                users.pop(user_id, None)
+            class_data["join_requests"] = [user_id for user_id in class_data["join_requests"]
+                                           if user_id not in imported]
+            return result
+
+    def add_member(self, class_id: str, user_id: int, team_role: str = "участник"):
+        """Добавить пользователя в класс без заявки"""
+        with self.transaction(class_id=class_id, user_id=user_id) as (class_data, user):
+            if not class_data:
+                return False
+            if user_id not in class_data["members"]:
+                class_data["members"].append(user_id)
+            if user:
+                user["class_id"] = class_id
+                user["teamRole"] = team_role
             return True
+
+    def remove_member(self, class_id: str, user_id: int):
+        with self.transaction(class_id=class_id, user_id=user_id) as (class_data, user):
+            if class_data and user_id in class_data["members"]:
+                class_data["members"].remove(user_id)
+                if user:
+                    user["class_id"] = None
+                return True
         return False
-    
-    def update_class_homework(self, class_id: str, homework_data: Dict):
-        class_data = self.get_class(class_id)
-        if class_data:
-            class_data["homework"] = homework_data
-            self.save_class(class_id, class_data)
-    
+
+    def update_class_homework(self, class_id: str, homework_data: Dict, author_id: Optional[int] = None):
+        with self.transaction(class_id=class_id) as class_data:
+            if class_data:
+                self._record_homework_changes(class_id, class_data["homework"], homework_data, author_id)
+                class_data["homework"] = homework_data
+                self._touch_homework(class_data)
+                if "homework_meta" in class_data:
+                    class_data["homework_meta"] = {subject: meta for subject, meta in class_data["homework_meta"].items()
+                                                   if subject in homework_data}
+        self._reindex_homework(class_id=class_id)
+
+    def set_class_homework(self, class_id: str, subject: str, homework: str, author_id: Optional[int] = None,
+                           due: Optional[str] = None, attachments: Optional[List[Dict]] = None):
+        """Изменить ДЗ по одному предмету.
+
+        due - срок сдачи (datetime.isoformat()), attachments - описания
+        вложений; без них у предмета не остаётся ни срока, ни вложений.
+        """
+        with self.transaction(class_id=class_id) as class_data:
+            if class_data:
+                self._record_homework_changes(class_id, {subject: class_data["homework"].get(subject)},
+                                              {subject: homework}, author_id)
+                class_data["homework"][subject] = homework
+                self._touch_homework(class_data)
+                self._set_homework_meta(class_data.setdefault("homework_meta", {}), subject, due, attachments)
+        self._reindex_homework(class_id=class_id)
+
     def update_class_information(self, class_id: str, information: str):
-        class_data = self.get_class(class_id)
-        if class_data:
-            class_data["information"] = information
-            self.save_class(class_id, class_data)
-    
+        with self.transaction(class_id=class_id) as class_data:
+            if class_data:
+                class_data["information"] = information
+
+    @staticmethod
+    def _touch_homework(class_data: Dict):
+        """Отметить изменение ДЗ класса: версия для кэша и время для статистики"""
+        class_data["homework_version"] = class_data.get("homework_version", 0) + 1
+        class_data["homework_updated_at"] = datetime.now().isoformat()
+
+    @staticmethod
+    def _set_homework_meta(meta: Dict, subject: str, due: Optional[str], attachments: Optional[List[Dict]]):
+        """Срок и вложения предмета в homework_meta (personal_homework_meta)"""
+        details = {key: value for key, value in (("due", due), ("attachments", attachments)) if value}
+        if details:
+            meta[subject] = details
+        else:
+            meta.pop(subject, None)
+
+    @staticmethod
+    def _archive_homework(record: Dict, homework_key: str, subject: str, due: str) -> Optional[str]:
+        """Перенести ДЗ со сроком due в архив записи; вернуть его текст"""
+        meta = record.get(homework_key + "_meta", {})
+        if meta.get(subject, {}).get("due") != due or subject not in record.get(homework_key, {}):
+            return None
+        text = record[homework_key].pop(subject)
+        archive = record.setdefault(homework_key + "_archive", [])
+        archive.append(dict(meta.pop(subject), subject=subject, text=text, archived_at=datetime.now().isoformat()))
+        del archive[:-HOMEWORK_ARCHIVE_SIZE]
+        return text
+
+    def archive_class_homework(self, class_id: str, subject: str, due: str) -> bool:
+        """Убрать в архив ДЗ с истёкшим сроком, если срок с тех пор не меняли"""
+        with self.transaction(class_id=class_id) as class_data:
+            if not class_data:
+                return False
+            text = self._archive_homework(class_data, "homework", subject, due)
+            if text is None:
+                return False
+            self._record_homework_changes(class_id, {subject: text}, {}, None)
+            self._touch_homework(class_data)
+        self._reindex_homework(class_id=class_id)
+        return True
+
+    def archive_personal_homework(self, user_id: int, subject: str, due: str) -> bool:
+        with self.transaction(user_id=user_id) as user:
+            archived = bool(user) and self._archive_homework(user, "personal_homework", subject, due) is not None
+            if archived:
+                user["personal_homework_version"] = user.get("personal_homework_version", 0) + 1
+        if archived:
+            self._reindex_homework(user_id=user_id)
+        return archived
+
+    # === Homework Search ===
+    _HOMEWORK_KEYS = {"class": ("homework", "homework_version"),
+                      "user": ("personal_homework", "personal_homework_version")}
+
+    def _index_record(self, owner: search.Owner, record: Dict):
+        """Заменить документы владельца в индексе, вызывать под _search_lock"""
+        homework_key, version_key = self._HOMEWORK_KEYS[owner[0]]
+        self._search.replace(owner, search.homework_documents(record, homework_key))
+        self._search_versions[owner] = record.get(version_key, 0)
+
+    def build_search_index(self):
+        """Построить индекс поиска заранее (при запуске бота), чтобы первый
+        запрос не читал всё хранилище"""
+        with self._search_lock:
+            self._homework_index()
+
+    def _homework_index(self) -> search.SearchIndex:
+        """Индекс поиска по ДЗ; без build_search_index() строится при первом запросе.
+
+        Вызывать под _search_lock.
+        """
+        if self._search is None:
+            started = time.perf_counter()
+            self._search = search.SearchIndex()
+            for class_id, class_data in self.get_all_classes().items():
+                self._index_record(("class", class_id), class_data)
+            for user_id, user in self.get_all_users().items():
+                self._index_record(("user", int(user_id)), user)
+            logger.info("Built homework search index: %d documents in %.3fs",
+                        len(self._search), time.perf_counter() - started)
+        return self._search
+
+    def _reindex_homework(self, class_id: Optional[str] = None, user_id: Optional[int] = None):
+        """Переиндексировать ДЗ записи после сохранения изменений.
+
+        Документы владельца перечитываются из хранилища целиком, поэтому
+        порядок конкурентных вызовов не важен.
+        """
+        with self._search_lock:
+            if self._search is None:
+                return
+            if class_id is not None:
+                self._index_record(("class", class_id), self.get_class(class_id) or {})
+            if user_id is not None:
+                self._index_record(("user", int(user_id)), self.get_user(user_id) or {})
+
+    def _homework_versions(self, owners: List[search.Owner]) -> Dict[search.Owner, int]:
+        """Текущие версии ДЗ владельцев, если ДЗ могут менять другие процессы.
+
+        Индекс у каждого процесса свой; владельцы, чья версия разошлась с
+        индексом, переиндексируются перед поиском. Хранилищу одного
+        процесса проверять нечего.
+        """
+        return {}
+
+    def search_homework(self, query: str, class_id: Optional[str] = None, user_id: Optional[int] = None,
+                        limit: int = 10) -> List[Dict]:
+        """Поиск по ДЗ класса и личному ДЗ пользователя, включая архив.
+
+        Результат - {"scope": "class" | "user", "subject", "text", "archived_at"}.
+        """
+        owners = []
+        if class_id is not None:
+            owners.append(("class", class_id))
+        if user_id is not None:
+            owners.append(("user", int(user_id)))
+        with self._search_lock:
+            index = self._homework_index()
+            for owner, version in self._homework_versions(owners).items():
+                if version != self._search_versions.get(owner):
+                    scope, key = owner
+                    self._index_record(owner, (self.get_class(key) if scope == "class" else self.get_user(key)) or {})
+            return index.search(owners, query, limit)
+
     def get_class_homework(self, class_id: str, subject: str = None) -> Dict:
         class_data = self.get_class(class_id)
         if class_data:
@@ -165,24 +664,1859 @@ class Database:
                 return {subject: class_data["homework"].get(subject, "ДЗ не задано")}
             return class_data["homework"]
         return {}
-    
+
+    # === Homework History ===
+    def _record_homework_changes(self, class_id: str, old: Dict, new: Dict, author_id: Optional[int]):
+        """Дописать в историю ревизии изменившихся предметов.
+
+        Вызывается под блокировкой класса, до сохранения самой записи.
+        """
+        for subject in list(dict.fromkeys(list(old) + list(new))):
+            old_text, new_text = old.get(subject), new.get(subject)
+            if old_text == new_text:
+                continue
+            count = self._revision_count(class_id, subject)
+            entries = []
+            if count:
+                # Разница считается от последней версии в истории, а не от
+                # записи: так цепочка ревизий согласована сама с собой
+                base = self.get_homework_revision(class_id, subject, count)
+            else:
+                base = old_text
+                if old_text is not None:
+                    # ДЗ задано до появления истории: сохраняем его первой ревизией
+                    entries.append(dict(history.make_revision(1, None, old_text, None), at=None))
+            entries.append(history.make_revision(count + len(entries) + 1, base, new_text, author_id))
+            self._append_revisions(class_id, subject, entries)
+
+    def get_homework_history(self, class_id: str, subject: str, limit: int = 5) -> List[Dict]:
+        """Последние версии ДЗ по предмету, новые первыми.
+
+        Версия - {"rev", "author", "at", "text"}; text = None, если
+        предмет в этой версии удалён.
+        """
+        count = self._revision_count(class_id, subject)
+        if not count:
+            return []
+        first = max(count - limit + 1, 1)
+        entries = self._read_revisions(class_id, subject, history.keyframe_before(first))
+        return [{"rev": entry["rev"], "author": entry["author"], "at": entry["at"], "text": text}
+                for entry, text in reversed(history.replay(entries)) if entry["rev"] >= first]
+
+    def get_homework_revision(self, class_id: str, subject: str, rev: int) -> Optional[str]:
+        """Текст ДЗ в версии rev (None - нет такой версии или предмет удалён)"""
+        if rev < 1:
+            return None
+        entries = self._read_revisions(class_id, subject, history.keyframe_before(rev))
+        versions = [text for entry, text in history.replay(entries) if entry["rev"] == rev]
+        return versions[0] if versions else None
+
+    def revert_class_homework(self, class_id: str, subject: str, rev: int,
+                              author_id: Optional[int] = None) -> Optional[str]:
+        """Вернуть ДЗ к версии rev. Откат - новая ревизия, история не переписывается"""
+        # Чтение версии и запись в одной транзакции: правка между ними
+        # не затрётся, и ревизия отката считается от последней версии
+        with self.transaction(class_id=class_id) as class_data:
+            if not class_data:
+                return None
+            text = self.get_homework_revision(class_id, subject, rev)
+            if text is not None:
+                # Срок и вложения остаются прежними: откатывается только текст
+                self._record_homework_changes(class_id, {subject: class_data["homework"].get(subject)},
+                                              {subject: text}, author_id)
+                class_data["homework"][subject] = text
+                self._touch_homework(class_data)
+        if text is not None:
+            self._reindex_homework(class_id=class_id)
+        return text
+
     # === Utility Methods ===
-    def get_all_classes(self) -> Dict:
-        with open(self.classes_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    def get_all_users(self) -> Dict:
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
     def get_users_in_class(self, class_id: str) -> List[int]:
         class_data = self.get_class(class_id)
         return class_data.get("members", []) if class_data else []
-    
+
     def get_user_class(self, user_id: int) -> Optional[Dict]:
         user = self.get_user(user_id)
         if user and user.get("class_id"):
             return self.get_class(user["class_id"])
         return None
 
-db = Database()
\ No newline at end of file
+    def get_notification_recipients(self, class_id: str) -> List[int]:
+        """Участники класса, включившие уведомления об изменении ДЗ"""
+        users = self.get_users(self.get_users_in_class(class_id))
+        return [user_id for user_id, user in users.items()
+                if user and user.get("settings", {}).get("homework_notifications")]
+
+    # === Membership ===
+    def is_member(self, class_id: str, user_id: int) -> bool:
+        return user_id in self.get_users_in_class(class_id)
+
+    def has_join_request(self, class_id: str, user_id: int) -> bool:
+        class_data = self.get_class(class_id)
+        return bool(class_data) and user_id in class_data["join_requests"]
+
+    def get_member_class(self, user_id: int) -> Optional[str]:
+        """Класс, в списке участников которого состоит пользователь"""
+        for class_id, class_data in self.get_all_classes().items():
+            if user_id in class_data.get("members", []):
+                return class_id
+        return None
+
+    # === Pages ===
+    # Курсор страниц как в paginate(): anchor - крайний элемент соседней
+    # страницы, position - его позиция. Возвращают позицию начала
+    # страницы, её элементы и длину всего списка.
+    def get_class_list_page(self, class_id: str, field: str, size: int, anchor: Optional[int] = None,
+                            backward: bool = False, position: Optional[int] = None) -> Tuple[int, List[int], int]:
+        """Страница участников (field="members") или заявок (field="join_requests") класса"""
+        class_data = self.get_class(class_id)
+        items = class_data.get(field, []) if class_data else []
+        start, page = paginate(items, size, anchor, backward, position)
+        return start, page, len(items)
+
+    def get_id_page(self, table: str, size: int, anchor=None, backward: bool = False,
+                    position: Optional[int] = None) -> Tuple[int, List, int]:
+        """Страница id пользователей (table="users") или классов по возрастанию"""
+        ids = sorted(self.get_user_ids() if table == "users" else self.get_class_ids())
+        start, page = _sorted_page(ids, size, anchor, backward)
+        return start, page, len(ids)
+
+    # === Statistics ===
+    # Счётчики (см. stats.py) хранилища поддерживают при каждой записи,
+    # поэтому get_stats() не зависит от числа пользователей и классов.
+    def record_activity(self, user_id: int, day: Optional[str] = None) -> bool:
+        """Отметить, что пользователь писал боту в день day (по умолчанию сегодня).
+
+        Возвращает False, если пользователь в этот день уже отмечен.
+        """
+        raise NotImplementedError
+
+    def _activity_counts(self) -> Dict[str, int]:
+        """Число активных пользователей по дням из исходных данных"""
+        raise NotImplementedError
+
+    def _read_stats(self, keys: Iterable[str], prefixes: Iterable[str] = ()) -> Dict[str, int]:
+        """Значения счётчиков keys и всех счётчиков с префиксами prefixes"""
+        raise NotImplementedError
+
+    def _all_stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def _replace_stats(self, values: Dict[str, int]):
+        raise NotImplementedError
+
+    def get_stats(self, days: int = 7) -> Dict:
+        """Сводка для админ-панели, активность - за последние days дней"""
+        recent = stats.recent_days(days)
+        return stats.summarize(self._read_stats(stats.keys_for(recent), stats.PREFIXES), recent)
+
+    def rebuild_stats(self, repair: bool = True) -> List[str]:
+        """Пересчитать счётчики по всем записям и сверить с текущими.
+
+        Возвращает расхождения; с repair=True счётчики заменяются
+        пересчитанными.
+        """
+        expected = stats.compute(self.get_all_users(), self.get_all_classes(), self._activity_counts())
+        problems = stats.diff(self._all_stats(), expected)
+        if problems and repair:
+            self._replace_stats(expected)
+        return problems
+
+    def check_consistency(self, repair: bool = False) -> List[str]:
+        """Найти расхождения между составом классов и class_id пользователей.
+
+        Главным считается список участников класса: пользователь, который
+        в нём есть, получает class_id этого класса, а class_id без записи
+        в списке сбрасывается. С repair=True расхождения исправляются.
+        """
+        users = self.get_all_users()
+        classes = self.get_all_classes()
+        problems = []
+        member_of: Dict[int, List[str]] = {}
+        for class_id, class_data in classes.items():
+            members = class_data.get("members", [])
+            if len(set(members)) != len(members):
+                problems.append(f"Класс {class_id}: повторяющиеся участники")
+            for user_id in dict.fromkeys(members):
+                member_of.setdefault(user_id, []).append(class_id)
+
+        dropped_members: Dict[str, set] = {class_id: set() for class_id in classes}
+        dropped_requests: Dict[str, set] = {class_id: set() for class_id in classes}
+        user_fixes: Dict[int, Optional[str]] = {}
+        for user_id, class_ids in member_of.items():
+            user = users.get(str(user_id))
+            if user is None:
+                problems.append(f"Пользователь {user_id} без профиля числится в классе {', '.join(class_ids)}")
+                for class_id in class_ids:
+                    dropped_members[class_id].add(user_id)
+                continue
+            keep = user.get("class_id") if user.get("class_id") in class_ids else class_ids[0]
+            for class_id in class_ids:
+                if class_id != keep:
+                    problems.append(f"Пользователь {user_id} числится в классах {keep} и {class_id}")
+                    dropped_members[class_id].add(user_id)
+            if user.get("class_id") != keep:
+                problems.append(f"Пользователь {user_id} состоит в классе {keep}, но class_id = {user.get('class_id')}")
+                user_fixes[user_id] = keep
+        for key, user in users.items():
+            if user.get("class_id") and int(key) not in member_of:
+                problems.append(f"Пользователь {key}: class_id = {user['class_id']}, но в списке класса его нет")
+                user_fixes[int(key)] = None
+        for class_id, class_data in classes.items():
+            members = set(class_data.get("members", []))
+            for user_id in class_data.get("join_requests", []):
+                if user_id in members or str(user_id) not in users:
+                    problems.append(f"Класс {class_id}: лишняя заявка от {user_id}")
+                    dropped_requests[class_id].add(user_id)
+
+        if repair:
+            for class_id in classes:
+                with self.transaction(class_id=class_id) as class_data:
+                    if not class_data:
+                        continue
+                    class_data["members"] = [user_id for user_id in dict.fromkeys(class_data["members"])
+                                             if user_id not in dropped_members[class_id]]
+                    class_data["join_requests"] = [user_id for user_id in dict.fromkeys(class_data["join_requests"])
+                                                   if user_id not in dropped_requests[class_id]]
+            for user_id, class_id in user_fixes.items():
+                with self.transaction(user_id=user_id) as user:
+                    if user:
+                        user["class_id"] = class_id
+                        if class_id is None:
+                            user["teamRole"] = None
+                        elif not user.get("teamRole"):
+                            user["teamRole"] = "участник"
+        return problems
+
+
+class Database(BaseDatabase):
+    """JSON-хранилище с резидентным кэшем.
+
+    Оба файла читаются один раз при старте, чтение идёт из памяти.
+    Записи помечают таблицу грязной и сбрасываются на диск фоновым
+    потоком после паузы в записях (debounce), а также принудительно в
+    close().
+
+    В режиме журнала (journal=True) users.json/classes.json служат
+    снимком, а каждое изменение дописывается одной строкой в journal.log;
+    при старте снимок загружается и журнал проигрывается поверх него.
+    Когда журнал вырастает больше compact_threshold, фоновый поток
+    записывает новый снимок и очищает журнал.
+
+    Файлы пишутся в формате storage_format (json, orjson, msgpack - см.
+    serializers.py), а читаются в любом из этих форматов.
+
+    В раскладке sharded (layout="sharded") каждая запись лежит в своём
+    файле, и сброс переписывает только изменённые записи. Журнал в этой
+    раскладке не нужен и не поддерживается.
+
+    История ДЗ дописывается в отдельный homework_history.log (см.
+    history.py) и в кэш не загружается.
+
+    Состав классов и заявки дублируются в памяти множествами, а для
+    пользователей ведётся обратный индекс user_id -> классы, поэтому
+    проверки членства - O(1). Вступление и выход не копируют запись
+    класса глубоко, но изменённый список участников или заявок заменяется
+    копией (O(размер класса)): записи кэша не меняются на месте. Запись
+    на диск по-прежнему сериализует весь класс (строка журнала) или всю
+    таблицу (раскладка single).
+    """
+
+    READ_METHODS = BaseDatabase.READ_METHODS | {"activity_entries"}
+
+    def __init__(self, data_dir: str = "data", flush_delay: float = FLUSH_DELAY,
+                 max_flush_delay: float = MAX_FLUSH_DELAY, journal: bool = JSON_JOURNAL,
+                 compact_threshold: int = JOURNAL_COMPACT_BYTES, layout: str = JSON_LAYOUT,
+                 storage_format: str = STORAGE_FORMAT, indent: Optional[int] = JSON_INDENT):
+        super().__init__()
+        if layout not in ("single", "sharded"):
+            raise ValueError(f"Unknown JSON layout: {layout}")
+        if layout == "sharded" and journal:
+            raise ValueError("Journal mode is not supported with the sharded layout")
+        self.data_dir = data_dir
+        self.sharded = layout == "sharded"
+        self._serializer = serializers.get_serializer(storage_format, indent)
+        self.users_file = os.path.join(self.data_dir, "users.json")
+        self.classes_file = os.path.join(self.data_dir, "classes.json")
+        self.users_dir = os.path.join(self.data_dir, "users")
+        self.classes_dir = os.path.join(self.data_dir, "classes")
+        self.journal_file = os.path.join(self.data_dir, "journal.log")
+        self.history_file = os.path.join(self.data_dir, "homework_history.log")
+        self.activity_file = os.path.join(self.data_dir, "activity.log")
+        self.flush_delay = flush_delay
+        self.max_flush_delay = max_flush_delay
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        # Поток сброса один на хранилище: запись только сдвигает срок сброса
+        self._flusher: Optional[threading.Thread] = None
+        self._flush_wakeup = threading.Condition()
+        self._flush_deadline: Optional[float] = None
+        self._flush_stopping = False
+        self._first_dirty_at: Optional[float] = None
+        self._dirty = {"users": set(), "classes": set()}
+        self._journal_buffer: List[str] = []
+        self._compactor: Optional[threading.Thread] = None
+        self._members: Dict[str, set] = {}
+        self._requests: Dict[str, set] = {}
+        self._user_classes: Dict[int, set] = {}
+        self._stats = Counter()
+        # Отметки активности: {день: user_id} за последние дни и ещё не
+        # записанные в activity.log пары (день, user_id), под _activity_lock
+        self._activity_lock = threading.Lock()
+        self._active_users: Dict[str, set] = {}
+        self._activity_buffer: List[Tuple[str, int]] = []
+
+        self._ensure_directories()
+        self._init_files()
+        self._history = history.HistoryLog(self.history_file)
+        if self.sharded:
+            self._users = self._load_users_dir()
+            self._classes = self._load_classes_dir()
+        else:
+            self._users = self._load(self.users_file)
+            self._classes = self._load(self.classes_file)
+        self._tables = {"users": self._users, "classes": self._classes}
+        self._files = {"users": self.users_file, "classes": self.classes_file}
+        if os.path.exists(self.journal_file):
+            self._replay_journal()
+            if not self.journal:
+                # Журнал остался от прошлого запуска в режиме журнала
+                self.compact()
+        self._rebuild_indexes()
+        # id записей по возрастанию для постраничных списков админ-панели
+        self._sorted_ids = {"users": sorted(int(user_id) for user_id, user in self._users.items() if user),
+                            "classes": sorted(class_id for class_id, class_data in self._classes.items() if class_data)}
+        self._stats = stats.compute(self._users, self._classes, self._load_activity())
+        atexit.register(self.close)
+
+    def _ensure_directories(self):
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def _init_files(self):
+        if self.sharded:
+            if not os.path.exists(self.users_dir) and os.path.exists(self.users_file):
+                # Не стартуем с пустой базой рядом с неперенесёнными данными
+                raise RuntimeError(f"{self.users_file} is not migrated to the sharded layout, "
+                                   f"run: python manage.py migrate-sharded")
+            os.makedirs(self.users_dir, exist_ok=True)
+            os.makedirs(self.classes_dir, exist_ok=True)
+            return
+
+        for path in (self.users_file, self.classes_file):
+            if not os.path.exists(path):
+                atomic_write(path, self._serializer.dumps({}))
+
+    def _load(self, path: str) -> Dict:
+        with open(path, 'rb') as f:
+            return serializers.loads(f.read())
+
+    # === Sharded layout ===
+    def _record_path(self, table: str, key: str) -> str:
+        if table == "users":
+            return os.path.join(self.users_dir, f"{int(key) % USER_SHARDS:02x}", f"{key}.json")
+        # id класса вводят пользователи: кодируем всё, кроме букв и цифр
+        return os.path.join(self.classes_dir, quote(key, safe="") + ".json")
+
+    @staticmethod
+    def _record_files(directory: str):
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".json") and not entry.name.startswith(".tmp-"):
+                yield entry.name[:-len(".json")], entry.path
+
+    def _load_users_dir(self) -> Dict:
+        users = {}
+        for shard in os.scandir(self.users_dir):
+            if shard.is_dir():
+                for key, path in self._record_files(shard.path):
+                    users[key] = self._load(path)
+        return users
+
+    def _load_classes_dir(self) -> Dict:
+        return {unquote(key): self._load(path) for key, path in self._record_files(self.classes_dir)}
+
+    def _write_record(self, path: str, record: Optional[Dict]):
+        if record is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, self._serializer.dumps(record))
+
+    # === Homework history ===
+    def _revision_count(self, class_id: str, subject: str) -> int:
+        return self._history.count(class_id, subject)
+
+    def _append_revisions(self, class_id: str, subject: str, entries: List[Dict]):
+        self._history.append(class_id, subject, entries)
+
+    def _read_revisions(self, class_id: str, subject: str, since_rev: int = 1) -> List[Dict]:
+        return self._history.read(class_id, subject, since_rev)
+
+    # === Journal ===
+    def _replay_journal(self) -> int:
+        started = time.perf_counter()
+        count = 0
+        valid_size = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.strip() else None
+                    if line.strip() and not line.endswith(b"\n"):
+                        raise ValueError("unterminated entry")
+                except ValueError:
+                    # Недописанная последняя строка после сбоя: отрезаем её,
+                    # чтобы новые записи не склеились с мусором
+                    logger.warning("Truncating damaged journal tail in %s", self.journal_file)
+                    break
+                valid_size += len(line)
+                if entry is None:
+                    continue
+                table = self._tables[entry["t"]]
+                if entry["v"] is None:
+                    table.pop(entry["k"], None)
+                else:
+                    table[entry["k"]] = entry["v"]
+                count += 1
+        if valid_size != os.path.getsize(self.journal_file):
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(valid_size)
+        logger.info("Replayed %d journal entries in %.3fs", count, time.perf_counter() - started)
+        return count
+
+    def _append_journal(self, lines: List[str]):
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        metrics.storage_serialized_bytes.inc(len(data), "json")
+        with open(self.journal_file, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_file)
+        except OSError:
+            return 0
+
+    def compact(self):
+        """Записать новый снимок и очистить журнал"""
+        with self._flush_lock:
+            with self._lock:
+                lines, self._journal_buffer = self._journal_buffer, []
+                # Записи в кэше не изменяются на месте, поэтому хватает
+                # поверхностной копии таблиц
+                tables = {name: dict(table) for name, table in self._tables.items()}
+                for keys in self._dirty.values():
+                    keys.clear()
+            if lines:
+                self._append_journal(lines)
+            for name, table in tables.items():
+                if self.sharded:
+                    for key, record in table.items():
+                        self._write_record(self._record_path(name, key), record)
+                else:
+                    atomic_write(self._files[name], self._serializer.dumps(table))
+            with open(self.journal_file, 'w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            if not self.journal:
+                os.unlink(self.journal_file)
+
+    def _maybe_compact(self):
+        if self._journal_size() < self.compact_threshold:
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, name="journal-compactor", daemon=True)
+            self._compactor.start()
+
+    # === Cache / Flush ===
+    def _mark_dirty(self, table: str, key: str):
+        with self._lock:
+            self._dirty[table].add(key)
+            if self.journal:
+                self._journal_buffer.append(json.dumps(
+                    {"t": table, "k": key, "v": self._tables[table].get(key)},
+                    ensure_ascii=False, separators=(",", ":")
+                ))
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Назначить фоновый сброс, вызывать под _lock"""
+        now = time.monotonic()
+        if self._first_dirty_at is None:
+            self._first_dirty_at = now
+        # Откладываем сброс при каждой записи, но не дольше max_flush_delay
+        deadline = now + min(self.flush_delay, self.max_flush_delay - (now - self._first_dirty_at))
+        with self._flush_wakeup:
+            earlier = self._flush_deadline is None or deadline < self._flush_deadline
+            self._flush_deadline = deadline
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flush_stopping = False
+                self._flusher = threading.Thread(target=self._flush_loop, name="json-flusher", daemon=True)
+                self._flusher.start()
+            elif earlier:
+                # Более поздний срок поток увидит сам, проснувшись к прежнему
+                self._flush_wakeup.notify()
+
+    def _flush_loop(self):
+        """Фоновый сброс: ждать наступления _flush_deadline и вызывать flush()"""
+        while True:
+            with self._flush_wakeup:
+                while not self._flush_stopping:
+                    if self._flush_deadline is None:
+                        self._flush_wakeup.wait()
+                        continue
+                    remaining = self._flush_deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._flush_wakeup.wait(remaining)
+                if self._flush_stopping:
+                    return
+                self._flush_deadline = None
+            try:
+                self.flush()
+            except Exception:
+                # Уже записано в лог flush(); изменения остались грязными
+                pass
+
+    def flush(self):
+        """Сбросить изменения на диск: дописать журнал или переписать грязные таблицы"""
+        with self._flush_lock:
+            with self._lock:
+                with self._flush_wakeup:
+                    self._flush_deadline = None
+                self._first_dirty_at = None
+                lines, self._journal_buffer = self._journal_buffer, []
+                if self.sharded:
+                    # Только изменённые записи, каждая в свой файл
+                    records = [(self._record_path(name, key), self._tables[name].get(key))
+                               for name, keys in self._dirty.items() for key in keys]
+                    pending = []
+                else:
+                    records = []
+                    pending = [(self._files[name], dict(self._tables[name]))
+                               for name, keys in self._dirty.items() if keys and not self.journal]
+                dirty = {table: set(keys) for table, keys in self._dirty.items()}
+                for keys in self._dirty.values():
+                    keys.clear()
+
+            try:
+                if lines:
+                    self._append_journal(lines)
+                for path, record in records:
+                    self._write_record(path, record)
+                for path, table in pending:
+                    atomic_write(path, self._serializer.dumps(table))
+            except Exception:
+                logger.exception("Failed to flush database")
+                with self._lock:
+                    self._journal_buffer[:0] = lines
+                    for table, keys in dirty.items():
+                        self._dirty[table].update(keys)
+                raise
+            self._flush_activity()
+        if self.journal:
+            self._maybe_compact()
+
+    def close(self):
+        self.flush()
+        with self._flush_wakeup:
+            flusher, self._flusher = self._flusher, None
+            self._flush_stopping = True
+            self._flush_wakeup.notify()
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        # Закрытое хранилище больше не сбрасывается при выходе
+        atexit.unregister(self.close)
+
+    # === Indexes ===
+    def _rebuild_indexes(self):
+        with self._lock:
+            self._members, self._requests, self._user_classes = {}, {}, {}
+            for class_id, class_data in self._classes.items():
+                self._index_class(class_id, class_data)
+
+    def _index_class(self, class_id: str, class_data: Optional[Dict]):
+        for user_id in self._members.pop(class_id, ()):
+            self._user_classes[user_id].discard(class_id)
+            if not self._user_classes[user_id]:
+                del self._user_classes[user_id]
+        self._requests.pop(class_id, None)
+        if class_data is None:
+            return
+        self._members[class_id] = set(class_data.get("members") or [])
+        self._requests[class_id] = set(class_data.get("join_requests") or [])
+        for user_id in self._members[class_id]:
+            self._user_classes.setdefault(user_id, set()).add(class_id)
+
+    def _index_member(self, class_id: str, user_id: int, member: bool):
+        if member:
+            self._members[class_id].add(user_id)
+            self._user_classes.setdefault(user_id, set()).add(class_id)
+        else:
+            self._members[class_id].discard(user_id)
+            classes = self._user_classes.get(user_id)
+            if classes is not None:
+                classes.discard(class_id)
+                if not classes:
+                    del self._user_classes[user_id]
+
+    def _replace(self, table: str, key: str, record: Dict, **fields):
+        """Заменить запись в кэше её поверхностной копией с новыми полями.
+
+        Записи кэша не изменяются на месте (их сериализуют без блокировки),
+        поэтому вложенные объекты можно разделять со старой версией.
+        """
+        self._put(table, key, dict(record, **fields))
+
+    def _put(self, table: str, key: str, record: Optional[Dict]):
+        """Положить запись в кэш (под _lock), обновив счётчики статистики"""
+        old = self._tables[table].get(key)
+        stats.apply(self._stats, table, old, record)
+        if (old is None) != (record is None):
+            ids, value = self._sorted_ids[table], int(key) if table == "users" else key
+            if record is None:
+                del ids[bisect.bisect_left(ids, value)]
+                if table == "classes":
+                    self.homework_render_cache.discard(key)
+            else:
+                bisect.insort(ids, value)
+        self._tables[table][key] = record
+        self._mark_dirty(table, key)
+
+    def _check_indexes(self) -> List[str]:
+        with self._lock:
+            current = (self._members, self._requests, self._user_classes)
+            self._rebuild_indexes()
+            if current != (self._members, self._requests, self._user_classes):
+                return ["Индексы участников и заявок расходились с данными и перестроены"]
+        return []
+
+    def check_consistency(self, repair: bool = False) -> List[str]:
+        return self._check_indexes() + super().check_consistency(repair)
+
+    def _save_batch(self, class_id: str, class_data: Optional[Dict], users: Dict[int, Optional[Dict]]):
+        # Под общей блокировкой сброс на диск увидит пачку целиком
+        with self._lock:
+            super()._save_batch(class_id, class_data, users)
+
+    # === Statistics ===
+    # Счётчики живут только в памяти и пересчитываются при старте из
+    # кэша; активность копится в _activity_buffer и при сбросе дописывается
+    # строками "день user_id" в activity.log. Файл и буфер меняются только
+    # под _activity_lock.
+    def _read_activity(self) -> List[Tuple[str, int]]:
+        """Пары (день, user_id) из activity.log и буфера без повторов, под _activity_lock"""
+        entries = {}
+        if os.path.exists(self.activity_file):
+            with open(self.activity_file, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1].isdigit():
+                        entries[(parts[0], int(parts[1]))] = None
+        entries.update(dict.fromkeys(self._activity_buffer))
+        return list(entries)
+
+    def activity_entries(self) -> List[Tuple[str, int]]:
+        """Пары (день, user_id), отмеченные record_activity(), без повторов"""
+        with self._activity_lock:
+            return self._read_activity()
+
+    def _load_activity(self) -> Dict[str, int]:
+        with self._activity_lock:
+            entries = self._read_activity()
+            today = date.today().isoformat()
+            self._active_users = {today: {user_id for day, user_id in entries if day == today}}
+        return Counter(day for day, _ in entries)
+
+    def _flush_activity(self):
+        with self._activity_lock:
+            if not self._activity_buffer:
+                return
+            try:
+                with open(self.activity_file, 'a', encoding='utf-8') as f:
+                    f.writelines(f"{day} {user_id}\n" for day, user_id in self._activity_buffer)
+            except OSError:
+                logger.exception("Failed to write %s", self.activity_file)
+                raise
+            self._activity_buffer.clear()
+
+    def record_activity(self, user_id: int, day: Optional[str] = None) -> bool:
+        day = day or date.today().isoformat()
+        with self._activity_lock:
+            users = self._active_users.get(day)
+            if users is None:
+                # Новый день или запоздалая отметка за давний день
+                users = self._active_users[day] = {known for known_day, known in self._read_activity()
+                                                   if known_day == day}
+                for old_day in sorted(self._active_users)[:-ACTIVITY_DAYS_CACHED]:
+                    del self._active_users[old_day]
+            if user_id in users:
+                return False
+            users.add(user_id)
+            self._activity_buffer.append((day, user_id))
+            # Под _lock только счётчик и срок сброса, файл пишет flush()
+            with self._lock:
+                self._stats[f"active:{day}"] += 1
+                self._schedule_flush()
+        return True
+
+    def _activity_counts(self) -> Dict[str, int]:
+        with self._activity_lock:
+            return Counter(day for day, _ in self._read_activity())
+
+    def _read_stats(self, keys: Iterable[str], prefixes: Iterable[str] = ()) -> Dict[str, int]:
+        prefixes = tuple(prefixes)
+        with self._lock:
+            values = {key: self._stats[key] for key in keys}
+            if prefixes:
+                values.update((key, value) for key, value in self._stats.items() if key.startswith(prefixes))
+            return values
+
+    def _all_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {key: value for key, value in self._stats.items() if value}
+
+    def _replace_stats(self, values: Dict[str, int]):
+        with self._lock:
+            self._stats = Counter(values)
+
+    # === Records ===
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        with self._lock:
+            return copy.deepcopy(self._users.get(str(user_id)))
+
+    # Пакетные чтения берут блокировку один раз: согласованный снимок
+    def get_users(self, user_ids: Iterable[int]) -> Dict[int, Optional[Dict]]:
+        with self._lock:
+            return {user_id: copy.deepcopy(self._users.get(str(user_id))) for user_id in user_ids}
+
+    def get_classes(self, class_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        with self._lock:
+            return {class_id: copy.deepcopy(self._classes.get(class_id)) for class_id in class_ids}
+
+    def get_user_ids(self) -> List[int]:
+        with self._lock:
+            return [int(user_id) for user_id in self._users]
+
+    def get_class_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._classes)
+
+    def save_user(self, user_id: int, user_data: Dict):
+        with self._lock:
+            self._put("users", str(user_id), copy.deepcopy(user_data))
+
+    def get_class(self, class_id: str) -> Optional[Dict]:
+        with self._lock:
+            return copy.deepcopy(self._classes.get(class_id))
+
+    def save_class(self, class_id: str, class_data: Dict):
+        with self._lock:
+            self._index_class(class_id, class_data)
+            self._put("classes", class_id, copy.deepcopy(class_data))
+
+    def get_all_classes(self) -> Dict:
+        with self._lock:
+            return copy.deepcopy(self._classes)
+
+    def get_all_users(self) -> Dict:
+        with self._lock:
+            return copy.deepcopy(self._users)
+
+    # === Membership ===
+    def is_member(self, class_id: str, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._members.get(class_id, ())
+
+    def has_join_request(self, class_id: str, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._requests.get(class_id, ())
+
+    def get_member_class(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            classes = self._user_classes.get(user_id)
+            return min(classes) if classes else None
+
+    def get_users_in_class(self, class_id: str) -> List[int]:
+        with self._lock:
+            class_data = self._classes.get(class_id)
+            return list(class_data["members"]) if class_data else []
+
+    def get_class_list_page(self, class_id: str, field: str, size: int, anchor: Optional[int] = None,
+                            backward: bool = False, position: Optional[int] = None) -> Tuple[int, List[int], int]:
+        # Списки в кэше не меняются на месте: страница берётся без копии записи
+        with self._lock:
+            class_data = self._classes.get(class_id)
+            items = class_data.get(field, []) if class_data else []
+            start, page = paginate(items, size, anchor, backward, position)
+            return start, page, len(items)
+
+    def get_id_page(self, table: str, size: int, anchor=None, backward: bool = False,
+                    position: Optional[int] = None) -> Tuple[int, List, int]:
+        with self._lock:
+            ids = self._sorted_ids[table]
+            start, page = _sorted_page(ids, size, anchor, backward)
+            return start, page, len(ids)
+
+    # Операции ниже меняют только нужные поля записей прямо в кэше.
+    # Блокировки записей берутся так же, как в transaction().
+    def add_join_request(self, class_id: str, user_id: int):
+        with self._record_locks(*self._lock_keys(class_id=class_id)), self._lock:
+            class_data = self._classes.get(class_id)
+            if not class_data or user_id in self._requests[class_id]:
+                return
+            self._requests[class_id].add(user_id)
+            self._replace("classes", class_id, class_data,
+                          join_requests=class_data["join_requests"] + [user_id])
+
+    def process_join_request(self, class_id: str, user_id: int, accept: bool):
+        with self._record_locks(*self._lock_keys(class_id, user_id)), self._lock:
+            class_data = self._classes.get(class_id)
+            if not class_data or user_id not in self._requests[class_id]:
+                return False
+            self._requests[class_id].discard(user_id)
+            fields = {"join_requests": [request for request in class_data["join_requests"] if request != user_id]}
+            if accept:
+                if user_id not in self._members[class_id]:
+                    fields["members"] = class_data["members"] + [user_id]
+                    self._index_member(class_id, user_id, True)
+                user = self._users.get(str(user_id))
+                if user:
+                    self._replace("users", str(user_id), user, class_id=class_id, teamRole="участник")
+            self._replace("classes", class_id, class_data, **fields)
+            return True
+
+    def add_member(self, class_id: str, user_id: int, team_role: str = "участник"):
+        with self._record_locks(*self._lock_keys(class_id, user_id)), self._lock:
+            class_data = self._classes.get(class_id)
+            if not class_data:
+                return False
+            if user_id not in self._members[class_id]:
+                self._index_member(class_id, user_id, True)
+                self._replace("classes", class_id, class_data, members=class_data["members"] + [user_id])
+            user = self._users.get(str(user_id))
+            if user:
+                self._replace("users", str(user_id), user, class_id=class_id, teamRole=team_role)
+            return True
+
+    def remove_member(self, class_id: str, user_id: int):
+        with self._record_locks(*self._lock_keys(class_id, user_id)), self._lock:
+            class_data = self._classes.get(class_id)
+            if not class_data or user_id not in self._members[class_id]:
+                return False
+            self._index_member(class_id, user_id, False)
+            self._replace("classes", class_id, class_data,
+                          members=[member for member in class_data["members"] if member != user_id])
+            user = self._users.get(str(user_id))
+            if user:
+                self._replace("users", str(user_id), user, class_id=None)
+            return True
+
+    def get_notification_recipients(self, class_id: str) -> List[int]:
+        # Смотрим записи прямо в кэше, без копирования
+        with self._lock:
+            class_data = self._classes.get(class_id)
+            if not class_data:
+                return []
+            recipients = []
+            for user_id in class_data["members"]:
+                user = self._users.get(str(user_id))
+                if user and user.get("settings", {}).get("homework_notifications"):
+                    recipients.append(user_id)
+            return recipients
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    profile TEXT NOT NULL DEFAULT '{}',
+    project_status TEXT NOT NULL DEFAULT 'Member',
+    class_id TEXT,
+    team_role TEXT,
+    created_at TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_users_class_id ON users(class_id);
+CREATE INDEX IF NOT EXISTS idx_users_project_status ON users(project_status);
+
+CREATE TABLE IF NOT EXISTS classes (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    information TEXT NOT NULL DEFAULT '',
+    created_at TEXT,
+    created_by INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}',
+    homework_version INTEGER NOT NULL DEFAULT 0,
+    homework_updated_at TEXT,
+    member_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS class_members (
+    class_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (class_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_class_members_user_id ON class_members(user_id);
+-- Строки класса в порядке rowid (порядок вступления) для страниц списка
+CREATE INDEX IF NOT EXISTS idx_class_members_class_id ON class_members(class_id);
+
+CREATE TABLE IF NOT EXISTS join_requests (
+    class_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (class_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_join_requests_user_id ON join_requests(user_id);
+CREATE INDEX IF NOT EXISTS idx_join_requests_class_id ON join_requests(class_id);
+
+CREATE TABLE IF NOT EXISTS class_homework (
+    class_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (class_id, subject)
+);
+
+CREATE TABLE IF NOT EXISTS personal_homework (
+    user_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (user_id, subject)
+);
+
+CREATE TABLE IF NOT EXISTS homework_history (
+    class_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (class_id, subject, rev)
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_activity (
+    day TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+);
+"""
+
+
+def _stat(key: str, delta: str) -> str:
+    return (f"INSERT INTO stats (key, value) VALUES ({key}, {delta}) "
+            f"ON CONFLICT(key) DO UPDATE SET value = value + excluded.value;")
+
+
+def _homework_key(row: str) -> str:
+    return (f"CASE WHEN {row}.homework_updated_at IS NULL THEN 'homework_never' "
+            f"ELSE 'homework_day:' || substr({row}.homework_updated_at, 1, 10) END")
+
+
+# Триггеры ведут счётчики stats (ключи - см. stats.py) в той же транзакции,
+# что и запись. Число участников класса хранится в classes.member_count.
+SQLITE_STATS_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+    {_stat("'users'", "1")}
+    {_stat("'status:' || NEW.project_status", "1")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+    {_stat("'users'", "-1")}
+    {_stat("'status:' || OLD.project_status", "-1")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_status AFTER UPDATE OF project_status ON users
+WHEN OLD.project_status IS NOT NEW.project_status BEGIN
+    {_stat("'status:' || OLD.project_status", "-1")}
+    {_stat("'status:' || NEW.project_status", "1")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_classes_insert AFTER INSERT ON classes BEGIN
+    {_stat("'classes'", "1")}
+    {_stat("'class_size:' || NEW.member_count", "1")}
+    {_stat("'members'", "NEW.member_count")}
+    {_stat(_homework_key("NEW"), "1")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_classes_delete AFTER DELETE ON classes BEGIN
+    {_stat("'classes'", "-1")}
+    {_stat("'class_size:' || OLD.member_count", "-1")}
+    {_stat("'members'", "-OLD.member_count")}
+    {_stat(_homework_key("OLD"), "-1")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_classes_size AFTER UPDATE OF member_count ON classes
+WHEN OLD.member_count != NEW.member_count BEGIN
+    {_stat("'class_size:' || OLD.member_count", "-1")}
+    {_stat("'class_size:' || NEW.member_count", "1")}
+    {_stat("'members'", "NEW.member_count - OLD.member_count")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_classes_homework AFTER UPDATE OF homework_updated_at ON classes
+WHEN OLD.homework_updated_at IS NOT NEW.homework_updated_at BEGIN
+    {_stat(_homework_key("OLD"), "-1")}
+    {_stat(_homework_key("NEW"), "1")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_members_insert AFTER INSERT ON class_members BEGIN
+    UPDATE classes SET member_count = member_count + 1 WHERE id = NEW.class_id;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_members_delete AFTER DELETE ON class_members BEGIN
+    UPDATE classes SET member_count = member_count - 1 WHERE id = OLD.class_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_requests_insert AFTER INSERT ON join_requests
+WHEN EXISTS (SELECT 1 FROM classes WHERE id = NEW.class_id) BEGIN
+    {_stat("'join_requests'", "1")}
+END;
+CREATE TRIGGER IF NOT EXISTS stats_requests_delete AFTER DELETE ON join_requests
+WHEN EXISTS (SELECT 1 FROM classes WHERE id = OLD.class_id) BEGIN
+    {_stat("'join_requests'", "-1")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_activity_insert AFTER INSERT ON user_activity BEGIN
+    {_stat("'active:' || NEW.day", "1")}
+END;
+"""
+
+# Поля записей, которые хранятся в отдельных колонках/таблицах.
+# Всё остальное попадает в колонку extra.
+USER_FIELDS = ("id", "name", "profile", "projectStatus", "class_id", "teamRole",
+               "personal_homework", "created_at")
+CLASS_FIELDS = ("id", "name", "homework", "information", "members", "join_requests",
+                "created_at", "created_by", "homework_version", "homework_updated_at")
+USER_COLUMNS = "id, name, profile, project_status, class_id, team_role, created_at, extra"
+CLASS_COLUMNS = "id, name, information, created_at, created_by, extra, homework_version, homework_updated_at"
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+SQLITE_MIGRATIONS = [
+    ("classes", "homework_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("classes", "homework_updated_at", "TEXT"),
+    ("classes", "member_count", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def _chunks(items: List, size: int = 500):
+    """Части списка для запросов с IN (...): число параметров SQLite ограничено"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteDatabase(BaseDatabase):
+    """SQLite-хранилище с тем же API, что и Database.
+
+    Записи разложены по таблицам, поэтому точечные операции (заявка,
+    участник, ДЗ по предмету) меняют одну строку, а не весь класс.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._migrate_schema()
+        self._conn.executescript(SQLITE_STATS_TRIGGERS)
+        if self._execute("SELECT 1 FROM stats LIMIT 1").fetchone() is None:
+            # База создана до появления статистики (или пустая)
+            if self.rebuild_stats():
+                logger.info("Built statistics counters for %s", path)
+
+    def _migrate_schema(self):
+        for table, column, definition in SQLITE_MIGRATIONS:
+            columns = {row[1] for row in self._execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока: в режиме WAL чтения идут параллельно"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self._conn.execute(sql, params)
+
+    @contextmanager
+    def _snapshot(self):
+        """Согласованное чтение нескольких таблиц"""
+        conn = self._conn
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _tx(self):
+        """Пишущая транзакция; вложенные вызовы используют внешнюю"""
+        conn = self._conn
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _write(self, statements):
+        """Выполнить набор (sql, params) в одной транзакции"""
+        with self._tx() as conn:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+
+    # === Row <-> record ===
+    # Записи собираются пачкой: по одному запросу на таблицу для всех
+    # строк, выбранных условием where.
+    def _load_users(self, where: str = "", params=()) -> Dict[int, Dict]:
+        rows = self._execute(f"SELECT {USER_COLUMNS} FROM users {where} ORDER BY rowid", params).fetchall()
+        homework: Dict[int, Dict] = {}
+        for user_id, subject, text in self._execute(
+            f"SELECT user_id, subject, text FROM personal_homework "
+            f"WHERE user_id IN (SELECT id FROM users {where}) ORDER BY rowid", params
+        ):
+            homework.setdefault(user_id, {})[subject] = text
+        return {row[0]: self._user_from_row(row, homework.get(row[0], {})) for row in rows}
+
+    def _load_classes(self, where: str = "", params=()) -> Dict[str, Dict]:
+        rows = self._execute(f"SELECT {CLASS_COLUMNS} FROM classes {where} ORDER BY rowid", params).fetchall()
+        selected = f"SELECT id FROM classes {where}"
+        homework: Dict[str, Dict] = {}
+        for class_id, subject, text in self._execute(
+            f"SELECT class_id, subject, text FROM class_homework WHERE class_id IN ({selected}) ORDER BY rowid",
+            params
+        ):
+            homework.setdefault(class_id, {})[subject] = text
+        members: Dict[str, List[int]] = {}
+        for class_id, user_id in self._execute(
+            f"SELECT class_id, user_id FROM class_members WHERE class_id IN ({selected}) ORDER BY rowid", params
+        ):
+            members.setdefault(class_id, []).append(user_id)
+        requests: Dict[str, List[int]] = {}
+        for class_id, user_id in self._execute(
+            f"SELECT class_id, user_id FROM join_requests WHERE class_id IN ({selected}) ORDER BY rowid", params
+        ):
+            requests.setdefault(class_id, []).append(user_id)
+        return {row[0]: self._class_from_row(row, homework.get(row[0], {}), members.get(row[0], []),
+                                             requests.get(row[0], []))
+                for row in rows}
+
+    @staticmethod
+    def _dumps(value) -> str:
+        """JSON для колонок profile/extra/entry; объём учитывается в метриках"""
+        text = json.dumps(value, ensure_ascii=False)
+        metrics.storage_serialized_bytes.inc(len(text.encode('utf-8')), "sqlite")
+        return text
+
+    @staticmethod
+    def _user_from_row(row, homework: Dict) -> Dict:
+        user_id, name, profile, status, class_id, team_role, created_at, extra = row
+        extra = json.loads(extra)
+        user = {
+            "id": user_id,
+            "name": name,
+            "profile": json.loads(profile),
+            "projectStatus": status,
+            "class_id": class_id,
+            "teamRole": team_role,
+            "personal_homework": homework,
+            "join_requests": extra.pop("join_requests", []),
+            "created_at": created_at
+        }
+        user.update(extra)
+        return user
+
+    @staticmethod
+    def _class_from_row(row, homework: Dict, members: List[int], requests: List[int]) -> Dict:
+        class_id, name, information, created_at, created_by, extra, homework_version, homework_updated_at = row
+        class_data = {
+            "id": class_id,
+            "name": name,
+            "homework": homework,
+            "information": information,
+            "members": members,
+            "join_requests": requests,
+            "created_at": created_at,
+            "created_by": created_by,
+            "homework_version": homework_version,
+            "homework_updated_at": homework_updated_at
+        }
+        class_data.update(json.loads(extra))
+        return class_data
+
+    def _sync_rows(self, conn: sqlite3.Connection, table: str, owner_column: str, owner, key_column: str,
+                   wanted: Dict, value_column: Optional[str] = None):
+        """Привести строки владельца в table к wanted ({ключ: значение}).
+
+        Пишутся только отличающиеся строки: триггеры статистики и индексы
+        не трогаются ради неизменившихся участников и предметов. Порядок
+        строк (rowid) - порядок ключей в записи, поэтому строки после
+        первого переставленного ключа вставляются заново.
+        """
+        columns = f"{key_column}, {value_column}" if value_column else f"{key_column}, NULL"
+        current = dict(conn.execute(f"SELECT {columns} FROM {table} WHERE {owner_column} = ? ORDER BY rowid",
+                                    (owner,)))
+        kept = [key for key in current if key in wanted]
+        position = 0
+        for key in wanted:
+            if position == len(kept) or kept[position] != key:
+                break
+            position += 1
+        stale = set(kept[position:])
+        conn.executemany(f"DELETE FROM {table} WHERE {owner_column} = ? AND {key_column} = ?",
+                         [(owner, key) for key in current if key not in wanted or key in stale])
+        current = {key: value for key, value in current.items() if key in wanted and key not in stale}
+        if value_column:
+            conn.executemany(f"UPDATE {table} SET {value_column} = ? WHERE {owner_column} = ? AND {key_column} = ?",
+                             [(value, owner, key) for key, value in wanted.items()
+                              if key in current and current[key] != value])
+            conn.executemany(f"INSERT INTO {table} ({owner_column}, {key_column}, {value_column}) VALUES (?, ?, ?)",
+                             [(owner, key, value) for key, value in wanted.items() if key not in current])
+        else:
+            conn.executemany(f"INSERT INTO {table} ({owner_column}, {key_column}) VALUES (?, ?)",
+                             [(owner, key) for key in wanted if key not in current])
+
+    def _save_user_rows(self, conn: sqlite3.Connection, user_id: int, user_data: Dict):
+        extra = {k: v for k, v in user_data.items() if k not in USER_FIELDS}
+        conn.execute(
+            "INSERT INTO users (id, name, profile, project_status, class_id, team_role, created_at, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET name = excluded.name, profile = excluded.profile, "
+            "project_status = excluded.project_status, class_id = excluded.class_id, "
+            "team_role = excluded.team_role, created_at = excluded.created_at, extra = excluded.extra",
+            (int(user_id), user_data.get("name"),
+             self._dumps(user_data.get("profile") or {}),
+             user_data.get("projectStatus") or "Member", user_data.get("class_id"),
+             user_data.get("teamRole"), user_data.get("created_at"),
+             self._dumps(extra))
+        )
+        self._sync_rows(conn, "personal_homework", "user_id", int(user_id), "subject",
+                        user_data.get("personal_homework") or {}, "text")
+
+    def _save_class_rows(self, conn: sqlite3.Connection, class_id: str, class_data: Dict):
+        extra = {k: v for k, v in class_data.items() if k not in CLASS_FIELDS}
+        conn.execute(
+            "INSERT INTO classes (id, name, information, created_at, created_by, extra, homework_version, "
+            "homework_updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET name = excluded.name, information = excluded.information, "
+            "created_at = excluded.created_at, created_by = excluded.created_by, extra = excluded.extra, "
+            "homework_version = excluded.homework_version, homework_updated_at = excluded.homework_updated_at",
+            (class_id, class_data.get("name"), class_data.get("information") or "",
+             class_data.get("created_at"), class_data.get("created_by"),
+             self._dumps(extra), class_data.get("homework_version", 0), class_data.get("homework_updated_at"))
+        )
+        self._sync_rows(conn, "class_homework", "class_id", class_id, "subject",
+                        class_data.get("homework") or {}, "text")
+        self._sync_rows(conn, "class_members", "class_id", class_id, "user_id",
+                        dict.fromkeys(class_data.get("members") or []))
+        self._sync_rows(conn, "join_requests", "class_id", class_id, "user_id",
+                        dict.fromkeys(class_data.get("join_requests") or []))
+
+    # === Records ===
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        with self._snapshot():
+            return self._load_users("WHERE id = ?", (int(user_id),)).get(int(user_id))
+
+    def save_user(self, user_id: int, user_data: Dict):
+        with self._tx() as conn:
+            self._save_user_rows(conn, user_id, user_data)
+
+    def get_class(self, class_id: str) -> Optional[Dict]:
+        with self._snapshot():
+            return self._load_classes("WHERE id = ?", (class_id,)).get(class_id)
+
+    def save_class(self, class_id: str, class_data: Dict):
+        with self._tx() as conn:
+            self._save_class_rows(conn, class_id, class_data)
+
+    def get_users(self, user_ids: Iterable[int]) -> Dict[int, Optional[Dict]]:
+        user_ids = list(user_ids)
+        found: Dict[int, Dict] = {}
+        with self._snapshot():
+            for chunk in _chunks(list({int(user_id) for user_id in user_ids})):
+                found.update(self._load_users(f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+        return {user_id: found.get(int(user_id)) for user_id in user_ids}
+
+    def get_classes(self, class_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        class_ids = list(class_ids)
+        found: Dict[str, Dict] = {}
+        with self._snapshot():
+            for chunk in _chunks(list(set(class_ids))):
+                found.update(self._load_classes(f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+        return {class_id: found.get(class_id) for class_id in class_ids}
+
+    def get_all_users(self) -> Dict:
+        with self._snapshot():
+            return {str(user_id): user for user_id, user in self._load_users().items()}
+
+    def get_all_classes(self) -> Dict:
+        with self._snapshot():
+            return self._load_classes()
+
+    def get_user_ids(self) -> List[int]:
+        return [user_id for user_id, in self._execute("SELECT id FROM users ORDER BY rowid")]
+
+    def get_class_ids(self) -> List[str]:
+        return [class_id for class_id, in self._execute("SELECT id FROM classes ORDER BY rowid")]
+
+    def _write_scope(self):
+        # Чтение и запись идут в одной транзакции SQLite: так транзакция
+        # не затрёт изменения строчных операций ниже и других процессов
+        return self._tx()
+
+    def _save_records(self, class_id: Optional[str], class_data: Optional[Dict],
+                      user_id: Optional[int], user: Optional[Dict]):
+        with self._tx() as conn:
+            if class_data is not None:
+                self._save_class_rows(conn, class_id, class_data)
+            if user is not None:
+                self._save_user_rows(conn, user_id, user)
+
+    def _save_batch(self, class_id: str, class_data: Optional[Dict], users: Dict[int, Optional[Dict]]):
+        with self._tx() as conn:
+            if class_data is not None:
+                self._save_class_rows(conn, class_id, class_data)
+            for user_id, user in users.items():
+                if user is not None:
+                    self._save_user_rows(conn, user_id, user)
+
+    # === Row-level operations ===
+    def _update_extra(self, conn: sqlite3.Connection, table: str, key, change) -> bool:
+        """Изменить поля записи, хранящиеся в колонке extra"""
+        row = conn.execute(f"SELECT extra FROM {table} WHERE id = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        extra = json.loads(row[0])
+        change(extra)
+        conn.execute(f"UPDATE {table} SET extra = ? WHERE id = ?", (self._dumps(extra), key))
+        return True
+
+    @staticmethod
+    def _bump_homework_version(conn: sqlite3.Connection, class_id: str) -> bool:
+        return conn.execute(
+            "UPDATE classes SET homework_version = homework_version + 1, homework_updated_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), class_id)
+        ).rowcount > 0
+
+    # Проверка и изменение выполняются в одной транзакции SQLite,
+    # поэтому блокировки записей здесь не нужны.
+    def update_user_status(self, user_id: int, status: str):
+        self._write([("UPDATE users SET project_status = ? WHERE id = ?", (status, int(user_id)))])
+
+    def update_user_class(self, user_id: int, class_id: Optional[str], team_role: Optional[str] = None):
+        if team_role:
+            self._write([("UPDATE users SET class_id = ?, team_role = ? WHERE id = ?",
+                          (class_id, team_role, int(user_id)))])
+        else:
+            self._write([("UPDATE users SET class_id = ? WHERE id = ?", (class_id, int(user_id)))])
+
+    def add_personal_homework(self, user_id: int, subject: str, homework: str,
+                              due: Optional[str] = None, attachments: Optional[List[Dict]] = None):
+        with self._tx() as conn:
+            def change(extra: Dict):
+                extra["personal_homework_version"] = extra.get("personal_homework_version", 0) + 1
+                self._set_homework_meta(extra.setdefault("personal_homework_meta", {}), subject, due, attachments)
+
+            if not self._update_extra(conn, "users", int(user_id), change):
+                return
+            conn.execute(
+                "INSERT INTO personal_homework (user_id, subject, text) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id, subject) DO UPDATE SET text = excluded.text",
+                (int(user_id), subject, homework)
+            )
+        self._reindex_homework(user_id=user_id)
+
+    def add_join_request(self, class_id: str, user_id: int):
+        with self._tx() as conn:
+            if not conn.execute("SELECT 1 FROM classes WHERE id = ?", (class_id,)).fetchone():
+                return
+            conn.execute("INSERT OR IGNORE INTO join_requests (class_id, user_id) VALUES (?, ?)",
+                         (class_id, user_id))
+
+    def process_join_request(self, class_id: str, user_id: int, accept: bool):
+        with self._tx() as conn:
+            deleted = conn.execute(
+                "DELETE FROM join_requests WHERE class_id = ? AND user_id = ?", (class_id, user_id)
+            ).rowcount
+            if not deleted:
+                return False
+            if accept:
+                conn.execute("INSERT OR IGNORE INTO class_members (class_id, user_id) VALUES (?, ?)",
+                             (class_id, user_id))
+                conn.execute("UPDATE users SET class_id = ?, team_role = ? WHERE id = ?",
+                             (class_id, "участник", user_id))
+        return True
+
+    def process_join_requests(self, class_id: str, user_ids: Optional[Iterable[int]] = None,
+                              accept: bool = True) -> List[int]:
+        with self._tx() as conn:
+            pending = [user_id for user_id, in conn.execute(
+                "SELECT user_id FROM join_requests WHERE class_id = ? ORDER BY rowid", (class_id,)
+            )]
+            if user_ids is not None:
+                wanted = set(user_ids)
+                pending = [user_id for user_id in pending if user_id in wanted]
+            conn.executemany("DELETE FROM join_requests WHERE class_id = ? AND user_id = ?",
+                             [(class_id, user_id) for user_id in pending])
+            if accept:
+                # Пользователи из других классов не принимаются
+                busy = set()
+                for chunk in _chunks(pending):
+                    busy.update(user_id for user_id, in conn.execute(
+                        f"SELECT id FROM users WHERE id IN ({', '.join('?' * len(chunk))}) "
+                        "AND class_id IS NOT NULL AND class_id != ?", (*chunk, class_id)
+                    ))
+                accepted = [user_id for user_id in pending if user_id not in busy]
+                conn.executemany("INSERT OR IGNORE INTO class_members (class_id, user_id) VALUES (?, ?)",
+                                 [(class_id, user_id) for user_id in accepted])
+                conn.executemany("UPDATE users SET class_id = ?, team_role = ? WHERE id = ?",
+                                 [(class_id, "участник", user_id) for user_id in accepted])
+        return pending
+
+    def add_member(self, class_id: str, user_id: int, team_role: str = "участник"):
+        with self._tx() as conn:
+            if not conn.execute("SELECT 1 FROM classes WHERE id = ?", (class_id,)).fetchone():
+                return False
+            conn.execute("INSERT OR IGNORE INTO class_members (class_id, user_id) VALUES (?, ?)",
+                         (class_id, user_id))
+            conn.execute("UPDATE users SET class_id = ?, team_role = ? WHERE id = ?",
+                         (class_id, team_role, user_id))
+        return True
+
+    def remove_member(self, class_id: str, user_id: int):
+        with self._tx() as conn:
+            deleted = conn.execute(
+                "DELETE FROM class_members WHERE class_id = ? AND user_id = ?", (class_id, user_id)
+            ).rowcount
+            if not deleted:
+                return False
+            conn.execute("UPDATE users SET class_id = NULL WHERE id = ?", (user_id,))
+        return True
+
+    def update_class_homework(self, class_id: str, homework_data: Dict, author_id: Optional[int] = None):
+        with self._tx() as conn:
+            if not self._bump_homework_version(conn, class_id):
+                return
+            old = dict(conn.execute("SELECT subject, text FROM class_homework WHERE class_id = ?", (class_id,)))
+            self._record_homework_changes(class_id, old, homework_data, author_id)
+            self._update_extra(conn, "classes", class_id, lambda extra: extra.update(homework_meta={
+                subject: meta for subject, meta in extra.get("homework_meta", {}).items() if subject in homework_data
+            }))
+            conn.execute("DELETE FROM class_homework WHERE class_id = ?", (class_id,))
+            conn.executemany("INSERT INTO class_homework (class_id, subject, text) VALUES (?, ?, ?)",
+                             [(class_id, subject, text) for subject, text in homework_data.items()])
+        self._reindex_homework(class_id=class_id)
+
+    def set_class_homework(self, class_id: str, subject: str, homework: str, author_id: Optional[int] = None,
+                           due: Optional[str] = None, attachments: Optional[List[Dict]] = None):
+        with self._tx() as conn:
+            if not self._bump_homework_version(conn, class_id):
+                return
+            row = conn.execute("SELECT text FROM class_homework WHERE class_id = ? AND subject = ?",
+                               (class_id, subject)).fetchone()
+            self._record_homework_changes(class_id, {subject: row[0] if row else None},
+                                          {subject: homework}, author_id)
+            self._update_extra(conn, "classes", class_id, lambda extra: self._set_homework_meta(
+                extra.setdefault("homework_meta", {}), subject, due, attachments))
+            conn.execute(
+                "INSERT INTO class_homework (class_id, subject, text) VALUES (?, ?, ?) "
+                "ON CONFLICT(class_id, subject) DO UPDATE SET text = excluded.text",
+                (class_id, subject, homework)
+            )
+        self._reindex_homework(class_id=class_id)
+
+    def update_class_information(self, class_id: str, information: str):
+        self._write([("UPDATE classes SET information = ? WHERE id = ?", (information, class_id))])
+
+    def archive_class_homework(self, class_id: str, subject: str, due: str) -> bool:
+        # Срок, архив и текст предмета меняются строчными запросами, без
+        # перезаписи участников и остальных предметов класса
+        with self._tx() as conn:
+            row = conn.execute(
+                "SELECT c.extra, h.text FROM classes c JOIN class_homework h ON h.class_id = c.id "
+                "WHERE c.id = ? AND h.subject = ?", (class_id, subject)
+            ).fetchone()
+            if row is None:
+                return False
+            record = dict(json.loads(row[0]), homework={subject: row[1]})
+            text = self._archive_homework(record, "homework", subject, due)
+            if text is None:
+                return False
+            del record["homework"]
+            self._record_homework_changes(class_id, {subject: text}, {}, None)
+            conn.execute("UPDATE classes SET extra = ? WHERE id = ?", (self._dumps(record), class_id))
+            conn.execute("DELETE FROM class_homework WHERE class_id = ? AND subject = ?", (class_id, subject))
+            self._bump_homework_version(conn, class_id)
+        self._reindex_homework(class_id=class_id)
+        return True
+
+    def revert_class_homework(self, class_id: str, subject: str, rev: int,
+                              author_id: Optional[int] = None) -> Optional[str]:
+        # Версия читается и текст пишется в одной транзакции; меняются
+        # только строка предмета и версия ДЗ класса
+        with self._tx() as conn:
+            if not conn.execute("SELECT 1 FROM classes WHERE id = ?", (class_id,)).fetchone():
+                return None
+            text = self.get_homework_revision(class_id, subject, rev)
+            if text is None:
+                return None
+            row = conn.execute("SELECT text FROM class_homework WHERE class_id = ? AND subject = ?",
+                               (class_id, subject)).fetchone()
+            self._record_homework_changes(class_id, {subject: row[0] if row else None}, {subject: text}, author_id)
+            self._bump_homework_version(conn, class_id)
+            conn.execute(
+                "INSERT INTO class_homework (class_id, subject, text) VALUES (?, ?, ?) "
+                "ON CONFLICT(class_id, subject) DO UPDATE SET text = excluded.text",
+                (class_id, subject, text)
+            )
+        self._reindex_homework(class_id=class_id)
+        return text
+
+    def _revision_count(self, class_id: str, subject: str) -> int:
+        return self._execute(
+            "SELECT COALESCE(MAX(rev), 0) FROM homework_history WHERE class_id = ? AND subject = ?",
+            (class_id, subject)
+        ).fetchone()[0]
+
+    def _append_revisions(self, class_id: str, subject: str, entries: List[Dict]):
+        self._write([(
+            "INSERT OR REPLACE INTO homework_history (class_id, subject, rev, entry) VALUES (?, ?, ?, ?)",
+            [(class_id, subject, entry["rev"], self._dumps(entry)) for entry in entries]
+        )])
+
+    def _read_revisions(self, class_id: str, subject: str, since_rev: int = 1) -> List[Dict]:
+        rows = self._execute(
+            "SELECT entry FROM homework_history WHERE class_id = ? AND subject = ? AND rev >= ? ORDER BY rev",
+            (class_id, subject, since_rev)
+        ).fetchall()
+        return [json.loads(entry) for entry, in rows]
+
+    def get_class_homework(self, class_id: str, subject: str = None) -> Dict:
+        with self._snapshot():
+            if subject:
+                if not self._execute("SELECT 1 FROM classes WHERE id = ?", (class_id,)).fetchone():
+                    return {}
+                row = self._execute(
+                    "SELECT text FROM class_homework WHERE class_id = ? AND subject = ?", (class_id, subject)
+                ).fetchone()
+                return {subject: row[0] if row else "ДЗ не задано"}
+            class_data = self.get_class(class_id)
+            return class_data["homework"] if class_data else {}
+
+    def get_users_in_class(self, class_id: str) -> List[int]:
+        rows = self._execute(
+            "SELECT user_id FROM class_members WHERE class_id = ? ORDER BY rowid", (class_id,)
+        ).fetchall()
+        return [user_id for user_id, in rows]
+
+    def is_member(self, class_id: str, user_id: int) -> bool:
+        return self._execute(
+            "SELECT 1 FROM class_members WHERE class_id = ? AND user_id = ?", (class_id, user_id)
+        ).fetchone() is not None
+
+    def has_join_request(self, class_id: str, user_id: int) -> bool:
+        return self._execute(
+            "SELECT 1 FROM join_requests WHERE class_id = ? AND user_id = ?", (class_id, user_id)
+        ).fetchone() is not None
+
+    def get_member_class(self, user_id: int) -> Optional[str]:
+        row = self._execute(
+            "SELECT class_id FROM class_members WHERE user_id = ? ORDER BY class_id LIMIT 1", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _column(self, sql: str, params=()) -> List:
+        return [value for value, in self._execute(sql, params)]
+
+    def get_class_list_page(self, class_id: str, field: str, size: int, anchor: Optional[int] = None,
+                            backward: bool = False, position: Optional[int] = None) -> Tuple[int, List[int], int]:
+        # Страница - диапазон rowid по индексу (class_id, rowid), без чтения всего списка.
+        # position из кнопки только нумерует строки и сверяется при её отсутствии.
+        table = {"members": "class_members", "join_requests": "join_requests"}[field]
+        rows = f"SELECT user_id FROM {table} WHERE class_id = ?"
+        with self._snapshot():
+            if field == "members":
+                row = self._execute("SELECT member_count FROM classes WHERE id = ?", (class_id,)).fetchone()
+                total = row[0] if row else 0
+            else:
+                total = self._execute(f"SELECT COUNT(*) FROM {table} WHERE class_id = ?", (class_id,)).fetchone()[0]
+            row = self._execute(f"SELECT rowid FROM {table} WHERE class_id = ? AND user_id = ?",
+                                (class_id, anchor)).fetchone() if anchor is not None else None
+            if row is None:
+                # Курсора в списке уже нет: первая страница, как в paginate()
+                return 0, self._column(f"{rows} ORDER BY rowid LIMIT ?", (class_id, size)), total
+            if position is None:
+                position = self._execute(f"SELECT COUNT(*) FROM {table} WHERE class_id = ? AND rowid < ?",
+                                         (class_id, row[0])).fetchone()[0]
+            if backward:
+                page = self._column(f"{rows} AND rowid < ? ORDER BY rowid DESC LIMIT ?", (class_id, row[0], size))[::-1]
+                if len(page) < size:
+                    return 0, self._column(f"{rows} ORDER BY rowid LIMIT ?", (class_id, size)), total
+                start = position - size
+            else:
+                page = self._column(f"{rows} AND rowid > ? ORDER BY rowid LIMIT ?", (class_id, row[0], size))
+                if not page:
+                    page = self._column(f"{rows} ORDER BY rowid DESC LIMIT ?", (class_id, size))[::-1]
+                    start = total - len(page)
+                else:
+                    start = position + 1
+        return max(min(start, total - len(page)), 0), page, total
+
+    def get_id_page(self, table: str, size: int, anchor=None, backward: bool = False,
+                    position: Optional[int] = None) -> Tuple[int, List, int]:
+        # Диапазон по первичному ключу; число записей - из счётчиков статистики
+        if table not in ("users", "classes"):
+            raise ValueError(f"Unknown table: {table}")
+        ids = f"SELECT id FROM {table}"
+        with self._snapshot():
+            total = self._read_stats([table])[table]
+            if anchor is None:
+                return 0, self._column(f"{ids} ORDER BY id LIMIT ?", (size,)), total
+            if backward:
+                page = self._column(f"{ids} WHERE id < ? ORDER BY id DESC LIMIT ?", (anchor, size))[::-1]
+                if len(page) < size:
+                    return 0, self._column(f"{ids} ORDER BY id LIMIT ?", (size,)), total
+                start = position - size if position is not None else None
+            else:
+                page = self._column(f"{ids} WHERE id > ? ORDER BY id LIMIT ?", (anchor, size))
+                if not page:
+                    page = self._column(f"{ids} ORDER BY id DESC LIMIT ?", (size,))[::-1]
+                    start = total - len(page)
+                else:
+                    start = position + 1 if position is not None else None
+            if start is None:
+                # Кнопка без позиции: считаем её по индексу
+                start = self._execute(f"SELECT COUNT(*) FROM {table} WHERE id < ?", (page[0],)).fetchone()[0]
+        return max(min(start, total - len(page)), 0), page, total
+
+    def get_notification_recipients(self, class_id: str) -> List[int]:
+        rows = self._execute(
+            "SELECT m.user_id FROM class_members m JOIN users u ON u.id = m.user_id "
+            "WHERE m.class_id = ? AND json_extract(u.extra, '$.settings.homework_notifications') = 1 "
+            "ORDER BY m.rowid", (class_id,)
+        ).fetchall()
+        return [user_id for user_id, in rows]
+
+    def _homework_versions(self, owners: List[search.Owner]) -> Dict[search.Owner, int]:
+        # ДЗ класса могут менять обработчики в других процессах (workers.py)
+        versions = {}
+        for scope, key in owners:
+            if scope == "class":
+                row = self._execute("SELECT homework_version FROM classes WHERE id = ?", (key,)).fetchone()
+            else:
+                row = self._execute("SELECT COALESCE(json_extract(extra, '$.personal_homework_version'), 0) "
+                                    "FROM users WHERE id = ?", (key,)).fetchone()
+            if row is not None:
+                versions[(scope, key)] = row[0]
+        return versions
+
+    # === Statistics ===
+    # Счётчики ведут триггеры SQLITE_STATS_TRIGGERS
+    def record_activity(self, user_id: int, day: Optional[str] = None) -> bool:
+        with self._tx() as conn:
+            return conn.execute("INSERT OR IGNORE INTO user_activity (day, user_id) VALUES (?, ?)",
+                                (day or date.today().isoformat(), user_id)).rowcount > 0
+
+    def _activity_counts(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT day, COUNT(*) FROM user_activity GROUP BY day"))
+
+    def _read_stats(self, keys: Iterable[str], prefixes: Iterable[str] = ()) -> Dict[str, int]:
+        keys = list(keys)
+        values = dict.fromkeys(keys, 0)
+        with self._snapshot():
+            for chunk in _chunks(keys):
+                values.update(self._execute(
+                    f"SELECT key, value FROM stats WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ))
+            for prefix in prefixes:
+                # Диапазон по первичному ключу вместо LIKE
+                values.update(self._execute("SELECT key, value FROM stats WHERE key >= ? AND key < ?",
+                                            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))))
+        return values
+
+    def _all_stats(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT key, value FROM stats WHERE value != 0"))
+
+    def _replace_stats(self, values: Dict[str, int]):
+        self._write([
+            # Сначала member_count: его триггер тоже меняет stats
+            ("UPDATE classes SET member_count = "
+             "(SELECT COUNT(*) FROM class_members WHERE class_id = classes.id)", ()),
+            ("DELETE FROM stats", ()),
+            ("INSERT INTO stats (key, value) VALUES (?, ?)", list(values.items())),
+        ])
+
+    def rebuild_stats(self, repair: bool = True) -> List[str]:
+        # Пересчёт и замена в одной транзакции: записи других процессов
+        # не попадут между ними
+        with self._tx():
+            return super().rebuild_stats(repair)
+
+
+def migrate_json_to_sharded(data_dir: str = DATA_DIR) -> Dict[str, int]:
+    """Разложить data/users.json и data/classes.json по файлам записей.
+
+    Исходные файлы переименовываются в *.bak, повторный запуск ничего не делает.
+    """
+    if not os.path.exists(os.path.join(data_dir, "users.json")):
+        return {"users": 0, "classes": 0}
+    source = Database(data_dir, journal=False, layout="single")
+    users = source.get_all_users()
+    classes = source.get_all_classes()
+    source.close()
+
+    os.makedirs(os.path.join(data_dir, "users"), exist_ok=True)
+    target = Database(data_dir, journal=False, layout="sharded")
+    for user_id, user_data in users.items():
+        target.save_user(user_id, user_data)
+    for class_id, class_data in classes.items():
+        target.save_class(class_id, class_data)
+    target.close()
+    for path in (source.users_file, source.classes_file):
+        os.replace(path, path + ".bak")
+    return {"users": len(users), "classes": len(classes)}
+
+
+def migrate_json_to_sqlite(data_dir: str = DATA_DIR, sqlite_path: str = SQLITE_PATH) -> Dict[str, int]:
+    """Перенести data/users.json, data/classes.json, историю ДЗ и activity.log в SQLite"""
+    source = Database(data_dir)
+    try:
+        target = SQLiteDatabase(sqlite_path)
+        users = source.get_all_users()
+        classes = source.get_all_classes()
+        activity = source.activity_entries()
+
+        with target._tx() as conn:
+            for user_id, user_data in users.items():
+                target._save_user_rows(conn, int(user_id), user_data)
+            for class_id, class_data in classes.items():
+                target._save_class_rows(conn, class_id, class_data)
+            conn.executemany("INSERT OR IGNORE INTO user_activity (day, user_id) VALUES (?, ?)", activity)
+        for class_id, subject in source._history.subjects():
+            target._append_revisions(class_id, subject, source._read_revisions(class_id, subject))
+        target.close()
+    finally:
+        # Иначе таймер сброса и atexit исходного хранилища могут переписать JSON после переноса
+        source.close()
+    return {"users": len(users), "classes": len(classes), "activity": len(activity)}
+
+
+# Счётчик обращений к хранилищу в рамках текущего апдейта (см. middlewares.py)
+_storage_calls: contextvars.ContextVar[Optional[Counter]] = contextvars.ContextVar("storage_calls", default=None)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над хранилищем.
+
+    Любой метод бэкенда вызывается как `await db.method(...)` и выполняется
+    в отдельном пуле потоков, не блокируя цикл событий aiogram.
+    """
+
+    def __init__(self, backend: BaseDatabase, max_workers: int = STORAGE_WORKERS):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+
+        kind = "read" if name in self.backend.READ_METHODS else "write"
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            self._count_call(name)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+            finally:
+                metrics.observe_storage_call(name, kind, time.perf_counter() - started)
+
+        setattr(self, name, method)
+        return method
+
+    @staticmethod
+    def _count_call(name: str):
+        counter = _storage_calls.get()
+        if counter is not None:
+            counter[name] += 1
+
+    @staticmethod
+    def count_calls() -> Counter:
+        """Начать подсчёт обращений к хранилищу в текущем контексте"""
+        counter = Counter()
+        _storage_calls.set(counter)
+        return counter
+
+    @staticmethod
+    def counted_calls() -> Optional[Counter]:
+        return _storage_calls.get()
+
+    async def atomic(self, func, class_id: Optional[str] = None, user_id: Optional[int] = None):
+        """Асинхронный аналог backend.transaction().
+
+        func(records) вызывается в потоке хранилища под блокировками записей
+        и получает то же, что отдаёт transaction(); её результат возвращается.
+        """
+        def run():
+            with self.backend.transaction(class_id=class_id, user_id=user_id) as records:
+                return func(records)
+
+        self._count_call("atomic")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, run)
+        finally:
+            metrics.observe_storage_call("atomic", "write", time.perf_counter() - started)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.backend.close)
+        self._executor.shutdown(wait=True)
+
+
+def create_database(backend: str = STORAGE_BACKEND) -> BaseDatabase:
+    if backend == "sqlite":
+        return SQLiteDatabase(SQLITE_PATH)
+    if backend == "json":
+        return Database(DATA_DIR)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+storage_backend = create_database()
+db = AsyncDatabase(storage_backend)
@@ -0,0 +1,243 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import time
+import typing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import FSM_PATH, FSM_TTL, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+Key = typing.Tuple[str, str]
+
+FSM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    chat TEXT NOT NULL,
+    user TEXT NOT NULL,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    bucket TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat, user)
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm(updated_at);
+"""
+
+
+def _empty_record() -> dict:
+    return {"state": None, "data": {}, "bucket": {}, "updated_at": time.time()}
+
+
+def _is_empty(record: dict) -> bool:
+    return record["state"] is None and not record["data"] and not record["bucket"]
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM, переживающее перезапуск бота.
+
+    Горячие записи живут в LRU-кэше на cache_size пользователей, изменения
+    копятся в памяти и раз в flush_interval секунд пишутся в SQLite одной
+    транзакцией. Состояния, не менявшиеся дольше ttl секунд, считаются
+    брошенными и удаляются.
+    """
+
+    def __init__(self, path: str = FSM_PATH, ttl: float = FSM_TTL,
+                 cache_size: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # Соединение используется только из единственного потока executor'а
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(FSM_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+
+        self._hot: "OrderedDict[Key, dict]" = OrderedDict()
+        self._dirty: typing.Dict[Key, dict] = {}
+        self._flusher: typing.Optional[asyncio.Task] = None
+        self._last_sweep = time.time()
+
+    # === Persistence (поток executor'а) ===
+    def _load(self, key: Key) -> dict:
+        row = self._conn.execute(
+            "SELECT state, data, bucket, updated_at FROM fsm WHERE chat = ? AND user = ?", key
+        ).fetchone()
+        if row is None:
+            return _empty_record()
+        state, data, bucket, updated_at = row
+        return {"state": state, "data": json.loads(data), "bucket": json.loads(bucket), "updated_at": updated_at}
+
+    def _write(self, batch: typing.Dict[Key, dict]):
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM fsm WHERE chat = ? AND user = ?",
+                [key for key, record in batch.items() if record is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fsm (chat, user, state, data, bucket, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [key + (record["state"], record["data"], record["bucket"], record["updated_at"])
+                 for key, record in batch.items() if record is not None]
+            )
+
+    def _delete_expired(self, cutoff: float) -> int:
+        with self._conn:
+            return self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,)).rowcount
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # === Hot tier ===
+    async def _record(self, chat, user) -> typing.Tuple[Key, dict]:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = self._hot.get(key)
+        if record is None:
+            record = self._dirty.get(key)
+        if record is None:
+            loaded = await self._run(self._load, key)
+            # Пока шла загрузка, запись могли создать
+            record = self._hot.get(key) or self._dirty.get(key) or loaded
+        if time.time() - record["updated_at"] > self.ttl and not _is_empty(record):
+            record = _empty_record()
+            self._touch(key, record)
+        self._hot[key] = record
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.cache_size:
+            # Несохранённые записи остаются в _dirty до ближайшего сброса
+            self._hot.popitem(last=False)
+        return key, record
+
+    def _touch(self, key: Key, record: dict):
+        record["updated_at"] = time.time()
+        self._dirty[key] = record
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_sweep > min(self.ttl, 3600):
+                    await self.sweep()
+            except Exception:
+                logger.exception("Failed to persist FSM states")
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        batch = {
+            key: None if _is_empty(record) else {
+                "state": record["state"],
+                "data": json.dumps(record["data"], ensure_ascii=False),
+                "bucket": json.dumps(record["bucket"], ensure_ascii=False),
+                "updated_at": record["updated_at"],
+            }
+            for key, record in pending.items()
+        }
+        try:
+            await self._run(self._write, batch)
+        except Exception:
+            for key, record in pending.items():
+                self._dirty.setdefault(key, record)
+            raise
+
+    async def sweep(self) -> int:
+        """Удалить состояния, не менявшиеся дольше ttl"""
+        self._last_sweep = time.time()
+        cutoff = self._last_sweep - self.ttl
+        for key in [key for key, record in self._hot.items()
+                    if record["updated_at"] < cutoff and key not in self._dirty]:
+            del self._hot[key]
+        return await self._run(self._delete_expired, cutoff)
+
+    # === BaseStorage ===
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        key, record = await self._record(chat, user)
+        return record["state"] if record["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        key, record = await self._record(chat, user)
+        return copy.deepcopy(record["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key, record = await self._record(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._touch(key, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key, record = await self._record(chat, user)
+        record["data"] = copy.deepcopy(data) if data else {}
+        self._touch(key, record)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        key, record = await self._record(chat, user)
+        record["data"].update(data or {}, **kwargs)
+        self._touch(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        key, record = await self._record(chat, user)
+        return copy.deepcopy(record["bucket"])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key, record = await self._record(chat, user)
+        record["bucket"] = copy.deepcopy(bucket) if bucket else {}
+        self._touch(key, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        key, record = await self._record(chat, user)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._touch(key, record)
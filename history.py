@@ -0,0 +1,155 @@
+"""История изменений ДЗ класса.
+
+Каждое изменение предмета - ревизия с автором и временем. Ревизия хранит
+не весь текст, а разницу с предыдущей (delta); каждая KEYFRAME_INTERVAL-я
+ревизия хранит текст целиком, чтобы восстановление любой версии
+проигрывало не больше KEYFRAME_INTERVAL разниц. Текущее ДЗ по-прежнему
+лежит в записи класса, история читается только при её просмотре.
+"""
+import difflib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME_INTERVAL = 16
+
+
+def make_delta(old: str, new: str) -> list:
+    """Разница old -> new: число n - скопировать n символов old,
+    -n - пропустить n символов old, строка - вставить её"""
+    delta = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append(i2 - i1)
+            continue
+        if i2 > i1:
+            delta.append(i1 - i2)
+        if j2 > j1:
+            delta.append(new[j1:j2])
+    return delta
+
+
+def apply_delta(old: str, delta: list) -> str:
+    parts = []
+    position = 0
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op >= 0:
+            parts.append(old[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(parts)
+
+
+def make_revision(rev: int, old: Optional[str], new: Optional[str], author_id: Optional[int]) -> Dict:
+    """Ревизия rev: текст предмета меняется с old на new (None - предмета нет)"""
+    entry = {"rev": rev, "author": author_id, "at": datetime.now().isoformat()}
+    if new is None:
+        entry["removed"] = True
+        return entry
+    delta = make_delta(old or "", new)
+    keyframe = (rev - 1) % KEYFRAME_INTERVAL == 0
+    # Разница бывает длиннее самого текста, если текст переписан целиком
+    if keyframe or len(json.dumps(delta, ensure_ascii=False)) >= len(new):
+        entry["text"] = new
+    else:
+        entry["delta"] = delta
+    return entry
+
+
+def keyframe_before(rev: int) -> int:
+    """Ревизия, с которой надо начать чтение, чтобы восстановить rev"""
+    return max(rev - 1, 0) // KEYFRAME_INTERVAL * KEYFRAME_INTERVAL + 1
+
+
+def replay(entries: List[Dict]) -> List[Tuple[Dict, Optional[str]]]:
+    """Тексты ревизий подряд, начиная с опорной: [(ревизия, текст или None)]"""
+    versions = []
+    text = ""
+    for entry in entries:
+        if entry.get("removed"):
+            versions.append((entry, None))
+            text = ""
+            continue
+        if "text" in entry:
+            text = entry["text"]
+        else:
+            text = apply_delta(text, entry["delta"])
+        versions.append((entry, text))
+    return versions
+
+
+class HistoryLog:
+    """История для JSON-хранилища: файл, в который ревизии только дописываются.
+
+    В памяти держатся лишь смещения строк по (класс, предмет), сами
+    ревизии читаются с диска при просмотре истории.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets: Dict[Tuple[str, str], List[int]] = {}
+        self._size = 0
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated entry")
+                except ValueError:
+                    logger.warning("Truncating damaged history tail in %s", self.path)
+                    break
+                self._offsets.setdefault((entry["class_id"], entry["subject"]), []).append(self._size)
+                self._size += len(line)
+        if self._size != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._size)
+
+    def subjects(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return list(self._offsets)
+
+    def count(self, class_id: str, subject: str) -> int:
+        with self._lock:
+            return len(self._offsets.get((class_id, subject), ()))
+
+    def append(self, class_id: str, subject: str, entries: List[Dict]):
+        lines = [json.dumps(dict(entry, class_id=class_id, subject=subject),
+                            ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                 for entry in entries]
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            offsets = self._offsets.setdefault((class_id, subject), [])
+            for line in lines:
+                offsets.append(self._size)
+                self._size += len(line)
+
+    def read(self, class_id: str, subject: str, since_rev: int = 1) -> List[Dict]:
+        with self._lock:
+            offsets = list(self._offsets.get((class_id, subject), ())[since_rev - 1:])
+        if not offsets:
+            return []
+        entries = []
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                entry = json.loads(f.readline())
+                del entry["class_id"], entry["subject"]
+                entries.append(entry)
+        return entries
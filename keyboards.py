@@ -1,6 +1,12 @@
+import zlib
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Tuple
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
-def get_main_keyboard(user_status: str):
+from config import PROJECT_STATUSES, TEAM_ROLES
+
+def _build_main_keyboard(user_status: str):
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     
     keyboard.add(KeyboardButton("👤 Мой профиль"))
@@ -14,11 +20,12 @@ def get_main_keyboard(user_status: str):
     
     return keyboard
 
-def get_admin_keyboard(user_status: str):
+def _build_admin_keyboard(user_status: str):
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     
     keyboard.add(KeyboardButton("👥 Управление пользователями"))
     keyboard.add(KeyboardButton("🏫 Управление классами"))
+    keyboard.add(KeyboardButton("📊 Статистика"))
     
     if user_status in ["Owner", "Admin"]:
         keyboard.add(KeyboardButton("🔧 Изменить статусы"))
@@ -27,13 +34,13 @@ def get_admin_keyboard(user_status: str):
     
     return keyboard
 
-def get_profile_keyboard():
+def _build_profile_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add(KeyboardButton("✏️ Редактировать профиль"))
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_edit_profile_keyboard():
+def _build_edit_profile_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     keyboard.add(
         KeyboardButton("Дата рождения"),
@@ -44,7 +51,7 @@ def get_edit_profile_keyboard():
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_class_keyboard(team_role: str = None):
+def _build_class_keyboard(team_role: str = None):
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     
     keyboard.add(KeyboardButton("Вступить в класс"))
@@ -57,13 +64,15 @@ def get_class_keyboard(team_role: str = None):
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_class_management_keyboard(team_role: str):
+def _build_class_management_keyboard(team_role: str):
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     
     keyboard.add(KeyboardButton("Изменить ДЗ"))
+    keyboard.add(KeyboardButton("История ДЗ"))
     keyboard.add(KeyboardButton("Изменить информацию"))
     keyboard.add(KeyboardButton("Заявки на вступление"))
     keyboard.add(KeyboardButton("Участники класса"))
+    keyboard.add(KeyboardButton("Импорт участников"))
     
     if team_role == "староста":
         keyboard.add(KeyboardButton("Назначить помощника"))
@@ -71,27 +80,34 @@ def get_class_management_keyboard(team_role: str):
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_homework_keyboard():
+def _build_homework_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add(KeyboardButton("📚 Все предметы"))
     keyboard.add(KeyboardButton("🔍 Конкретный предмет"))
+    keyboard.add(KeyboardButton("🔎 Поиск по ДЗ"))
     keyboard.add(KeyboardButton("➕ Добавить личное ДЗ"))
+    keyboard.add(KeyboardButton("🔔 Уведомления о ДЗ"))
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_homework_edit_keyboard():
+def _build_homework_edit_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add(KeyboardButton("Выбрать из списка"))
     keyboard.add(KeyboardButton("Написать самому"))
     keyboard.add(KeyboardButton("⬅️ Назад"))
     return keyboard
 
-def get_yes_no_keyboard():
+def _build_due_date_keyboard():
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add(KeyboardButton("Без срока"))
+    return keyboard
+
+def _build_yes_no_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     keyboard.add(KeyboardButton("✅ Да"), KeyboardButton("❌ Нет"))
     return keyboard
 
-def get_status_keyboard(current_status: str):
+def _build_status_keyboard(current_status: str):
     keyboard = InlineKeyboardMarkup(row_width=2)
     
     statuses = ["Owner", "Admin", "Staff", "Member"]
@@ -105,7 +121,7 @@ def get_status_keyboard(current_status: str):
     
     return keyboard
 
-def get_team_role_keyboard(current_role: str = None):
+def _build_team_role_keyboard(current_role: str = None):
     keyboard = InlineKeyboardMarkup(row_width=2)
     
     roles = ["староста", "помощник старосты", "участник"]
@@ -118,6 +134,88 @@ def get_team_role_keyboard(current_role: str = None):
     
     return keyboard
 
+# === Кэш клавиатур ===
+# Клавиатуры выше зависят только от статуса/роли, поэтому все варианты
+# строятся один раз при импорте. Разметка общая для всех вызовов, поэтому
+# она заморожена: ряды кнопок - кортежи, а add/row/insert бросают
+# TypeError. Чтобы дополнить такую клавиатуру, соберите новую.
+class _FrozenMarkup:
+    def _shared(self, *args, **kwargs):
+        raise TypeError("Cached keyboards are shared between users, build a new markup instead")
+
+    add = row = insert = _shared
+
+
+class FrozenReplyKeyboardMarkup(_FrozenMarkup, ReplyKeyboardMarkup):
+    ROWS = "keyboard"
+
+
+class FrozenInlineKeyboardMarkup(_FrozenMarkup, InlineKeyboardMarkup):
+    ROWS = "inline_keyboard"
+
+
+def _freeze(markup):
+    """Неизменяемая копия собранной клавиатуры для кэша"""
+    frozen_class = FrozenInlineKeyboardMarkup if isinstance(markup, InlineKeyboardMarkup) else FrozenReplyKeyboardMarkup
+    frozen = frozen_class(row_width=markup.row_width)
+    frozen.values.update(markup.values)
+    frozen.values[frozen.ROWS] = tuple(tuple(row) for row in markup.values[frozen.ROWS])
+    return frozen
+
+
+_MAIN_KEYBOARDS = MappingProxyType({status: _freeze(_build_main_keyboard(status)) for status in PROJECT_STATUSES})
+_ADMIN_KEYBOARDS = MappingProxyType({status: _freeze(_build_admin_keyboard(status)) for status in PROJECT_STATUSES})
+_CLASS_KEYBOARDS = MappingProxyType({role: _freeze(_build_class_keyboard(role)) for role in [None] + TEAM_ROLES})
+_CLASS_MANAGEMENT_KEYBOARDS = MappingProxyType({role: _freeze(_build_class_management_keyboard(role))
+                                                for role in [None] + TEAM_ROLES})
+_STATUS_KEYBOARDS = MappingProxyType({status: _freeze(_build_status_keyboard(status))
+                                      for status in [None] + PROJECT_STATUSES})
+_TEAM_ROLE_KEYBOARDS = MappingProxyType({role: _freeze(_build_team_role_keyboard(role))
+                                         for role in [None] + TEAM_ROLES})
+_PROFILE_KEYBOARD = _freeze(_build_profile_keyboard())
+_EDIT_PROFILE_KEYBOARD = _freeze(_build_edit_profile_keyboard())
+_HOMEWORK_KEYBOARD = _freeze(_build_homework_keyboard())
+_HOMEWORK_EDIT_KEYBOARD = _freeze(_build_homework_edit_keyboard())
+_DUE_DATE_KEYBOARD = _freeze(_build_due_date_keyboard())
+_YES_NO_KEYBOARD = _freeze(_build_yes_no_keyboard())
+
+def get_main_keyboard(user_status: str):
+    return _MAIN_KEYBOARDS.get(user_status) or _MAIN_KEYBOARDS["Member"]
+
+def get_admin_keyboard(user_status: str):
+    return _ADMIN_KEYBOARDS.get(user_status) or _ADMIN_KEYBOARDS["Member"]
+
+def get_profile_keyboard():
+    return _PROFILE_KEYBOARD
+
+def get_edit_profile_keyboard():
+    return _EDIT_PROFILE_KEYBOARD
+
+def get_class_keyboard(team_role: str = None):
+    # Неизвестная роль показывается так же, как роль участника
+    return _CLASS_KEYBOARDS.get(team_role or None) or _CLASS_KEYBOARDS["участник"]
+
+def get_class_management_keyboard(team_role: str):
+    return _CLASS_MANAGEMENT_KEYBOARDS.get(team_role) or _CLASS_MANAGEMENT_KEYBOARDS[None]
+
+def get_homework_keyboard():
+    return _HOMEWORK_KEYBOARD
+
+def get_homework_edit_keyboard():
+    return _HOMEWORK_EDIT_KEYBOARD
+
+def get_due_date_keyboard():
+    return _DUE_DATE_KEYBOARD
+
+def get_yes_no_keyboard():
+    return _YES_NO_KEYBOARD
+
+def get_status_keyboard(current_status: str):
+    return _STATUS_KEYBOARDS.get(current_status) or _STATUS_KEYBOARDS[None]
+
+def get_team_role_keyboard(current_role: str = None):
+    return _TEAM_ROLE_KEYBOARDS.get(current_role) or _TEAM_ROLE_KEYBOARDS[None]
+
 def get_join_request_keyboard(request_id: int):
     keyboard = InlineKeyboardMarkup()
     keyboard.add(
@@ -132,4 +230,76 @@ def get_member_management_keyboard(user_id: int):
         InlineKeyboardButton("👑 Изменить роль", callback_data=f"change_role_{user_id}"),
         InlineKeyboardButton("❌ Удалить", callback_data=f"remove_member_{user_id}")
     )
-    return keyboard
\ No newline at end of file
+    return keyboard
+
+def get_page_navigation(prefix: str, page: List, start: int, total: int) -> List[InlineKeyboardButton]:
+    """Кнопки «назад/вперёд» для страницы page, которая начинается с позиции start.
+
+    В callback_data передаётся курсор - крайний элемент текущей страницы
+    и его позиция в списке: по ней соседняя страница находится без поиска.
+    """
+    buttons = []
+    if start > 0:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"{prefix}_prev_{start}_{page[0]}"))
+    if start + len(page) < total:
+        buttons.append(InlineKeyboardButton(
+            "➡️", callback_data=f"{prefix}_next_{start + len(page) - 1}_{page[-1]}"
+        ))
+    return buttons
+
+def get_members_keyboard(navigation: List[InlineKeyboardButton]):
+    keyboard = InlineKeyboardMarkup()
+    if navigation:
+        keyboard.row(*navigation)
+    return keyboard
+
+def get_join_requests_keyboard(requests: List[Tuple[int, str]], selected: Iterable[int] = (),
+                               navigation: List[InlineKeyboardButton] = ()):
+    """Список заявок с отметками и кнопками пакетной обработки.
+
+    Отметки хранятся в самой клавиатуре: toggle_join_request() меняет одну
+    кнопку, selected_join_requests() читает отмеченные заявки.
+    """
+    selected = set(selected)
+    keyboard = InlineKeyboardMarkup()
+    for user_id, name in requests:
+        keyboard.add(InlineKeyboardButton(
+            f"{'☑️' if user_id in selected else '⬜'} {name}",
+            callback_data=f"toggle_request_{user_id}"
+        ))
+    keyboard.add(InlineKeyboardButton("✅ Принять всех", callback_data="accept_all_requests"))
+    keyboard.add(
+        InlineKeyboardButton("✅ Принять выбранных", callback_data="accept_selected_requests"),
+        InlineKeyboardButton("❌ Отклонить выбранных", callback_data="reject_selected_requests")
+    )
+    if navigation:
+        keyboard.row(*navigation)
+    return keyboard
+
+def toggle_join_request(keyboard: InlineKeyboardMarkup, user_id: int) -> InlineKeyboardMarkup:
+    callback_data = f"toggle_request_{user_id}"
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            if button.callback_data == callback_data:
+                mark, name = button.text.split(" ", 1)
+                button.text = f"{'⬜' if mark == '☑️' else '☑️'} {name}"
+    return keyboard
+
+def selected_join_requests(keyboard: InlineKeyboardMarkup) -> List[int]:
+    return [int(button.callback_data.rsplit("_", 1)[1])
+            for row in keyboard.inline_keyboard for button in row
+            if button.callback_data.startswith("toggle_request_") and button.text.startswith("☑️")]
+
+def homework_revert_callback(subject: str, rev: int) -> str:
+    """callback_data отката: предмет не влезает в 64 байта, поэтому
+    передаётся его контрольная сумма для сверки с открытой историей"""
+    return f"hw_revert_{rev}_{zlib.crc32(subject.encode('utf-8')):08x}"
+
+def get_homework_history_keyboard(subject: str, versions: List[Dict]):
+    """Кнопки отката к прошлым версиям (versions - новые первыми)"""
+    keyboard = InlineKeyboardMarkup()
+    for version in versions[1:]:
+        if version["text"] is not None:
+            keyboard.add(InlineKeyboardButton(f"↩️ Вернуть версию {version['rev']}",
+                                              callback_data=homework_revert_callback(subject, version["rev"])))
+    return keyboard
@@ -0,0 +1,81 @@
+import argparse
+
+from config import DATA_DIR, SQLITE_PATH, STORAGE_BACKEND
+
+
+def cmd_migrate_sqlite(args):
+    from database import migrate_json_to_sqlite
+    counts = migrate_json_to_sqlite(args.data_dir, args.sqlite_path)
+    print(f"Перенесено пользователей: {counts['users']}, классов: {counts['classes']}, "
+          f"отметок активности: {counts['activity']}")
+
+
+def cmd_migrate_sharded(args):
+    from database import migrate_json_to_sharded
+    counts = migrate_json_to_sharded(args.data_dir)
+    print(f"Разложено по файлам пользователей: {counts['users']}, классов: {counts['classes']}")
+    print("Включите раскладку переменной JSON_LAYOUT=sharded")
+
+
+def cmd_check_consistency(args):
+    from database import Database, SQLiteDatabase
+    storage = SQLiteDatabase(args.sqlite_path) if args.backend == "sqlite" else Database(args.data_dir)
+    problems = storage.check_consistency(repair=args.repair)
+    storage.close()
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print("Расхождений не найдено")
+    elif args.repair:
+        print(f"Исправлено расхождений: {len(problems)}")
+
+
+def cmd_rebuild_stats(args):
+    from database import Database, SQLiteDatabase
+    storage = SQLiteDatabase(args.sqlite_path) if args.backend == "sqlite" else Database(args.data_dir)
+    problems = storage.rebuild_stats(repair=not args.check)
+    storage.close()
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print("Счётчики статистики совпадают с данными")
+    elif not args.check:
+        print(f"Пересчитано счётчиков: {len(problems)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate-sqlite", help="Перенести data/*.json в SQLite")
+    migrate.add_argument("--data-dir", default=DATA_DIR)
+    migrate.add_argument("--sqlite-path", default=SQLITE_PATH)
+    migrate.set_defaults(func=cmd_migrate_sqlite)
+
+    sharded = subparsers.add_parser("migrate-sharded",
+                                    help="Разложить data/*.json по файлам записей (бот должен быть остановлен)")
+    sharded.add_argument("--data-dir", default=DATA_DIR)
+    sharded.set_defaults(func=cmd_migrate_sharded)
+
+    check = subparsers.add_parser("check-consistency",
+                                  help="Сверить составы классов с class_id пользователей (бот должен быть остановлен)")
+    check.add_argument("--backend", choices=["json", "sqlite"], default=STORAGE_BACKEND)
+    check.add_argument("--data-dir", default=DATA_DIR)
+    check.add_argument("--sqlite-path", default=SQLITE_PATH)
+    check.add_argument("--repair", action="store_true", help="исправить найденные расхождения")
+    check.set_defaults(func=cmd_check_consistency)
+
+    rebuild = subparsers.add_parser("rebuild-stats",
+                                    help="Пересчитать счётчики статистики по данным (бот должен быть остановлен)")
+    rebuild.add_argument("--backend", choices=["json", "sqlite"], default=STORAGE_BACKEND)
+    rebuild.add_argument("--data-dir", default=DATA_DIR)
+    rebuild.add_argument("--sqlite-path", default=SQLITE_PATH)
+    rebuild.add_argument("--check", action="store_true", help="только сверить, не заменяя счётчики")
+    rebuild.set_defaults(func=cmd_rebuild_stats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Счётчики и гистограммы живут в памяти процесса; MetricsServer отдаёт
+их на http://METRICS_HOST:METRICS_PORT/metrics. Что измеряется:
+
+    bot_update_seconds                   обработка апдейта целиком
+    bot_handler_seconds{handler}         обработчик (с middleware process_*)
+    bot_slow_updates_total               апдейты дольше SLOW_UPDATE_THRESHOLD
+    storage_call_seconds{method,kind}    вызовы db.method(), kind - read/write
+    storage_serialized_bytes_total{backend}  байты, сериализованные хранилищем
+    telegram_api_seconds{method,status}  запросы к Bot API
+
+Время хранилища и Bot API дополнительно копится в UpdateTrace текущего
+апдейта - из него складывается журнал медленных апдейтов.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][position] += 1
+            state[1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_number(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+update_seconds = registry.histogram("bot_update_seconds", "Update processing time")
+handler_seconds = registry.histogram("bot_handler_seconds", "Handler time including process middlewares",
+                                     ["handler"])
+slow_updates = registry.counter("bot_slow_updates_total", "Updates slower than SLOW_UPDATE_THRESHOLD")
+storage_call_seconds = registry.histogram("storage_call_seconds", "Storage call time including executor wait",
+                                          ["method", "kind"])
+storage_serialized_bytes = registry.counter("storage_serialized_bytes_total", "Bytes serialized by storage",
+                                            ["backend"])
+telegram_api_seconds = registry.histogram("telegram_api_seconds", "Bot API request time", ["method", "status"])
+
+
+# === Трасса апдейта ===
+class UpdateTrace:
+    """Время апдейта по этапам: хранилище, Bot API и обработчик"""
+
+    __slots__ = ("started", "handler", "handler_started", "handler_seconds", "storage_calls", "storage_seconds",
+                 "api_calls", "api_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler: Optional[str] = None
+        self.handler_started: Optional[float] = None
+        self.handler_seconds = 0.0
+        self.storage_calls = 0
+        self.storage_seconds = 0.0
+        self.api_calls = 0
+        self.api_seconds = 0.0
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("update_trace", default=None)
+
+
+def start_trace() -> UpdateTrace:
+    trace = UpdateTrace()
+    _trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[UpdateTrace]:
+    return _trace.get()
+
+
+def handler_name(handler) -> str:
+    return getattr(handler, "__qualname__", None) or repr(handler)
+
+
+def observe_storage_call(method: str, kind: str, seconds: float):
+    """Вызов хранилища; kind - read или write (BaseDatabase.READ_METHODS)"""
+    storage_call_seconds.observe(seconds, method, kind)
+    trace = _trace.get()
+    if trace is not None:
+        trace.storage_calls += 1
+        trace.storage_seconds += seconds
+
+
+class InstrumentedBot(Bot):
+    """Bot, который замеряет каждый запрос к Bot API"""
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            telegram_api_seconds.observe(seconds, method, status)
+            trace = _trace.get()
+            if trace is not None:
+                trace.api_calls += 1
+                trace.api_seconds += seconds
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с GET /metrics"""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,167 @@
+import inspect
+import logging
+import time
+from datetime import date
+from typing import Dict, Set
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import metrics
+from config import SLOW_UPDATE_THRESHOLD
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Загружает пользователя и его класс один раз на апдейт.
+
+    Записи передаются в аргументы обработчика `user` и `class_data`,
+    если обработчик их объявил. Обработчики без этих аргументов
+    обращений к хранилищу не вызывают. Для кнопок TextRouter смотрится
+    выбранный им обработчик (data["route"]).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._specs: Dict[object, Set[str]] = {}
+
+    def _wanted(self, data: dict) -> Set[str]:
+        handler = data.get("route") or current_handler.get(None)
+        if handler is None:
+            return set()
+        if handler not in self._specs:
+            params = inspect.signature(handler).parameters
+            self._specs[handler] = {name for name in ("user", "class_data") if name in params}
+        return self._specs[handler]
+
+    async def _load(self, user_id: int, data: dict):
+        wanted = self._wanted(data)
+        if not wanted:
+            return
+        user = await db.get_user(user_id)
+        data["user"] = user
+        if "class_data" in wanted:
+            class_id = user.get("class_id") if user else None
+            data["class_data"] = await db.get_class(class_id) if class_id else None
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._load(message.from_user.id, data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._load(call.from_user.id, data)
+
+
+class StorageStatsMiddleware(BaseMiddleware):
+    """Считает обращения к хранилищу на каждый апдейт"""
+
+    def __init__(self):
+        super().__init__()
+        self.updates = 0
+        self.storage_calls = 0
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        db.count_calls()
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        counter = db.counted_calls()
+        if counter is None:
+            return
+        calls = sum(counter.values())
+        self.updates += 1
+        self.storage_calls += calls
+        logger.debug("Update %s: %d storage calls %s", update.update_id, calls, dict(counter))
+
+    @property
+    def calls_per_update(self) -> float:
+        return self.storage_calls / self.updates if self.updates else 0.0
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время апдейтов и обработчиков для /metrics.
+
+    Подключается первым, чтобы время обработчика включало загрузку
+    записей остальными middleware. Апдейты дольше slow_threshold секунд
+    пишутся в лог с разбивкой: выбор обработчика, сам обработчик, из них
+    хранилище и Bot API.
+    """
+
+    def __init__(self, slow_threshold: float = SLOW_UPDATE_THRESHOLD):
+        super().__init__()
+        self.slow_threshold = slow_threshold
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        metrics.start_trace()
+
+    def _handler_started(self, data: dict):
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.handler = metrics.handler_name(data.get("route") or current_handler.get(None))
+            trace.handler_started = time.perf_counter()
+
+    def _handler_finished(self):
+        trace = metrics.current_trace()
+        if trace is None or trace.handler_started is None:
+            return
+        seconds = time.perf_counter() - trace.handler_started
+        trace.handler_seconds += seconds
+        metrics.handler_seconds.observe(seconds, trace.handler)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._handler_started(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        self._handler_started(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._handler_finished()
+
+    async def on_post_process_callback_query(self, call: types.CallbackQuery, results, data: dict):
+        self._handler_finished()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        trace = metrics.current_trace()
+        if trace is None:
+            return
+        seconds = time.perf_counter() - trace.started
+        metrics.update_seconds.observe(seconds)
+        if not self.slow_threshold or seconds < self.slow_threshold:
+            return
+        metrics.slow_updates.inc()
+        dispatch = (trace.handler_started or time.perf_counter()) - trace.started
+        logger.warning(
+            "Slow update %s: %.3fs total, dispatch %.3fs, handler %s %.3fs "
+            "(storage %d calls %.3fs, Bot API %d calls %.3fs)",
+            update.update_id, seconds, dispatch, trace.handler or "-", trace.handler_seconds,
+            trace.storage_calls, trace.storage_seconds, trace.api_calls, trace.api_seconds
+        )
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Отмечает активных за день пользователей для статистики.
+
+    Хранилище получает одну запись на пользователя в день: повторные
+    апдейты отсекаются множеством уже отмеченных в этом процессе.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._day = None
+        self._seen: Set[int] = set()
+
+    async def _touch(self, user: types.User):
+        day = date.today().isoformat()
+        if day != self._day:
+            self._day, self._seen = day, set()
+        if user is None or user.id in self._seen:
+            return
+        self._seen.add(user.id)
+        await db.record_activity(user.id, day)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        await self._touch(message.from_user)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._touch(call.from_user)
@@ -0,0 +1,275 @@
+"""Напоминания о сроках ДЗ.
+
+ReminderScheduler - таймеры на asyncio: в памяти куча (heapq) по времени
+срабатывания, на диске таблица SQLite, из которой куча восстанавливается
+после перезапуска. Цикл спит до ближайшего таймера, так что ожидающие
+напоминания не перебираются и хранилище не опрашивается.
+
+Таблицу могут делить несколько процессов (workers.py): каждый
+восстанавливает все таймеры, но сработавший таймер сначала забирается
+в таблице (claim), поэтому обрабатывает его только один процесс.
+
+HomeworkReminders ставит на каждое ДЗ со сроком два таймера: напоминание
+за REMINDER_BEFORE секунд до срока и перенос в архив через
+HOMEWORK_ARCHIVE_AFTER секунд после него.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from config import REMINDERS_PATH, REMINDERS_FLUSH_INTERVAL, REMINDER_BEFORE, HOMEWORK_ARCHIVE_AFTER
+from database import db
+from utils import format_due
+
+logger = logging.getLogger(__name__)
+
+# На сколько секунд забранный таймер откладывается в таблице: если процесс
+# упадёт, не обработав его, таймер сработает снова после перезапуска
+CLAIM_LEASE = 60.0
+
+REMINDERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    key TEXT PRIMARY KEY,
+    fire_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+
+class ReminderScheduler:
+    """Персистентные таймеры: schedule(key, fire_at, payload) / cancel(key).
+
+    Таймер с тем же ключом заменяет прежний. Когда наступает fire_at,
+    вызывается handler(payload). Изменения пишутся в SQLite пачкой раз в
+    flush_interval секунд. Сработавший таймер удаляется из таблицы после
+    обработчика, поэтому после сбоя он может сработать повторно:
+    обработчик должен это переносить.
+    """
+
+    def __init__(self, handler: Callable[[Dict], Awaitable], path: str = REMINDERS_PATH,
+                 flush_interval: float = REMINDERS_FLUSH_INTERVAL):
+        self.handler = handler
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fired = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # Соединение используется только из единственного потока executor'а
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(REMINDERS_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reminders")
+
+        # key -> (fire_at, seq, payload). Заменённые и отменённые таймеры
+        # остаются в куче и пропускаются при извлечении по несовпадению seq
+        self._timers: Dict[str, Tuple[float, int, Dict]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._dirty: Dict[str, Optional[Tuple[float, Dict]]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    # === Persistence (поток executor'а) ===
+    def _load(self) -> List[Tuple[str, float, str]]:
+        return self._conn.execute("SELECT key, fire_at, payload FROM reminders").fetchall()
+
+    def _write(self, batch: Dict[str, Optional[Tuple[float, Dict]]]):
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM reminders WHERE key = ?",
+                [(key,) for key, timer in batch.items() if timer is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reminders (key, fire_at, payload) VALUES (?, ?, ?)",
+                [(key, timer[0], json.dumps(timer[1], ensure_ascii=False))
+                 for key, timer in batch.items() if timer is not None]
+            )
+
+    def _claim(self, key: str, fire_at: float) -> bool:
+        """Забрать сработавший таймер; False - его заменили, отменили или забрал другой процесс"""
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE reminders SET fire_at = ? WHERE key = ? AND fire_at = ?", (fire_at + CLAIM_LEASE, key, fire_at)
+            ).rowcount > 0
+
+    def _release(self, key: str, fire_at: float):
+        with self._conn:
+            self._conn.execute("DELETE FROM reminders WHERE key = ? AND fire_at = ?", (key, fire_at + CLAIM_LEASE))
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        try:
+            await self._run(self._write, pending)
+        except Exception:
+            for key, timer in pending.items():
+                self._dirty.setdefault(key, timer)
+            raise
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to persist reminders")
+
+    def _changed(self, key: str, timer: Optional[Tuple[float, Dict]]):
+        self._dirty[key] = timer
+        if not self._closing and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.ensure_future(self._flush_later())
+
+    # === Таймеры ===
+    async def start(self):
+        """Восстановить таймеры из SQLite и запустить цикл"""
+        started = time.perf_counter()
+        for key, fire_at, payload in await self._run(self._load):
+            self._timers[key] = (fire_at, next(self._seq), json.loads(payload))
+        self._heap = [(fire_at, seq, key) for key, (fire_at, seq, _) in self._timers.items()]
+        heapq.heapify(self._heap)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._loop())
+        logger.info("Restored %d reminders in %.3fs", len(self._timers), time.perf_counter() - started)
+
+    def schedule(self, key: str, fire_at: float, payload: Dict):
+        seq = next(self._seq)
+        self._timers[key] = (fire_at, seq, payload)
+        heapq.heappush(self._heap, (fire_at, seq, key))
+        self._changed(key, (fire_at, payload))
+        if self._heap[0][1] == seq and self._wakeup is not None:
+            # Новый таймер раньше всех: цикл спит слишком долго
+            self._wakeup.set()
+
+    def cancel(self, key: str):
+        if self._timers.pop(key, None) is None:
+            return
+        self._changed(key, None)
+        if len(self._heap) > 2 * len(self._timers) + 1024:
+            self._heap = [(fire_at, seq, key) for key, (fire_at, seq, _) in self._timers.items()]
+            heapq.heapify(self._heap)
+
+    async def _loop(self):
+        while not self._closing:
+            self._wakeup.clear()
+            while self._heap and self._heap[0][0] <= time.time() and not self._closing:
+                fire_at, seq, key = heapq.heappop(self._heap)
+                timer = self._timers.get(key)
+                if timer is None or timer[1] != seq:
+                    continue
+                del self._timers[key]
+                try:
+                    # Таймер мог ещё не дойти до таблицы
+                    await self.flush()
+                    if not await self._run(self._claim, key, fire_at):
+                        continue
+                except Exception:
+                    logger.exception("Failed to claim reminder %s", key)
+                    continue
+                try:
+                    await self.handler(timer[2])
+                except Exception:
+                    logger.exception("Reminder %s failed", key)
+                self.fired += 1
+                try:
+                    await self._run(self._release, key, fire_at)
+                except Exception:
+                    logger.exception("Failed to release reminder %s", key)
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        # Цикл дорабатывает текущий таймер и выходит
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self._task = self._flusher = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+class HomeworkReminders:
+    """Напоминания и архивация ДЗ класса и личного ДЗ по сроку сдачи"""
+
+    def __init__(self, broadcaster, path: str = REMINDERS_PATH, before: float = REMINDER_BEFORE,
+                 archive_after: float = HOMEWORK_ARCHIVE_AFTER):
+        self.broadcaster = broadcaster
+        self.before = before
+        self.archive_after = archive_after
+        self.scheduler = ReminderScheduler(self._handle, path)
+
+    async def start(self):
+        await self.scheduler.start()
+
+    async def close(self):
+        await self.scheduler.close()
+
+    def homework_changed(self, scope: str, owner: Union[str, int], subject: str, due: Optional[str]):
+        """Переставить таймеры после изменения ДЗ.
+
+        scope - "class" (owner - id класса) или "user" (owner - user_id);
+        due=None снимает таймеры.
+        """
+        for kind in ("remind", "archive"):
+            key = f"{scope}:{owner}:{kind}:{subject}"
+            if due is None:
+                self.scheduler.cancel(key)
+                continue
+            deadline = datetime.fromisoformat(due).timestamp()
+            fire_at = deadline - self.before if kind == "remind" else deadline + self.archive_after
+            self.scheduler.schedule(key, fire_at, {"kind": kind, "scope": scope, "owner": owner,
+                                                   "subject": subject, "due": due})
+
+    async def _handle(self, payload: Dict):
+        scope, owner, subject, due = payload["scope"], payload["owner"], payload["subject"], payload["due"]
+        # Таймер мог пережить изменение ДЗ: действуем, только если срок прежний
+        if payload["kind"] == "archive":
+            if scope == "class":
+                await db.archive_class_homework(owner, subject, due)
+            else:
+                await db.archive_personal_homework(owner, subject, due)
+            return
+
+        if datetime.fromisoformat(due) <= datetime.now():
+            return
+        if scope == "class":
+            record = await db.get_class(owner)
+            homework_key, title = "homework", f" ({record['name']})" if record else ""
+        else:
+            record = await db.get_user(owner)
+            homework_key, title = "personal_homework", " (личное ДЗ)"
+        if not record or record.get(homework_key + "_meta", {}).get(subject, {}).get("due") != due:
+            return
+        recipients = await db.get_notification_recipients(owner) if scope == "class" else [owner]
+        self.broadcaster.send(
+            recipients,
+            f"⏰ <b>Напоминание</b>{title}\n\n"
+            f"📘 <b>{subject}</b> - сдать до {format_due(due)}:\n{record[homework_key][subject]}",
+            parse_mode="HTML"
+        )
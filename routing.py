@@ -0,0 +1,94 @@
+"""Маршрутизация кнопок по тексту сообщения.
+
+Обработчики вида `message_handler(lambda m: m.text == "...")` aiogram
+проверяет по очереди, и последняя кнопка платит за фильтры всех
+предыдущих. TextRouter регистрирует в диспетчере один обработчик и
+находит нужный по словарю текст -> состояние -> обработчик.
+
+    router = TextRouter(dp)
+
+    @router.text("📚 Все предметы")
+    async def cmd_all_homework(message, user=None): ...
+"""
+import inspect
+from typing import Callable, Dict, FrozenSet, Optional, Union
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.filters.builtin import StateFilter
+from aiogram.dispatcher.filters.state import State
+from aiogram.dispatcher.handler import current_handler
+
+ANY_STATE = "*"
+
+
+class TextRouter:
+    """Обработчики точного текста сообщения с учётом состояния FSM.
+
+    Обработчик маршрутизатора регистрируется в диспетчере первым (при
+    создании), поэтому кнопки не проходят через фильтры остальных
+    обработчиков. Выбранный обработчик передаётся middleware в data["route"].
+    """
+
+    def __init__(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+        # текст -> состояние (None - без состояния, "*" - любое) -> обработчик
+        self._routes: Dict[str, Dict[Optional[str], Callable]] = {}
+        # обработчик -> имена аргументов, которые он принимает (None - **kwargs)
+        self._params: Dict[Callable, Optional[FrozenSet[str]]] = {}
+        dispatcher.register_message_handler(self._dispatch, self._match, state=ANY_STATE)
+
+    def __len__(self) -> int:
+        return sum(len(states) for states in self._routes.values())
+
+    def add(self, handler: Callable, *texts: str, state: Union[State, str, None] = None):
+        if isinstance(state, State):
+            state = state.state
+        for text in texts:
+            states = self._routes.setdefault(text, {})
+            if state in states:
+                raise ValueError(f"Text {text!r} is already routed in state {state!r}")
+            states[state] = handler
+        self._params[handler] = self._accepted_params(handler)
+
+    @staticmethod
+    def _accepted_params(handler: Callable) -> Optional[FrozenSet[str]]:
+        # Как aiogram: обработчик получает только объявленные аргументы из data
+        parameters = inspect.signature(handler).parameters.values()
+        if any(parameter.kind is parameter.VAR_KEYWORD for parameter in parameters):
+            return None
+        return frozenset(parameter.name for parameter in parameters
+                         if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY))
+
+    def text(self, *texts: str, state: Union[State, str, None] = None):
+        """Декоратор: обработчик для сообщений с одним из texts"""
+        def decorator(handler: Callable) -> Callable:
+            self.add(handler, *texts, state=state)
+            return handler
+        return decorator
+
+    async def _current_state(self, message: types.Message) -> Optional[str]:
+        # Тот же кэш на апдейт, что и у StateFilter: состояние читается из
+        # хранилища FSM не больше одного раза
+        try:
+            return StateFilter.ctx_state.get()
+        except LookupError:
+            state = await self.dispatcher.storage.get_state(chat=message.chat.id, user=message.from_user.id)
+            StateFilter.ctx_state.set(state)
+            return state
+
+    async def _match(self, message: types.Message):
+        states = self._routes.get(message.text)
+        if states is None:
+            return False
+        handler = states.get(await self._current_state(message)) or states.get(ANY_STATE)
+        return {"route": handler} if handler else False
+
+    async def _dispatch(self, message: types.Message, route: Callable, **data):
+        token = current_handler.set(route)
+        try:
+            params = self._params[route]
+            if params is not None:
+                data = {key: value for key, value in data.items() if key in params}
+            return await route(message, **data)
+        finally:
+            current_handler.reset(token)
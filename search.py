@@ -0,0 +1,181 @@
+"""Поиск по ДЗ.
+
+Тексты разбиваются на слова и приводятся к основе русским стеммером
+(упрощённый Snowball), так что «параграфы» находят «параграф». Индекс
+хранит для каждого владельца (класса или пользователя) словарь
+основа -> документы; запрос смотрит только индексы своего класса и
+своего личного ДЗ и не перебирает хранилище (SQLite сверяет лишь
+версии их ДЗ). Сам индекс строится по всем записям при запуске бота
+(BaseDatabase.build_search_index).
+"""
+import difflib
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+Owner = Tuple[str, Any]
+
+_VOWELS = "аеиоуыэюя"
+_WORD = re.compile(r"\w+")
+_STOP_WORDS = {"на", "по", "из", "не", "но", "за", "от", "до", "же", "ли", "бы", "во", "со", "об", "или", "для"}
+
+
+def _endings(*groups) -> List[Tuple[str, bool]]:
+    """Окончания (окончание, нужна ли перед ним «а»/«я»), длинные первыми"""
+    endings = [(ending, after_a) for after_a, words in groups for ending in words.split()]
+    return sorted(endings, key=lambda item: -len(item[0]))
+
+
+_PERFECTIVE_GERUND = _endings((True, "в вши вшись"), (False, "ив ивши ившись ыв ывши ывшись"))
+_REFLEXIVE = _endings((False, "ся сь"))
+_ADJECTIVE = _endings((False, "ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому "
+                              "их ых ую юю ая яя ою ею"))
+_PARTICIPLE = _endings((True, "ем нн вш ющ щ"), (False, "ивш ывш ующ"))
+_VERB = _endings((True, "ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно"),
+                 (False, "ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют "
+                         "ит ыт ены ить ыть ишь ую ю"))
+_NOUN = _endings((False, "а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у "
+                         "ах иях ях ы ь ию ью ю ия ья я"))
+_SUPERLATIVE = _endings((False, "ейш ейше"))
+_DERIVATIONAL = _endings((False, "ост ость"))
+
+
+def _match(word: str, endings: List[Tuple[str, bool]]) -> int:
+    """Длина найденного окончания или 0"""
+    for ending, after_a in endings:
+        if word.endswith(ending) and (not after_a or word[:-len(ending)].endswith(("а", "я"))):
+            return len(ending)
+    return 0
+
+
+def _region(word: str, start: int = 0) -> int:
+    """Начало области после первой согласной, следующей за гласной"""
+    for position in range(start + 1, len(word)):
+        if word[position] not in _VOWELS and word[position - 1] in _VOWELS:
+            return position + 1
+    return len(word)
+
+
+def stem(word: str) -> str:
+    """Основа русского слова; остальные слова возвращаются как есть"""
+    vowel = next((position for position, char in enumerate(word) if char in _VOWELS), None)
+    if vowel is None:
+        return word
+    prefix, rv = word[:vowel + 1], word[vowel + 1:]
+
+    def cut(text: str, length: int) -> str:
+        return text[:len(text) - length]
+
+    length = _match(rv, _PERFECTIVE_GERUND)
+    if length:
+        rv = cut(rv, length)
+    else:
+        rv = cut(rv, _match(rv, _REFLEXIVE))
+        length = _match(rv, _ADJECTIVE)
+        if length:
+            rv = cut(rv, length)
+            rv = cut(rv, _match(rv, _PARTICIPLE))
+        else:
+            length = _match(rv, _VERB) or _match(rv, _NOUN)
+            rv = cut(rv, length)
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    length = _match(rv, _DERIVATIONAL)
+    if length and len(prefix) + len(rv) - length >= _region(word, _region(word)):
+        rv = cut(rv, length)
+
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        length = _match(rv, _SUPERLATIVE)
+        if length:
+            rv = cut(rv, length)
+            if rv.endswith("нн"):
+                rv = rv[:-1]
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е").strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы слов текста без однобуквенных слов и предлогов"""
+    return [stem(word) for word in _WORD.findall(normalize(text))
+            if (len(word) > 1 or word.isdigit()) and word not in _STOP_WORDS]
+
+
+def match_subject(query: str, subjects: Iterable[str]) -> Optional[str]:
+    """Предмет по названию с опечатками: точное совпадение, единственный
+    предмет с таким началом или ближайшее похожее название"""
+    names = {normalize(subject): subject for subject in subjects}
+    query = normalize(query)
+    if not query:
+        return None
+    if query in names:
+        return names[query]
+    prefixed = [name for name in names if name.startswith(query)]
+    if len(prefixed) == 1:
+        return names[prefixed[0]]
+    close = difflib.get_close_matches(query, names, n=1, cutoff=0.7)
+    return names[close[0]] if close else None
+
+
+def homework_documents(record: Dict, homework_key: str) -> List[Dict]:
+    """Документы для индекса: текущее ДЗ записи и её архив"""
+    documents = [{"subject": subject, "text": text, "archived_at": None}
+                 for subject, text in (record.get(homework_key) or {}).items()]
+    documents += [{"subject": entry["subject"], "text": entry["text"], "archived_at": entry.get("archived_at")}
+                  for entry in record.get(homework_key + "_archive") or []]
+    return documents
+
+
+class SearchIndex:
+    """Инвертированный индекс ДЗ по владельцам.
+
+    Владелец - ("class", class_id) или ("user", user_id); его документы
+    всегда заменяются целиком (replace), поэтому индекс нельзя испортить
+    порядком обновлений. Синхронизацию обеспечивает вызывающий код.
+    """
+
+    def __init__(self):
+        self._postings: Dict[Owner, Dict[str, Set[int]]] = {}
+        self._documents: Dict[Owner, List[Dict]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(documents) for documents in self._documents.values())
+
+    def replace(self, owner: Owner, documents: List[Dict]):
+        if not documents:
+            self._postings.pop(owner, None)
+            self._documents.pop(owner, None)
+            return
+        postings: Dict[str, Set[int]] = {}
+        for number, document in enumerate(documents):
+            for token in set(tokenize(document["subject"] + " " + document["text"])):
+                postings.setdefault(token, set()).add(number)
+        self._postings[owner] = postings
+        self._documents[owner] = documents
+
+    def search(self, owners: Iterable[Owner], query: str, limit: int = 10) -> List[Dict]:
+        """Документы, содержащие больше всего слов запроса; текущее ДЗ
+        выше архивного, свежий архив выше старого"""
+        terms = set(tokenize(query))
+        found = []
+        for owner in owners:
+            postings = self._postings.get(owner)
+            if not postings:
+                continue
+            scores = Counter()
+            for term in terms:
+                scores.update(postings.get(term, ()))
+            documents = self._documents[owner]
+            for number, score in scores.items():
+                found.append((score, dict(documents[number], scope=owner[0])))
+        # Сортировка устойчивая: сначала по дате архива, затем по весу
+        found.sort(key=lambda item: item[1]["archived_at"] or "", reverse=True)
+        found.sort(key=lambda item: (-item[0], item[1]["archived_at"] is not None))
+        return [document for _, document in found[:limit]]
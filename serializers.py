@@ -0,0 +1,93 @@
+"""Форматы файлов JSON-хранилища.
+
+Записываются файлы в формате из настроек, а читаются в любом
+поддерживаемом: формат определяется по заголовку файла, поэтому смена
+формата не требует миграции - файлы переписываются при следующем сбросе.
+orjson и msgpack необязательны.
+"""
+import json
+from typing import Any, Dict, Optional, Type
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Файлы msgpack начинаются с этой сигнатуры, JSON - с "{"
+MSGPACK_HEADER = b"\x00msgpack\n"
+
+
+class Serializer:
+    name = ""
+
+    def __init__(self, indent: Optional[int] = None):
+        self.indent = indent
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+    name = "json"
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, indent=self.indent).encode("utf-8")
+
+
+class OrjsonSerializer(Serializer):
+    """Тот же JSON, но в несколько раз быстрее stdlib"""
+
+    name = "orjson"
+
+    def __init__(self, indent: Optional[int] = None):
+        if orjson is None:
+            raise RuntimeError("orjson is not installed: pip install orjson")
+        super().__init__(indent)
+        # Как json.dumps: нестроковые ключи приводятся к строкам
+        self._option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+
+    def dumps(self, data: Any) -> bytes:
+        return orjson.dumps(data, option=self._option)
+
+
+class MsgpackSerializer(Serializer):
+    """Двоичный формат: меньше файлы, но их не прочитать глазами"""
+
+    name = "msgpack"
+
+    def __init__(self, indent: Optional[int] = None):
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed: pip install msgpack")
+        super().__init__(indent)
+
+    def dumps(self, data: Any) -> bytes:
+        return MSGPACK_HEADER + msgpack.packb(data, use_bin_type=True)
+
+
+SERIALIZERS: Dict[str, Type[Serializer]] = {
+    "json": JsonSerializer,
+    "orjson": OrjsonSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+
+def get_serializer(name: str, indent: Optional[int] = None) -> Serializer:
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown storage format: {name}")
+    return SERIALIZERS[name](indent)
+
+
+def loads(raw: bytes) -> Any:
+    """Разобрать файл любого поддерживаемого формата"""
+    if raw.startswith(MSGPACK_HEADER):
+        if msgpack is None:
+            raise RuntimeError("File is in msgpack format, but msgpack is not installed: pip install msgpack")
+        return msgpack.unpackb(raw[len(MSGPACK_HEADER):], raw=False)
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
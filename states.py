@@ -14,15 +14,21 @@ class EditProfileStates(StatesGroup):
 class ClassStates(StatesGroup):
     waiting_for_class_name = State()
     waiting_for_class_id = State()
+    waiting_for_roster = State()
 
 class HomeworkStates(StatesGroup):
     waiting_for_subject_choice = State()
     waiting_for_subject_name = State()
     waiting_for_homework_text = State()
+    waiting_for_due_date = State()
+    waiting_for_history_subject = State()
+    waiting_for_view_subject = State()
+    waiting_for_search_query = State()
 
 class InformationStates(StatesGroup):
     waiting_for_information = State()
 
 class PersonalHomeworkStates(StatesGroup):
     waiting_for_personal_subject = State()
-    waiting_for_personal_homework = State()
\ No newline at end of file
+    waiting_for_personal_homework = State()
+    waiting_for_personal_due = State()
\ No newline at end of file
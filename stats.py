@@ -0,0 +1,103 @@
+"""Статистика для админ-панели.
+
+Счётчики - словарь ключ -> число, который хранилища поддерживают при
+каждой записи: JSON-хранилище вычитает вклад старой версии записи и
+прибавляет вклад новой, SQLite ведёт те же ключи триггерами в таблице
+stats. Поэтому чтение статистики не перебирает пользователей и классы.
+
+    users                     пользователи
+    status:<projectStatus>    пользователи по статусу
+    classes                   классы
+    class_size:<n>            классы с n участниками
+    members                   участники всех классов
+    join_requests             необработанные заявки
+    homework_day:<ГГГГ-ММ-ДД> классы, ДЗ которых последний раз менялось в этот день
+    homework_never            классы, ДЗ которых ни разу не менялось
+    active:<ГГГГ-ММ-ДД>       пользователи, писавшие боту в этот день
+"""
+from collections import Counter
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Mapping, Optional
+
+FIXED_KEYS = ("users", "classes", "members", "join_requests", "homework_never")
+PREFIXES = ("status:", "class_size:")
+
+
+def record_stats(table: str, record: Optional[Dict]) -> Dict[str, int]:
+    """Вклад одной записи в счётчики"""
+    if record is None:
+        return {}
+    if table == "users":
+        return {"users": 1, f"status:{record.get('projectStatus') or 'Member'}": 1}
+    members = len(record.get("members") or ())
+    updated_at = record.get("homework_updated_at")
+    return {
+        "classes": 1,
+        f"class_size:{members}": 1,
+        "members": members,
+        "join_requests": len(record.get("join_requests") or ()),
+        f"homework_day:{updated_at[:10]}" if updated_at else "homework_never": 1,
+    }
+
+
+def apply(counters: Counter, table: str, old: Optional[Dict], new: Optional[Dict]):
+    """Обновить счётчики после замены записи old на new"""
+    counters.subtract(record_stats(table, old))
+    counters.update(record_stats(table, new))
+
+
+def compute(users: Mapping, classes: Mapping, activity: Mapping[str, int]) -> Counter:
+    """Счётчики с нуля по всем записям и числу активных по дням"""
+    counters = Counter()
+    for user in users.values():
+        counters.update(record_stats("users", user))
+    for class_data in classes.values():
+        counters.update(record_stats("classes", class_data))
+    counters.update({f"active:{day}": count for day, count in activity.items()})
+    return +counters
+
+
+def diff(actual: Mapping[str, int], expected: Mapping[str, int]) -> List[str]:
+    problems = []
+    for key in sorted(set(actual) | set(expected)):
+        if actual.get(key, 0) != expected.get(key, 0):
+            problems.append(f"Статистика {key}: {actual.get(key, 0)}, по данным {expected.get(key, 0)}")
+    return problems
+
+
+def recent_days(days: int, today: Optional[date] = None) -> List[str]:
+    today = today or date.today()
+    return [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+
+
+def keys_for(days: Iterable[str]) -> List[str]:
+    """Точные ключи, нужные summarize() кроме PREFIXES"""
+    days = list(days)
+    return list(FIXED_KEYS) + [f"active:{day}" for day in days] + [f"homework_day:{day}" for day in days]
+
+
+def summarize(values: Mapping[str, int], days: List[str]) -> Dict:
+    """Сводка для админ-панели; days - дни от сегодняшнего назад"""
+    def prefixed(prefix: str) -> Dict[str, int]:
+        return {key[len(prefix):]: value for key, value in values.items() if key.startswith(prefix) and value}
+
+    classes = values.get("classes", 0)
+    members = values.get("members", 0)
+    recent = sum(values.get(f"homework_day:{day}", 0) for day in days)
+    never = values.get("homework_never", 0)
+    return {
+        "users": values.get("users", 0),
+        "users_by_status": prefixed("status:"),
+        "classes": classes,
+        "members": members,
+        "average_class_size": round(members / classes, 1) if classes else 0,
+        "class_sizes": dict(sorted((int(size), count) for size, count in prefixed("class_size:").items())),
+        "join_requests": values.get("join_requests", 0),
+        "homework": {
+            "today": values.get(f"homework_day:{days[0]}", 0) if days else 0,
+            "recent": recent,
+            "older": classes - never - recent,
+            "never": never,
+        },
+        "active_users": {day: values.get(f"active:{day}", 0) for day in days},
+    }
@@ -0,0 +1,54 @@
+"""Общие фикстуры тестов.
+
+database.py создаёт хранилище по умолчанию при импорте, поэтому до
+импорта модулей бота DATA_DIR указывает во временный каталог.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+os.environ["BOT_TOKEN"] = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bot-tests-")
+atexit.register(shutil.rmtree, os.environ["DATA_DIR"], True)
+os.environ["STORAGE_BACKEND"] = "json"
+os.environ.pop("SQLITE_PATH", None)
+
+import pytest
+
+from database import Database, SQLiteDatabase
+
+# Все варианты хранилища: одинаковое поведение BaseDatabase API
+BACKENDS = ["json", "journal", "sharded", "sqlite"]
+
+
+def open_storage(kind: str, path: str):
+    if kind == "sqlite":
+        return SQLiteDatabase(os.path.join(path, "bot.sqlite3"))
+    return Database(path, flush_delay=0, journal=kind == "journal",
+                    layout="sharded" if kind == "sharded" else "single")
+
+
+@pytest.fixture(params=BACKENDS)
+def backend_kind(request):
+    return request.param
+
+
+@pytest.fixture
+def make_storage(backend_kind, tmp_path):
+    """Открыть хранилище в tmp_path (повторный вызов - то же хранилище после перезапуска)"""
+    opened = []
+
+    def make():
+        storage = open_storage(backend_kind, str(tmp_path))
+        opened.append(storage)
+        return storage
+
+    yield make
+    for storage in opened:
+        storage.close()
+
+
+@pytest.fixture
+def storage(make_storage):
+    return make_storage()
@@ -0,0 +1,498 @@
+"""BaseDatabase API: одинаковое поведение JSON (single, journal, sharded) и SQLite"""
+import json
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import BACKENDS, open_storage
+from database import Database, SQLiteDatabase, migrate_json_to_sqlite
+
+DUE = "2099-05-20T08:00:00"
+
+
+def make_user(storage, user_id):
+    # create_user_profile перезаписывает профиль целиком
+    if storage.get_user(user_id) is None:
+        storage.create_user_profile(user_id, f"Ученик {user_id}")
+
+
+def make_class(storage, class_id="c1", creator=1, members=(), requests=()):
+    make_user(storage, creator)
+    storage.create_class(class_id, f"Класс {class_id}", creator)
+    storage.update_user_class(creator, class_id, "староста")
+    for user_id in members:
+        make_user(storage, user_id)
+        storage.add_member(class_id, user_id)
+    for user_id in requests:
+        make_user(storage, user_id)
+        storage.add_join_request(class_id, user_id)
+
+
+def assert_consistent(storage):
+    assert storage.check_consistency() == []
+    assert storage.rebuild_stats(repair=False) == []
+
+
+# === Users ===
+def test_user_profile_roundtrip(storage):
+    storage.create_user_profile(1, "Аня")
+    storage.update_user_profile(1, {"phone": "+7 900"})
+    storage.update_user_status(1, "Admin")
+    storage.update_user_settings(1, {"homework_notifications": True})
+    user = storage.get_user(1)
+    assert user["name"] == "Аня"
+    assert user["profile"]["phone"] == "+7 900"
+    assert user["projectStatus"] == "Admin"
+    assert user["settings"] == {"homework_notifications": True}
+    assert storage.get_user(2) is None
+    assert storage.get_users([2, 1]) == {2: None, 1: user}
+    assert storage.get_user_ids() == [1]
+
+
+def test_returned_records_are_copies(storage):
+    make_class(storage, members=[2])
+    storage.get_class("c1")["members"].append(99)
+    storage.get_user(2)["profile"]["phone"] = "changed"
+    assert storage.get_class("c1")["members"] == [1, 2]
+    assert storage.get_user(2)["profile"]["phone"] == ""
+
+
+# === Membership ===
+def test_join_request_accept_and_reject(storage):
+    make_class(storage, requests=[2, 3])
+    storage.add_join_request("c1", 2)
+    assert storage.get_class("c1")["join_requests"] == [2, 3]
+    assert storage.has_join_request("c1", 2)
+
+    assert storage.process_join_request("c1", 2, accept=True)
+    assert not storage.process_join_request("c1", 2, accept=True)
+    assert storage.process_join_request("c1", 3, accept=False)
+    assert storage.is_member("c1", 2) and not storage.is_member("c1", 3)
+    assert not storage.has_join_request("c1", 3)
+    assert storage.get_users_in_class("c1") == [1, 2]
+    assert storage.get_user(2)["class_id"] == "c1"
+    assert storage.get_user(2)["teamRole"] == "участник"
+    assert storage.get_user(3)["class_id"] is None
+    assert storage.get_member_class(2) == "c1"
+    assert storage.get_user_class(2)["id"] == "c1"
+    assert_consistent(storage)
+
+
+def test_remove_member(storage):
+    make_class(storage, members=[2, 3])
+    assert storage.remove_member("c1", 2)
+    assert not storage.remove_member("c1", 2)
+    assert storage.get_users_in_class("c1") == [1, 3]
+    assert storage.get_user(2)["class_id"] is None
+    assert storage.get_member_class(2) is None
+    assert_consistent(storage)
+
+
+def test_process_join_requests_skips_users_of_other_classes(storage):
+    make_class(storage, "c1", 1, requests=[2, 3, 4])
+    make_class(storage, "c2", 10, members=[3])
+    processed = storage.process_join_requests("c1")
+    assert processed == [2, 3, 4]
+    assert storage.get_class("c1")["join_requests"] == []
+    assert storage.get_users_in_class("c1") == [1, 2, 4]
+    assert storage.get_user(3)["class_id"] == "c2"
+    assert_consistent(storage)
+
+
+def test_import_members(storage):
+    make_class(storage, "c1", 1, requests=[2])
+    make_class(storage, "c2", 10, members=[3])
+    result = storage.import_members("c1", [(2, "Боря", "участник"), (3, "Вера", "участник"),
+                                           (4, "Гоша", "помощник старосты")])
+    assert result == {"added": [2, 4], "created": [4], "skipped": [3]}
+    assert storage.get_users_in_class("c1") == [1, 2, 4]
+    assert storage.get_class("c1")["join_requests"] == []
+    assert storage.get_user(4)["name"] == "Гоша"
+    assert storage.get_user(4)["teamRole"] == "помощник старосты"
+    assert storage.import_members("missing", [(5, "Даша", "участник")]) is None
+    assert_consistent(storage)
+
+
+def test_notification_recipients(storage):
+    make_class(storage, members=[2, 3])
+    storage.update_user_settings(3, {"homework_notifications": True})
+    assert storage.get_notification_recipients("c1") == [3]
+
+
+# === Homework ===
+def test_class_homework_and_meta(storage):
+    make_class(storage)
+    storage.set_class_homework("c1", "Физика", "стр. 5", 1, due=DUE, attachments=[{"type": "photo", "file_id": "x"}])
+    storage.set_class_homework("c1", "Химия", "опыт", 1)
+    class_data = storage.get_class("c1")
+    assert class_data["homework"] == {"Физика": "стр. 5", "Химия": "опыт"}
+    assert class_data["homework_meta"] == {"Физика": {"due": DUE, "attachments": [{"type": "photo", "file_id": "x"}]}}
+    assert class_data["homework_version"] == 2
+    assert class_data["homework_updated_at"]
+    assert storage.get_class_homework("c1", "Физика") == {"Физика": "стр. 5"}
+    assert storage.get_class_homework("c1", "Алгебра") == {"Алгебра": "ДЗ не задано"}
+    assert storage.get_class_homework("missing") == {}
+
+    storage.update_class_homework("c1", {"Химия": "опыт 2", "Алгебра": "№1"}, 1)
+    class_data = storage.get_class("c1")
+    assert class_data["homework"] == {"Химия": "опыт 2", "Алгебра": "№1"}
+    assert class_data.get("homework_meta", {}) == {}
+    assert class_data["homework_version"] == 3
+    assert_consistent(storage)
+
+
+def test_personal_homework(storage):
+    storage.create_user_profile(1, "Аня")
+    storage.add_personal_homework(1, "Химия", "опыт", due=DUE)
+    user = storage.get_user(1)
+    assert user["personal_homework"] == {"Химия": "опыт"}
+    assert user["personal_homework_meta"] == {"Химия": {"due": DUE}}
+    assert user["personal_homework_version"] == 1
+
+
+def test_history_and_revert(storage):
+    make_class(storage)
+    for number in range(1, 21):
+        storage.set_class_homework("c1", "Физика", f"параграф {number}", author_id=number, due=DUE)
+    history = storage.get_homework_history("c1", "Физика", limit=3)
+    assert [(entry["rev"], entry["author"], entry["text"]) for entry in history] == [
+        (20, 20, "параграф 20"), (19, 19, "параграф 19"), (18, 18, "параграф 18")]
+    assert storage.get_homework_revision("c1", "Физика", 7) == "параграф 7"
+    assert storage.get_homework_revision("c1", "Физика", 99) is None
+
+    assert storage.revert_class_homework("c1", "Физика", 7, author_id=5) == "параграф 7"
+    class_data = storage.get_class("c1")
+    assert class_data["homework"]["Физика"] == "параграф 7"
+    # Откат меняет только текст: срок остаётся
+    assert class_data["homework_meta"]["Физика"]["due"] == DUE
+    latest = storage.get_homework_history("c1", "Физика", limit=1)[0]
+    assert (latest["rev"], latest["author"], latest["text"]) == (21, 5, "параграф 7")
+    assert storage.revert_class_homework("c1", "Физика", 99) is None
+    assert storage.revert_class_homework("missing", "Физика", 1) is None
+
+
+def test_archive_class_homework(storage):
+    make_class(storage)
+    storage.set_class_homework("c1", "Физика", "стр. 5", 1, due=DUE)
+    storage.set_class_homework("c1", "Химия", "опыт", 1)
+    version = storage.get_class("c1")["homework_version"]
+    # Срок с тех пор меняли - таймер устарел
+    assert not storage.archive_class_homework("c1", "Физика", "2099-05-21T08:00:00")
+    assert not storage.archive_class_homework("c1", "Химия", DUE)
+    assert not storage.archive_class_homework("missing", "Физика", DUE)
+
+    assert storage.archive_class_homework("c1", "Физика", DUE)
+    class_data = storage.get_class("c1")
+    assert class_data["homework"] == {"Химия": "опыт"}
+    assert "Физика" not in class_data.get("homework_meta", {})
+    archived = class_data["homework_archive"][-1]
+    assert (archived["subject"], archived["text"], archived["due"]) == ("Физика", "стр. 5", DUE)
+    assert class_data["homework_version"] == version + 1
+    assert storage.get_homework_history("c1", "Физика", limit=1)[0]["text"] is None
+    assert not storage.archive_class_homework("c1", "Физика", DUE)
+
+
+def test_archive_personal_homework(storage):
+    storage.create_user_profile(1, "Аня")
+    storage.add_personal_homework(1, "Химия", "опыт", due=DUE)
+    assert not storage.archive_personal_homework(1, "Химия", "2099-01-01T08:00:00")
+    assert storage.archive_personal_homework(1, "Химия", DUE)
+    user = storage.get_user(1)
+    assert user["personal_homework"] == {}
+    assert user["personal_homework_archive"][-1]["text"] == "опыт"
+
+
+def test_search_homework(storage):
+    make_class(storage, members=[2])
+    storage.set_class_homework("c1", "Физика", "прочитать параграфы 5 и 6", 1, due=DUE)
+    storage.set_class_homework("c1", "Химия", "лабораторная работа", 1)
+    storage.add_personal_homework(2, "Алгебра", "решить задачи из параграфа 3")
+    storage.build_search_index()
+
+    found = storage.search_homework("параграф", class_id="c1", user_id=2)
+    assert {(item["scope"], item["subject"]) for item in found} == {("class", "Физика"), ("user", "Алгебра")}
+    assert storage.search_homework("параграф", class_id="c1") == [
+        {"subject": "Физика", "text": "прочитать параграфы 5 и 6", "archived_at": None, "scope": "class"}]
+    # Изменения после построения индекса видны поиску
+    storage.set_class_homework("c1", "Химия", "повторить параграф", 1)
+    assert {item["subject"] for item in storage.search_homework("параграф", class_id="c1")} == {"Физика", "Химия"}
+    storage.archive_class_homework("c1", "Физика", DUE)
+    archived = [item for item in storage.search_homework("параграфы", class_id="c1") if item["subject"] == "Физика"]
+    assert archived and archived[0]["archived_at"]
+    assert storage.search_homework("параграф", class_id="c2") == []
+
+
+# === Pages ===
+def test_class_list_pages(storage):
+    make_class(storage, members=range(2, 13))
+    assert storage.get_class_list_page("c1", "members", 5) == (0, [1, 2, 3, 4, 5], 12)
+    assert storage.get_class_list_page("c1", "members", 5, anchor=5, position=4) == (5, [6, 7, 8, 9, 10], 12)
+    assert storage.get_class_list_page("c1", "members", 5, anchor=10) == (10, [11, 12], 12)
+    assert storage.get_class_list_page("c1", "members", 5, anchor=11, backward=True, position=10) == (
+        5, [6, 7, 8, 9, 10], 12)
+    # Курсора больше нет в списке - первая страница
+    storage.remove_member("c1", 10)
+    assert storage.get_class_list_page("c1", "members", 5, anchor=10) == (0, [1, 2, 3, 4, 5], 11)
+    assert storage.get_class_list_page("c1", "join_requests", 5) == (0, [], 0)
+
+
+def test_id_pages(storage):
+    for user_id in (30, 10, 20, 50, 40):
+        storage.create_user_profile(user_id, "x")
+    assert storage.get_id_page("users", 2) == (0, [10, 20], 5)
+    assert storage.get_id_page("users", 2, anchor=20, position=1) == (2, [30, 40], 5)
+    assert storage.get_id_page("users", 2, anchor=40) == (4, [50], 5)
+    assert storage.get_id_page("users", 2, anchor=30, backward=True, position=2) == (0, [10, 20], 5)
+    make_class(storage, "b", 60)
+    make_class(storage, "a", 70)
+    assert storage.get_id_page("classes", 5) == (0, ["a", "b"], 2)
+
+
+# === Statistics ===
+def test_stats_follow_writes(storage):
+    make_class(storage, "c1", 1, members=[2, 3], requests=[4])
+    make_class(storage, "c2", 10)
+    storage.update_user_status(2, "Staff")
+    storage.set_class_homework("c1", "Физика", "стр. 5", 1)
+    storage.remove_member("c1", 3)
+    summary = storage.get_stats(days=3)
+    assert summary["users"] == 5
+    assert summary["users_by_status"] == {"Member": 4, "Staff": 1}
+    assert summary["classes"] == 2
+    assert summary["members"] == 3
+    assert summary["class_sizes"] == {1: 1, 2: 1}
+    assert summary["join_requests"] == 1
+    assert summary["homework"] == {"today": 1, "recent": 1, "older": 0, "never": 1}
+    assert_consistent(storage)
+
+
+def test_record_activity_counts_each_user_once_per_day(storage):
+    today = date.today().isoformat()
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    old = (date.today() - timedelta(days=30)).isoformat()
+    assert storage.record_activity(1)
+    assert storage.record_activity(1, yesterday)
+    # Чередование дней и запоздалые отметки не считаются повторно
+    assert not storage.record_activity(1, today)
+    assert not storage.record_activity(1, yesterday)
+    assert storage.record_activity(1, old)
+    assert not storage.record_activity(1, old)
+    assert storage.record_activity(2, today)
+    assert storage.get_stats(days=2)["active_users"] == {today: 2, yesterday: 1}
+    assert storage.rebuild_stats(repair=False) == []
+
+
+def test_check_consistency_repairs_membership(storage):
+    make_class(storage, members=[2])
+    with storage.transaction(user_id=2) as user:
+        user["class_id"] = None
+    with storage.transaction(class_id="c1") as class_data:
+        class_data["join_requests"].append(1)
+    assert len(storage.check_consistency(repair=True)) == 2
+    assert storage.get_user(2)["class_id"] == "c1"
+    assert storage.get_class("c1")["join_requests"] == []
+    assert storage.check_consistency() == []
+
+
+# === Transactions ===
+def test_transaction_saves_only_without_exception(storage):
+    make_class(storage)
+    with pytest.raises(RuntimeError):
+        with storage.transaction(class_id="c1") as class_data:
+            class_data["information"] = "не сохранится"
+            raise RuntimeError
+    assert storage.get_class("c1")["information"] == ""
+    with storage.transaction(class_id="c1", user_id=1) as (class_data, user):
+        class_data["information"] = "сохранится"
+        user["name"] = "Новое имя"
+    assert storage.get_class("c1")["information"] == "сохранится"
+    assert storage.get_user(1)["name"] == "Новое имя"
+
+
+def test_transaction_and_create_do_not_deadlock(storage):
+    """Регрессия: transaction() и create_* брали блокировки в разном порядке"""
+    make_class(storage)
+    errors = []
+
+    def edit():
+        try:
+            for number in range(100):
+                with storage.transaction(class_id="c1", user_id=1) as (class_data, user):
+                    class_data["information"] = str(number)
+        except Exception as e:
+            errors.append(e)
+
+    def create():
+        try:
+            for number in range(100):
+                storage.create_user_profile(1, "Аня")
+                storage.create_class(f"new-{number}", "Новый", 1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=edit), threading.Thread(target=create)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads), "deadlock"
+    assert errors == []
+
+
+def test_concurrent_edits_and_reverts_keep_history_consistent(storage):
+    """Регрессия: откат читал версию и писал текст в разных транзакциях"""
+    make_class(storage)
+    storage.set_class_homework("c1", "Физика", "v0", 1, due=DUE)
+
+    def edit():
+        for number in range(50):
+            storage.set_class_homework("c1", "Физика", f"правка {number}", 1, due=DUE)
+
+    def revert():
+        for _ in range(50):
+            storage.revert_class_homework("c1", "Физика", 1, 2)
+
+    threads = [threading.Thread(target=edit), threading.Thread(target=revert)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    class_data = storage.get_class("c1")
+    latest = storage.get_homework_history("c1", "Физика", limit=1)[0]
+    # Каждая правка меняет текст, повторный откат к той же версии - нет
+    assert 51 <= latest["rev"] <= 101
+    assert latest["text"] == class_data["homework"]["Физика"]
+    for entry in storage.get_homework_history("c1", "Физика", limit=latest["rev"]):
+        assert storage.get_homework_revision("c1", "Физика", entry["rev"]) == entry["text"]
+    assert class_data["homework_meta"]["Физика"]["due"] == DUE
+
+
+# === Persistence ===
+def test_data_survives_reopen(make_storage):
+    storage = make_storage()
+    make_class(storage, members=[2], requests=[3])
+    storage.set_class_homework("c1", "Физика", "стр. 5", 1, due=DUE)
+    storage.add_personal_homework(2, "Химия", "опыт")
+    storage.record_activity(2)
+    before = (storage.get_all_users(), storage.get_all_classes(), storage.get_stats())
+    history = storage.get_homework_history("c1", "Физика")
+    storage.close()
+
+    reopened = make_storage()
+    assert (reopened.get_all_users(), reopened.get_all_classes(), reopened.get_stats()) == before
+    assert reopened.get_homework_history("c1", "Физика") == history
+    assert not reopened.record_activity(2)
+
+
+def scenario(storage):
+    make_class(storage, "c1", 1, members=[2, 3], requests=[4, 5])
+    make_class(storage, "c2", 10, requests=[3])
+    storage.process_join_request("c1", 4, accept=True)
+    storage.process_join_requests("c2", accept=True)
+    storage.import_members("c2", [(20, "Новый", "участник"), (2, "Занят", "участник")])
+    storage.remove_member("c1", 2)
+    storage.update_class_information("c1", "Кабинет 12")
+    storage.update_class_homework("c1", {"Физика": "стр. 5", "Химия": "опыт"}, 1)
+    storage.set_class_homework("c1", "Физика", "стр. 6", 1, due=DUE)
+    storage.revert_class_homework("c1", "Физика", 1, 1)
+    storage.archive_class_homework("c1", "Физика", DUE)
+    storage.add_personal_homework(3, "Алгебра", "№ 1", due=DUE)
+    storage.update_user_settings(3, {"homework_notifications": True})
+    storage.update_user_status(10, "Admin")
+
+
+def normalized(storage):
+    """Все записи без отметок времени"""
+    def strip(value):
+        if isinstance(value, dict):
+            return {key: strip(item) for key, item in value.items()
+                    if key not in ("created_at", "homework_updated_at", "archived_at", "at")}
+        if isinstance(value, list):
+            return [strip(item) for item in value]
+        return value
+
+    history = {subject: [{key: value for key, value in entry.items() if key != "at"}
+                         for entry in storage.get_homework_history("c1", subject, limit=10)]
+               for subject in ("Физика", "Химия")}
+    return strip(storage.get_all_users()), strip(storage.get_all_classes()), history
+
+
+def test_backends_agree(tmp_path):
+    results = {}
+    for kind in BACKENDS:
+        storage = open_storage(kind, str(tmp_path / kind))
+        try:
+            scenario(storage)
+            assert storage.check_consistency() == []
+            results[kind] = (normalized(storage), storage.get_stats())
+        finally:
+            storage.close()
+    expected = results.pop("json")
+    for kind, result in results.items():
+        assert result == expected, kind
+
+
+# === Backend specifics ===
+def test_sqlite_save_writes_only_changed_rows(tmp_path):
+    storage = open_storage("sqlite", str(tmp_path))
+    try:
+        make_class(storage, members=range(2, 42), requests=range(50, 60))
+        storage.update_class_homework("c1", {f"Предмет {n}": "текст" for n in range(20)}, 1)
+        conn = storage._conn
+
+        before = conn.total_changes
+        storage.update_class_information("c1", "Кабинет 12")
+        assert conn.total_changes - before == 1
+
+        before = conn.total_changes
+        assert storage.process_join_request("c1", 55, accept=False)
+        # Заявка, строка класса и счётчик статистики
+        assert conn.total_changes - before <= 3
+
+        before = conn.total_changes
+        with storage.transaction(class_id="c1") as class_data:
+            class_data["members"].remove(20)
+        # Одна строка участника и счётчики; остальные 40 строк не переписываются
+        assert conn.total_changes - before < 10
+        assert storage.get_users_in_class("c1") == [1] + [n for n in range(2, 42) if n != 20]
+    finally:
+        storage.close()
+
+
+def test_json_flushes_from_single_thread(tmp_path):
+    storage = Database(str(tmp_path), flush_delay=0.05)
+    try:
+        threads_before = threading.active_count()
+        for user_id in range(200):
+            storage.create_user_profile(user_id, "x")
+        assert threading.active_count() <= threads_before + 1
+        storage.flush()
+        with open(storage.users_file, encoding="utf-8") as f:
+            assert len(json.load(f)) == 200
+    finally:
+        storage.close()
+    assert storage._flusher is None
+    assert Database(str(tmp_path)).get_user(199)["name"] == "x"
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    data_dir = str(tmp_path / "json")
+    source = open_storage("json", data_dir)
+    scenario(source)
+    source.record_activity(3)
+    expected = normalized(source)
+    stats = source.get_stats()
+    source.close()
+
+    sqlite_path = str(tmp_path / "bot.sqlite3")
+    assert migrate_json_to_sqlite(data_dir, sqlite_path) == {
+        "users": len(expected[0]), "classes": len(expected[1]), "activity": 1}
+    target = SQLiteDatabase(sqlite_path)
+    try:
+        assert normalized(target) == expected
+        assert target.get_stats() == stats
+        assert target.check_consistency() == []
+        assert not target.record_activity(3)
+    finally:
+        target.close()
@@ -0,0 +1,94 @@
+"""История ДЗ: разницы, опорные ревизии и файл истории"""
+import random
+
+import pytest
+
+import history
+from history import KEYFRAME_INTERVAL, HistoryLog
+
+
+@pytest.mark.parametrize("old, new", [
+    ("", "параграф 5"),
+    ("параграф 5", ""),
+    ("параграф 5, упр. 3", "параграф 6, упр. 3 и 4"),
+    ("одинаковый текст", "одинаковый текст"),
+    ("abc", "полностью другой текст"),
+])
+def test_delta_roundtrip(old, new):
+    assert history.apply_delta(old, history.make_delta(old, new)) == new
+
+
+def test_delta_roundtrip_random_edits():
+    rng = random.Random(1)
+    text = "прочитать параграф 5 и ответить на вопросы"
+    for _ in range(200):
+        position = rng.randrange(len(text) + 1)
+        new = text[:position] + rng.choice(["", "№ 7", " и "]) + text[position + rng.randrange(4):]
+        assert history.apply_delta(text, history.make_delta(text, new)) == new
+        text = new
+
+
+def test_keyframes():
+    assert history.keyframe_before(1) == 1
+    assert history.keyframe_before(KEYFRAME_INTERVAL) == 1
+    assert history.keyframe_before(KEYFRAME_INTERVAL + 1) == KEYFRAME_INTERVAL + 1
+    assert history.keyframe_before(3 * KEYFRAME_INTERVAL + 5) == 3 * KEYFRAME_INTERVAL + 1
+    revision = history.make_revision(KEYFRAME_INTERVAL + 1, "параграф 5", "параграф 6", 1)
+    assert revision["text"] == "параграф 6"
+    revision = history.make_revision(2, "длинный текст задания, параграф 5", "длинный текст задания, параграф 6", 1)
+    assert "delta" in revision and "text" not in revision
+    assert history.make_revision(3, "текст", None, 1)["removed"]
+
+
+def build_revisions(texts):
+    revisions, old = [], None
+    for rev, text in enumerate(texts, 1):
+        revisions.append(history.make_revision(rev, old, text, rev))
+        old = text
+    return revisions
+
+
+def test_replay_from_keyframe_restores_every_revision():
+    texts = [f"Задание {n}: параграф {n // 3}, упражнения {n} и {n + 1}" for n in range(3 * KEYFRAME_INTERVAL + 5)]
+    texts[20] = None
+    texts[21] = "после удаления"
+    revisions = build_revisions(texts)
+    for rev, text in enumerate(texts, 1):
+        start = history.keyframe_before(rev)
+        # Восстановление не проигрывает больше KEYFRAME_INTERVAL ревизий
+        versions = history.replay(revisions[start - 1:rev])
+        assert len(versions) <= KEYFRAME_INTERVAL
+        entry, restored = versions[-1]
+        assert entry["rev"] == rev
+        assert restored == text
+
+
+def test_history_log_append_read_reload(tmp_path):
+    path = str(tmp_path / "history.log")
+    log = HistoryLog(path)
+    physics = build_revisions(["параграф 5", "параграф 6", None])
+    log.append("c1", "Физика", physics[:2])
+    log.append("c2", "Химия", build_revisions(["опыт"]))
+    log.append("c1", "Физика", physics[2:])
+    assert log.count("c1", "Физика") == 3
+    assert log.read("c1", "Физика") == physics
+    assert log.read("c1", "Физика", since_rev=3) == physics[2:]
+    assert log.read("c1", "Алгебра") == []
+
+    reloaded = HistoryLog(path)
+    assert sorted(reloaded.subjects()) == [("c1", "Физика"), ("c2", "Химия")]
+    assert reloaded.read("c1", "Физика") == physics
+
+
+def test_history_log_drops_damaged_tail(tmp_path):
+    path = str(tmp_path / "history.log")
+    log = HistoryLog(path)
+    revisions = build_revisions(["параграф 5", "параграф 6"])
+    log.append("c1", "Физика", revisions)
+    with open(path, "ab") as f:
+        f.write(b'{"rev":3,"class_id":"c1","subj')
+
+    reloaded = HistoryLog(path)
+    assert reloaded.read("c1", "Физика") == revisions
+    reloaded.append("c1", "Физика", [history.make_revision(3, "параграф 6", "параграф 7", 1)])
+    assert [entry["rev"] for entry in HistoryLog(path).read("c1", "Физика")] == [1, 2, 3]
@@ -0,0 +1,35 @@
+"""Перенос data/users.json и data/classes.json по файлам записей"""
+import os
+
+from conftest import open_storage
+from database import Database, migrate_json_to_sharded
+from test_database import normalized, scenario
+
+
+def test_migrate_json_to_sharded(tmp_path):
+    data_dir = str(tmp_path)
+    source = open_storage("json", data_dir)
+    scenario(source)
+    expected = normalized(source)
+    stats = source.get_stats()
+    source.close()
+
+    assert migrate_json_to_sharded(data_dir) == {"users": len(expected[0]), "classes": len(expected[1])}
+    assert not os.path.exists(os.path.join(data_dir, "users.json"))
+    assert os.path.exists(os.path.join(data_dir, "users.json.bak"))
+    assert os.path.exists(os.path.join(data_dir, "classes.json.bak"))
+    # Повторный запуск ничего не делает
+    assert migrate_json_to_sharded(data_dir) == {"users": 0, "classes": 0}
+
+    target = Database(data_dir, layout="sharded")
+    try:
+        assert normalized(target) == expected
+        assert target.get_stats() == stats
+        assert target.check_consistency() == []
+    finally:
+        target.close()
+
+
+def test_migrate_json_to_sharded_without_data(tmp_path):
+    assert migrate_json_to_sharded(str(tmp_path)) == {"users": 0, "classes": 0}
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,143 @@
+"""ReminderScheduler: срабатывание, замена и отмена таймеров, claim/release в общей таблице"""
+import asyncio
+import sqlite3
+import time
+
+import reminders
+from reminders import ReminderScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def stored_keys(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(key for key, in conn.execute("SELECT key FROM reminders"))
+
+
+class Recorder:
+    def __init__(self):
+        self.payloads = []
+
+    async def __call__(self, payload):
+        self.payloads.append(payload)
+
+
+def test_timer_fires_once_and_is_released(tmp_path):
+    path = str(tmp_path / "reminders.sqlite3")
+    handler = Recorder()
+
+    async def scenario():
+        scheduler = ReminderScheduler(handler, path, flush_interval=0.01)
+        await scheduler.start()
+        scheduler.schedule("a", time.time() + 0.05, {"n": 1})
+        scheduler.schedule("later", time.time() + 3600, {"n": 2})
+        await asyncio.sleep(0.3)
+        assert len(scheduler) == 1
+        await scheduler.close()
+
+    run(scenario())
+    assert handler.payloads == [{"n": 1}]
+    assert stored_keys(path) == ["later"]
+
+
+def test_replace_and_cancel(tmp_path):
+    path = str(tmp_path / "reminders.sqlite3")
+    handler = Recorder()
+
+    async def scenario():
+        scheduler = ReminderScheduler(handler, path, flush_interval=0.01)
+        await scheduler.start()
+        scheduler.schedule("a", time.time() + 3600, {"n": 1})
+        # Новый таймер раньше спящего цикла - цикл просыпается
+        scheduler.schedule("a", time.time() + 0.05, {"n": 2})
+        scheduler.schedule("b", time.time() + 0.05, {"n": 3})
+        scheduler.cancel("b")
+        scheduler.cancel("missing")
+        await asyncio.sleep(0.3)
+        await scheduler.close()
+
+    run(scenario())
+    assert handler.payloads == [{"n": 2}]
+    assert stored_keys(path) == []
+
+
+def test_timers_survive_restart(tmp_path):
+    path = str(tmp_path / "reminders.sqlite3")
+    handler = Recorder()
+
+    async def first():
+        scheduler = ReminderScheduler(handler, path, flush_interval=3600)
+        await scheduler.start()
+        scheduler.schedule("a", time.time() + 0.2, {"n": 1})
+        scheduler.schedule("b", time.time() + 3600, {"n": 2})
+        # Закрытие сохраняет ещё не записанные изменения
+        await scheduler.close()
+
+    async def second():
+        scheduler = ReminderScheduler(handler, path)
+        await scheduler.start()
+        assert len(scheduler) == 2
+        await asyncio.sleep(0.5)
+        await scheduler.close()
+
+    run(first())
+    assert stored_keys(path) == ["a", "b"]
+    run(second())
+    assert handler.payloads == [{"n": 1}]
+    assert stored_keys(path) == ["b"]
+
+
+def test_shared_table_fires_timer_in_one_process(tmp_path):
+    path = str(tmp_path / "reminders.sqlite3")
+    handlers = [Recorder(), Recorder()]
+
+    async def scenario():
+        setup = ReminderScheduler(Recorder(), path)
+        await setup.start()
+        for n in range(10):
+            setup.schedule(f"t{n}", time.time() + 0.3, {"n": n})
+        await setup.close()
+
+        schedulers = [ReminderScheduler(handler, path) for handler in handlers]
+        for scheduler in schedulers:
+            await scheduler.start()
+        await asyncio.sleep(0.8)
+        for scheduler in schedulers:
+            await scheduler.close()
+
+    run(scenario())
+    fired = sorted(payload["n"] for handler in handlers for payload in handler.payloads)
+    assert fired == list(range(10))
+    assert stored_keys(path) == []
+
+
+def test_claimed_timer_fires_again_after_lease(tmp_path, monkeypatch):
+    """Процесс забрал таймер и упал до release: таймер срабатывает после аренды"""
+    monkeypatch.setattr(reminders, "CLAIM_LEASE", 0.3)
+    path = str(tmp_path / "reminders.sqlite3")
+    handler = Recorder()
+
+    async def scenario():
+        # Цикл не запущен: таймер забирается вручную, обработчик не вызывается
+        crashed = ReminderScheduler(Recorder(), path)
+        fire_at = time.time()
+        crashed.schedule("a", fire_at, {"n": 1})
+        await crashed.flush()
+        assert await crashed._run(crashed._claim, "a", fire_at)
+        # Забрать таймер второй раз нельзя
+        assert not await crashed._run(crashed._claim, "a", fire_at)
+        await crashed.close()
+        assert stored_keys(path) == ["a"]
+
+        scheduler = ReminderScheduler(handler, path)
+        await scheduler.start()
+        await asyncio.sleep(0.1)
+        assert handler.payloads == []
+        await asyncio.sleep(0.6)
+        await scheduler.close()
+
+    run(scenario())
+    assert handler.payloads == [{"n": 1}]
+    assert stored_keys(path) == []
@@ -0,0 +1,80 @@
+"""Стеммер и инвертированный индекс ДЗ"""
+import pytest
+
+from search import SearchIndex, homework_documents, match_subject, stem, tokenize
+
+
+@pytest.mark.parametrize("forms", [
+    ["параграф", "параграфы", "параграфа", "параграфов", "параграфе"],
+    ["задача", "задачи", "задачу", "задачей", "задач"],
+    ["упражнение", "упражнения", "упражнений"],
+    ["прочитать", "прочитай"],
+])
+def test_word_forms_share_stem(forms):
+    assert len({stem(form) for form in forms}) == 1
+
+
+@pytest.mark.parametrize("word", ["page", "12", "№", "бб"])
+def test_words_without_russian_endings_unchanged(word):
+    assert stem(word) == word
+
+
+def test_tokenize():
+    assert tokenize("Решить задачи на стр. 5 и № 7") == [stem("решить"), stem("задачи"), stem("стр"), "5", "7"]
+    assert tokenize("Ёлка") == [stem("елка")]
+    assert tokenize("и в на") == []
+
+
+def test_homework_documents():
+    record = {"homework": {"Физика": "параграф 5"},
+              "homework_archive": [{"subject": "Химия", "text": "опыт", "archived_at": "2024-05-01T08:00:00"}]}
+    assert homework_documents(record, "homework") == [
+        {"subject": "Физика", "text": "параграф 5", "archived_at": None},
+        {"subject": "Химия", "text": "опыт", "archived_at": "2024-05-01T08:00:00"}]
+    assert homework_documents({}, "personal_homework") == []
+
+
+def test_search_ranking_and_owners():
+    index = SearchIndex()
+    index.replace(("class", "c1"), [
+        {"subject": "Физика", "text": "прочитать параграф 5", "archived_at": None},
+        {"subject": "Физика", "text": "параграфы 1-4, задачи 3 и 4", "archived_at": "2024-04-01T08:00:00"},
+        {"subject": "Физика", "text": "параграф 3, задача 1", "archived_at": "2024-05-01T08:00:00"},
+        {"subject": "Химия", "text": "лабораторная работа", "archived_at": None},
+    ])
+    index.replace(("user", 1), [{"subject": "Алгебра", "text": "задачи из параграфа 2", "archived_at": None}])
+    index.replace(("class", "c2"), [{"subject": "Физика", "text": "параграф 9", "archived_at": None}])
+    assert len(index) == 6
+
+    found = index.search([("class", "c1"), ("user", 1)], "параграфы задач")
+    # Больше совпавших слов - выше; при равенстве текущее ДЗ выше архива, свежий архив выше старого
+    assert [(item["scope"], item["text"]) for item in found] == [
+        ("user", "задачи из параграфа 2"),
+        ("class", "параграф 3, задача 1"),
+        ("class", "параграфы 1-4, задачи 3 и 4"),
+        ("class", "прочитать параграф 5"),
+    ]
+    assert index.search([("class", "c1")], "химия")[0]["subject"] == "Химия"
+    assert index.search([("class", "c1")], "параграф", limit=1)[0]["text"] == "прочитать параграф 5"
+    assert index.search([("class", "c3")], "параграф") == []
+    assert index.search([("class", "c1")], "и на") == []
+
+
+def test_replace_drops_old_documents():
+    index = SearchIndex()
+    index.replace(("class", "c1"), [{"subject": "Физика", "text": "параграф 5", "archived_at": None}])
+    index.replace(("class", "c1"), [{"subject": "Химия", "text": "опыт", "archived_at": None}])
+    assert index.search([("class", "c1")], "параграф") == []
+    index.replace(("class", "c1"), [])
+    assert len(index) == 0
+    assert index.search([("class", "c1")], "опыт") == []
+
+
+def test_match_subject():
+    subjects = ["Физика", "Химия", "Алгебра", "Геометрия", "Литература", "Русский язык"]
+    assert match_subject("физика", subjects) == "Физика"
+    assert match_subject("Фищика", subjects) == "Физика"
+    assert match_subject("рус", subjects) == "Русский язык"
+    assert match_subject("алгебар", subjects) == "Алгебра"
+    assert match_subject("история", subjects) is None
+    assert match_subject("  ", subjects) is None
@@ -0,0 +1,68 @@
+"""Счётчики статистики: поддержка при записях против подсчёта с нуля"""
+import random
+from collections import Counter
+from datetime import date
+
+import stats
+
+
+def random_record(rng, table, key):
+    if table == "users":
+        return {"id": key, "projectStatus": rng.choice(["Owner", "Admin", "Staff", "Member", None])}
+    updated_at = rng.choice([None, "2024-05-10T09:00:00", "2024-05-09T18:30:00", "2024-04-01T08:00:00"])
+    return {
+        "id": key,
+        "members": list(range(rng.randrange(5))),
+        "join_requests": list(range(rng.randrange(3))),
+        "homework_updated_at": updated_at,
+    }
+
+
+def test_apply_matches_compute():
+    rng = random.Random(7)
+    records = {"users": {}, "classes": {}}
+    counters = Counter()
+    for _ in range(2000):
+        table = rng.choice(["users", "classes"])
+        key = rng.randrange(30)
+        old = records[table].get(key)
+        new = None if old is not None and rng.random() < 0.2 else random_record(rng, table, key)
+        stats.apply(counters, table, old, new)
+        if new is None:
+            del records[table][key]
+        else:
+            records[table][key] = new
+        assert stats.diff(+counters, stats.compute(records["users"], records["classes"], {})) == []
+
+
+def test_compute_and_summarize():
+    users = {1: {"projectStatus": "Admin"}, 2: {}, 3: {"projectStatus": "Member"}}
+    classes = {
+        "a": {"members": [1, 2], "join_requests": [3], "homework_updated_at": "2024-05-10T09:00:00"},
+        "b": {"members": [3], "join_requests": [], "homework_updated_at": "2024-05-01T09:00:00"},
+        "c": {"members": [], "homework_updated_at": None},
+    }
+    counters = stats.compute(users, classes, {"2024-05-10": 2, "2024-05-09": 0})
+    assert "active:2024-05-09" not in counters
+
+    days = stats.recent_days(3, today=date(2024, 5, 10))
+    assert days == ["2024-05-10", "2024-05-09", "2024-05-08"]
+    assert set(stats.keys_for(days)) >= {"users", "homework_never", "active:2024-05-08", "homework_day:2024-05-10"}
+    assert stats.summarize(counters, days) == {
+        "users": 3,
+        "users_by_status": {"Admin": 1, "Member": 2},
+        "classes": 3,
+        "members": 3,
+        "average_class_size": 1.0,
+        "class_sizes": {0: 1, 1: 1, 2: 1},
+        "join_requests": 1,
+        "homework": {"today": 1, "recent": 1, "older": 1, "never": 1},
+        "active_users": {"2024-05-10": 2, "2024-05-09": 0, "2024-05-08": 0},
+    }
+    assert stats.summarize({}, [])["average_class_size"] == 0
+
+
+def test_diff():
+    assert stats.diff({"users": 2, "classes": 0}, {"users": 2}) == []
+    assert stats.diff({"users": 3}, {"users": 2, "classes": 1}) == [
+        "Статистика classes: 0, по данным 1", "Статистика users: 3, по данным 2"]
@@ -0,0 +1,50 @@
+"""Разбор пользовательского ввода"""
+from datetime import datetime
+
+import pytest
+
+from config import HOMEWORK_DUE_TIME
+from utils import parse_due_date, parse_roster_csv
+
+NOW = datetime(2024, 5, 10, 12, 30)
+HOUR, MINUTE = map(int, HOMEWORK_DUE_TIME.split(":"))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("20.05", datetime(2024, 5, 20, HOUR, MINUTE)),
+    (" 1.6 ", datetime(2024, 6, 1, HOUR, MINUTE)),
+    ("20.05 18:45", datetime(2024, 5, 20, 18, 45)),
+    ("20.05.2025", datetime(2025, 5, 20, HOUR, MINUTE)),
+    ("20.05.25 9:05", datetime(2025, 5, 20, 9, 5)),
+    # Без года - ближайшая такая дата
+    ("01.02", datetime(2025, 2, 1, HOUR, MINUTE)),
+    ("10.05 12:00", datetime(2025, 5, 10, 12, 0)),
+    ("10.05 13:00", datetime(2024, 5, 10, 13, 0)),
+])
+def test_parse_due_date(text, expected):
+    assert parse_due_date(text, now=NOW) == expected
+
+
+@pytest.mark.parametrize("text", ["", "завтра", "32.05", "20.13", "20.05 25:00", "20/05", "20.05.202"])
+def test_parse_due_date_rejects(text):
+    assert parse_due_date(text, now=NOW) is None
+
+
+def test_parse_roster_csv():
+    text = "user_id,name,role\n101,Аня,Староста\n102, Боря ,\n\n103,Вера\n"
+    assert parse_roster_csv(text) == ([(101, "Аня", "староста"), (102, "Боря", "участник"),
+                                       (103, "Вера", "участник")], [])
+
+
+def test_parse_roster_csv_semicolon_without_header():
+    text = "101;Иванов, Аня;помощник старосты\n102;Петров, Боря"
+    assert parse_roster_csv(text) == ([(101, "Иванов, Аня", "помощник старосты"),
+                                       (102, "Петров, Боря", "участник")], [])
+
+
+def test_parse_roster_csv_errors():
+    text = "101,Аня\nабв,Боря\n102,\n103,Вера,директор\n104"
+    rows, errors = parse_roster_csv(text)
+    assert rows == [(101, "Аня", "участник")]
+    assert errors == ["Строка 2: нужны user_id и имя", "Строка 3: нужны user_id и имя",
+                      "Строка 4: неизвестная роль 'директор'", "Строка 5: нужны user_id и имя"]
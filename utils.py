@@ -1,9 +1,16 @@
-from typing import Dict, Any
+import csv
+import io
+import re
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from config import TEAM_ROLES, HOMEWORK_DUE_TIME
 from database import db
 
-def has_permission(user_id: int, required_status: str = None, required_team_role: str = None) -> bool:
-    """Проверка прав пользователя"""
-    user = db.get_user(user_id)
+async def has_permission(user_id: int, required_status: str = None, required_team_role: str = None,
+                         user: Dict = None) -> bool:
+    """Проверка прав пользователя (user - уже загруженная запись, если есть)"""
+    if user is None:
+        user = await db.get_user(user_id)
     if not user:
         return False
     
@@ -23,9 +30,10 @@ def has_permission(user_id: int, required_status: str = None, required_team_role
     
     return True
 
-def can_edit_class(user_id: int, class_id: str) -> bool:
+async def can_edit_class(user_id: int, class_id: str, user: Dict = None) -> bool:
     """Может ли пользователь редактировать класс"""
-    user = db.get_user(user_id)
+    if user is None:
+        user = await db.get_user(user_id)
     if not user:
         return False
     
@@ -41,9 +49,10 @@ def can_edit_class(user_id: int, class_id: str) -> bool:
     user_role = user.get("teamRole")
     return user_role in ["староста", "помощник старосты"]
 
-def can_manage_roles(user_id: int, class_id: str) -> bool:
+async def can_manage_roles(user_id: int, class_id: str, user: Dict = None) -> bool:
     """Может ли пользователь управлять ролями в классе"""
-    user = db.get_user(user_id)
+    if user is None:
+        user = await db.get_user(user_id)
     if not user:
         return False
     
@@ -58,18 +67,101 @@ def can_manage_roles(user_id: int, class_id: str) -> bool:
     
     return user.get("teamRole") == "староста"
 
-def format_homework(homework_dict: Dict) -> str:
-    """Форматирование ДЗ для отображения"""
+def format_homework(homework_dict: Dict, meta: Dict = None) -> str:
+    """Форматирование ДЗ для отображения (meta - сроки и вложения по предметам)"""
     if not homework_dict:
         return "ДЗ не задано"
     
+    meta = meta or {}
     result = []
     for subject, hw in homework_dict.items():
-        result.append(f"📘 <b>{subject}:</b>\n{hw}")
+        text = f"📘 <b>{subject}:</b>\n{hw}"
+        details = meta.get(subject, {})
+        if details.get("due"):
+            text += f"\n⏰ Сдать до {format_due(details['due'])}"
+        if details.get("attachments"):
+            text += f"\n📎 Вложений: {len(details['attachments'])}"
+        result.append(text)
     
     return "\n\n".join(result)
 
-def format_user_profile(user_data: Dict) -> str:
+def parse_due_date(text: str, now: datetime = None) -> Optional[datetime]:
+    """Срок сдачи из «ДД.ММ», «ДД.ММ.ГГГГ» и необязательного «ЧЧ:ММ».
+
+    Без времени срок - HOMEWORK_DUE_TIME, без года - ближайшая такая дата.
+    """
+    match = re.fullmatch(r"(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?(?:\s+(\d{1,2}):(\d{2}))?", text.strip())
+    if not match:
+        return None
+    now = now or datetime.now()
+    day, month, year, hour, minute = match.groups()
+    if hour is None:
+        hour, minute = HOMEWORK_DUE_TIME.split(":")
+    try:
+        due = datetime(int(year) if year else now.year, int(month), int(day), int(hour), int(minute))
+        if year and len(year) == 2:
+            due = due.replace(year=2000 + int(year))
+        if not year and due < now:
+            due = due.replace(year=now.year + 1)
+    except ValueError:
+        return None
+    return due
+
+def format_due(due: str) -> str:
+    return datetime.fromisoformat(due).strftime("%d.%m.%Y %H:%M")
+
+def render_class_homework(class_data: Dict) -> str:
+    """ДЗ класса для отображения, кэшируется хранилищем до следующего изменения ДЗ"""
+    cache = db.homework_render_cache
+    version = class_data.get("homework_version", 0)
+    text = cache.get(class_data["id"], version)
+    if text is None:
+        text = format_homework(class_data.get("homework", {}), class_data.get("homework_meta"))
+        cache.put(class_data["id"], version, text)
+    return text
+
+def format_search_results(results: List[Dict], limit: int = 200) -> str:
+    """Результаты поиска по ДЗ: предмет, откуда ДЗ и начало текста"""
+    if not results:
+        return "🔎 Ничего не найдено"
+    
+    result = []
+    for found in results:
+        title = f"📘 <b>{found['subject']}</b>"
+        if found["scope"] == "user":
+            title += " (личное)"
+        if found["archived_at"]:
+            title += f" - архив от {format_due(found['archived_at'])}"
+        text = found["text"] if len(found["text"]) <= limit else found["text"][:limit].rstrip() + "…"
+        result.append(f"{title}\n{text}")
+    
+    return "🔎 <b>Найдено:</b>\n\n" + "\n\n".join(result)
+
+def format_stats(stats: Dict) -> str:
+    """Сводка db.get_stats() для админ-панели"""
+    statuses = ", ".join(f"{status}: {count}" for status, count in sorted(stats["users_by_status"].items()))
+    sizes = ", ".join(f"{size} уч. — {count}" for size, count in stats["class_sizes"].items())
+    homework = stats["homework"]
+    days = len(stats["active_users"])
+
+    text = "📊 <b>Статистика</b>\n\n"
+    text += f"👤 <b>Пользователей:</b> {stats['users']}"
+    text += f" ({statuses})\n" if statuses else "\n"
+    text += f"🏫 <b>Классов:</b> {stats['classes']}, участников: {stats['members']}, "
+    text += f"в среднем {stats['average_class_size']}\n"
+    if sizes:
+        text += f"📏 <b>Размеры классов:</b> {sizes}\n"
+    text += f"📨 <b>Заявок ждут ответа:</b> {stats['join_requests']}\n\n"
+    text += "📝 <b>ДЗ классов обновлялось:</b>\n"
+    text += f"сегодня — {homework['today']}, за {days} дн. — {homework['recent']}, "
+    text += f"раньше — {homework['older']}, ни разу — {homework['never']}\n\n"
+    text += "📅 <b>Активные пользователи:</b>\n"
+    for day, count in stats["active_users"].items():
+        text += f"{datetime.fromisoformat(day).strftime('%d.%m')} — {count}\n"
+
+    return text
+
+async def format_user_profile(user_data: Dict, class_data: Dict = None) -> str:
     """Форматирование профиля пользователя"""
     profile = user_data.get("profile", {})
     
@@ -83,8 +175,34 @@ def format_user_profile(user_data: Dict) -> str:
     text += f"👥 <b>Роль в классе:</b> {user_data.get('teamRole', 'Не состоит в классе')}\n"
     
     if user_data.get("class_id"):
-        class_data = db.get_class(user_data["class_id"])
+        if class_data is None:
+            class_data = await db.get_class(user_data["class_id"])
         if class_data:
             text += f"🏫 <b>Класс:</b> {class_data.get('name', 'Неизвестно')}\n"
     
-    return text
\ No newline at end of file
+    return text
+
+def parse_roster_csv(text: str) -> Tuple[List[Tuple[int, str, str]], List[str]]:
+    """Разбор CSV со списком класса: user_id, имя[, роль].
+
+    Разделитель - запятая или точка с запятой, строка заголовка
+    пропускается. Возвращает строки (user_id, имя, роль) и ошибки.
+    """
+    first_line = text.lstrip().split("\n", 1)[0]
+    delimiter = ";" if first_line.count(";") >= first_line.count(",") and ";" in first_line else ","
+    rows, errors = [], []
+    for number, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if number == 1 and not cells[0].isdigit():
+            continue
+        if len(cells) < 2 or not cells[0].isdigit() or not cells[1]:
+            errors.append(f"Строка {number}: нужны user_id и имя")
+            continue
+        role = cells[2].lower() if len(cells) > 2 and cells[2] else "участник"
+        if role not in TEAM_ROLES:
+            errors.append(f"Строка {number}: неизвестная роль '{cells[2]}'")
+            continue
+        rows.append((int(cells[0]), cells[1], role))
+    return rows, errors
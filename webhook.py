@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from aiohttp import web
+from aiohttp.log import access_logger
+from aiogram import Bot, Dispatcher, types
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_SECRET,
+                    WEBHOOK_WORKERS, WEBHOOK_MAX_PENDING, WEBHOOK_BACKPRESSURE, WEBHOOK_STOP_TIMEOUT, WORKERS)
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: types.Update) -> Optional[int]:
+    """Чат, к которому относится апдейт (для сохранения порядка)"""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    return None
+
+
+class WebhookServer:
+    """Приём апдейтов по webhook и их параллельная обработка.
+
+    Апдейты разных чатов обрабатываются одновременно пулом из workers
+    задач, апдейты одного чата - строго по очереди. Одновременно в работе
+    не больше max_pending апдейтов; при заполнении очереди запрос либо
+    ждёт свободного места (backpressure="wait", Telegram придержит
+    следующие апдейты), либо сразу получает 503 (backpressure="reject").
+    """
+
+    def __init__(self, dispatcher: Dispatcher, workers: int = WEBHOOK_WORKERS,
+                 max_pending: int = WEBHOOK_MAX_PENDING, backpressure: str = WEBHOOK_BACKPRESSURE,
+                 secret: Optional[str] = WEBHOOK_SECRET):
+        if backpressure not in ("wait", "reject"):
+            raise ValueError(f"Unknown backpressure mode: {backpressure}")
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.max_pending = max_pending
+        self.backpressure = backpressure
+        self.secret = secret
+        self.processed = 0
+        self.rejected = 0
+        # Время от приёма до конца обработки последних апдейтов, сек
+        self.latencies: Deque[float] = deque(maxlen=100000)
+
+        self._chats: Dict[object, Deque] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = []
+        # Принятые и ещё не обработанные апдейты; _idle выставлен, когда их нет
+        self._pending = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    # === Очередь ===
+    async def start(self):
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = WEBHOOK_STOP_TIMEOUT):
+        """Дообработать принятые апдейты (не дольше timeout сек) и остановить пул"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping webhook workers with %d updates still pending", self._pending)
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def submit(self, update: types.Update) -> bool:
+        """Поставить апдейт в очередь; False - очередь заполнена (режим reject)"""
+        if self.backpressure == "reject" and self._slots.locked():
+            self.rejected += 1
+            return False
+        await self._slots.acquire()
+        self._pending += 1
+        self._idle.clear()
+        # Апдейты без чата не требуют порядка и идут в отдельную очередь
+        key = update_chat_id(update)
+        if key is None:
+            key = ("update", update.update_id)
+        queue = self._chats.get(key)
+        if queue is None:
+            self._chats[key] = deque([(update, time.perf_counter())])
+            self._ready.put_nowait(key)
+        else:
+            queue.append((update, time.perf_counter()))
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._chats[key]
+            update, received = queue[0]
+            try:
+                # Отдельная задача - отдельный контекст (состояние FSM, текущий апдейт)
+                await asyncio.ensure_future(self.dispatcher.updates_handler.notify(update))
+            except Exception:
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                self.processed += 1
+                self.latencies.append(time.perf_counter() - received)
+                queue.popleft()
+                self._slots.release()
+                self._pending -= 1
+                if not self._pending:
+                    self._idle.set()
+                # Чат с очередью встаёт в конец, чтобы не занимать worker надолго
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+    # === HTTP ===
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        update = types.Update(**(await request.json()))
+        if not await self.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    def make_app(self, path: str = WEBHOOK_PATH) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        return app
+
+
+def run_webhook(bot: Bot, dp: Dispatcher, bot_on_shutdown=None, bot_on_startup=None):
+    """Запустить HTTP-сервер и зарегистрировать webhook в Telegram"""
+    server = WebhookServer(dp)
+    app = server.make_app()
+
+    async def on_startup(app: web.Application):
+        Bot.set_current(bot)
+        Dispatcher.set_current(dp)
+        await server.start()
+        if bot_on_startup is not None:
+            await bot_on_startup(dp)
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+
+    async def on_shutdown(app: web.Application):
+        await server.stop()
+        if bot_on_shutdown is not None:
+            await bot_on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    # За supervisor (workers.py) каждый запрос - пересланный апдейт, журнал не нужен
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, access_log=None if WORKERS > 1 else access_logger)
+
+
+if __name__ == '__main__':
+    from bot import bot, dp, on_shutdown, on_startup
+
+    run_webhook(bot, dp, on_shutdown, on_startup)
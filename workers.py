@@ -0,0 +1,298 @@
+"""Несколько процессов-обработчиков за одной точкой входа.
+
+    WORKERS=4 STORAGE_BACKEND=sqlite python workers.py
+
+Supervisor запускает WORKERS процессов webhook.py на 127.0.0.1:WORKER_BASE_PORT+i
+и принимает апдейты сам: по webhook, если задан WEBHOOK_URL, иначе long
+polling. Каждый апдейт пересылается процессу, которому его чат
+принадлежит по консистентному хешированию (HashRing), поэтому апдейты
+одного чата и его состояние FSM всегда в одном процессе, а при изменении
+числа процессов переезжает только часть чатов.
+
+Процессы делят SQLite-хранилище (WAL; транзакции записи - BEGIN
+IMMEDIATE), FSM и таблицу напоминаний (сработавший таймер забирает один
+процесс). JSON-хранилище живёт в памяти одного процесса и не подходит.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiohttp import web
+
+from config import (BOT_TOKEN, STORAGE_BACKEND, WORKERS, WORKER_BASE_PORT, TELEGRAM_API_SERVER, WEBHOOK_URL,
+                    WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT)
+from webhook import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Точек на кольце у одного процесса: чем больше, тем ровнее делятся чаты
+RING_REPLICAS = 160
+# Ожидание запуска процесса, пауза перед перезапуском и между попытками пересылки, сек
+START_TIMEOUT = 60
+RESTART_DELAY = 1.0
+RETRY_DELAY = 1.0
+# Попытки переслать апдейт, полученный long polling (webhook повторит сам Telegram)
+POLL_ATTEMPTS = 30
+POLL_TIMEOUT = 20
+
+
+def _hash(value: str) -> int:
+    # hash() строк меняется между запусками, кольцо должно быть одинаковым всегда
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентное хеширование ключей по узлам.
+
+    Каждый узел занимает replicas точек на кольце, ключ принадлежит
+    узлу ближайшей следующей точки. Когда узел добавляется или убирается,
+    переезжают только ключи его точек - примерно 1/N всех.
+    """
+
+    def __init__(self, nodes: Iterable[int], replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError("HashRing needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key) -> int:
+        position = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._nodes[position % len(self._nodes)]
+
+
+class Ingress:
+    """Пересылка апдейтов процессу, которому принадлежит их чат.
+
+    Апдейты одного чата пересылаются по очереди, поэтому процесс получает
+    их в порядке приёма. Апдейты без чата раскладываются по update_id.
+    """
+
+    def __init__(self, urls: List[str], secret: str):
+        self.urls = urls
+        self.secret = secret
+        self.ring = HashRing(range(len(urls)))
+        self.forwarded = [0] * len(urls)
+        self.failed = 0
+        self._tails: Dict[int, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        # Соединения считаются по каждому процессу: занятый процесс не держит остальных
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=100),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, worker: int, data: Dict) -> bool:
+        try:
+            async with self._session.post(self.urls[worker], json=data,
+                                          headers={"X-Telegram-Bot-Api-Secret-Token": self.secret}) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Worker %d is unavailable: %r", worker, e)
+            return False
+
+    async def _send(self, worker: int, data: Dict, attempts: int) -> bool:
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY)
+            if await self._post(worker, data):
+                self.forwarded[worker] += 1
+                return True
+        self.failed += 1
+        return False
+
+    async def forward(self, data: Dict, attempts: int = 1) -> bool:
+        """Переслать апдейт (словарь из Bot API); False - процесс его не принял"""
+        update = types.Update(**data)
+        chat_id = update_chat_id(update)
+        worker = self.ring.node(chat_id if chat_id is not None else update.update_id)
+        if chat_id is None:
+            return await self._send(worker, data, attempts)
+
+        done = asyncio.get_running_loop().create_future()
+        previous, self._tails[chat_id] = self._tails.get(chat_id), done
+        try:
+            if previous is not None:
+                await previous
+            return await self._send(worker, data, attempts)
+        finally:
+            done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        # 503 - Telegram повторит апдейт позже
+        return web.Response() if await self.forward(await request.json()) else web.Response(status=503)
+
+    async def poll(self, bot: Bot):
+        """Long polling: пачка апдейтов пересылается целиком до запроса следующей"""
+        # Как executor.start_polling(skip_updates=True)
+        await bot.delete_webhook()
+        skipped = await bot.get_updates(offset=-1, timeout=1)
+        offset = skipped[-1].update_id + 1 if skipped else None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to get updates")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            if not updates:
+                continue
+            offset = updates[-1].update_id + 1
+            results = await asyncio.gather(*(self.forward(update.to_python(), POLL_ATTEMPTS) for update in updates))
+            for update, delivered in zip(updates, results):
+                if not delivered:
+                    logger.error("Dropped update %s: worker is unavailable", update.update_id)
+
+
+class Supervisor:
+    """Запускает процессы-обработчики (webhook.py) и перезапускает упавшие"""
+
+    def __init__(self, workers: int = WORKERS, base_port: int = WORKER_BASE_PORT, env: Optional[Dict] = None):
+        self.workers = workers
+        self.base_port = base_port
+        self.env = env or {}
+        self.secret = secrets.token_urlsafe(32)
+        self.urls = [f"http://127.0.0.1:{base_port + index}{WEBHOOK_PATH}" for index in range(workers)]
+        self.restarts = 0
+        self._processes: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self._watchers: List[asyncio.Task] = []
+        self._stopping = False
+
+    def _worker_env(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ, **self.env, WORKERS=str(self.workers), WORKER_INDEX=str(index),
+                   WEBAPP_HOST="127.0.0.1", WEBAPP_PORT=str(self.base_port + index), WEBHOOK_SECRET=self.secret)
+        # webhook в Telegram регистрирует только supervisor
+        env.pop("WEBHOOK_URL", None)
+        return env
+
+    async def _spawn(self, index: int):
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "webhook.py"),
+                                                       env=self._worker_env(index), cwd=ROOT)
+        self._processes[index] = process
+        deadline = asyncio.get_running_loop().time() + START_TIMEOUT
+        while True:
+            if process.returncode is not None:
+                raise RuntimeError(f"Worker {index} exited with code {process.returncode} on start")
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.base_port + index)
+            except OSError:
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"Worker {index} did not start in {START_TIMEOUT}s")
+                await asyncio.sleep(0.1)
+                continue
+            writer.close()
+            return
+
+    async def _watch(self, index: int):
+        while True:
+            code = await self._processes[index].wait()
+            if self._stopping:
+                return
+            logger.error("Worker %d exited with code %s, restarting", index, code)
+            self.restarts += 1
+            await asyncio.sleep(RESTART_DELAY)
+            try:
+                await self._spawn(index)
+            except RuntimeError:
+                logger.exception("Failed to restart worker %d", index)
+
+    async def start(self):
+        await asyncio.gather(*(self._spawn(index) for index in range(self.workers)))
+        self._watchers = [asyncio.ensure_future(self._watch(index)) for index in range(self.workers)]
+        logger.info("Started %d workers on ports %d-%d", self.workers, self.base_port,
+                    self.base_port + self.workers - 1)
+
+    async def stop(self):
+        """Остановить процессы (SIGTERM): они дообрабатывают принятые апдейты"""
+        self._stopping = True
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    pass
+        await asyncio.gather(*(process.wait() for process in self._processes if process is not None))
+        for watcher in self._watchers:
+            watcher.cancel()
+        self._watchers = []
+
+
+def _make_bot() -> Bot:
+    return Bot(BOT_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)
+               if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION)
+
+
+async def _run_polling(supervisor: Supervisor, ingress: Ingress):
+    bot = _make_bot()
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    await supervisor.start()
+    await ingress.start()
+    try:
+        await ingress.poll(bot)
+    finally:
+        await ingress.close()
+        await supervisor.stop()
+        await (await bot.get_session()).close()
+
+
+def run_webhook_ingress(supervisor: Supervisor, ingress: Ingress):
+    bot = _make_bot()
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, ingress.handle)
+
+    async def on_startup(app: web.Application):
+        await supervisor.start()
+        await ingress.start()
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+
+    async def on_shutdown(app: web.Application):
+        await ingress.close()
+        await supervisor.stop()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT)
+
+
+def run_supervisor(workers: int = WORKERS):
+    if STORAGE_BACKEND != "sqlite":
+        raise SystemExit("Several workers need STORAGE_BACKEND=sqlite")
+    supervisor = Supervisor(workers)
+    ingress = Ingress(supervisor.urls, supervisor.secret)
+    if WEBHOOK_URL:
+        run_webhook_ingress(supervisor, ingress)
+        return
+    try:
+        asyncio.run(_run_polling(supervisor, ingress))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run_supervisor()